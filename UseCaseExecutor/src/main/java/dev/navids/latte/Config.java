@@ -20,6 +20,7 @@ public class Config {
     public final String ATF_ISSUES_FILE_PATH = "aft_a11y_issues.jsonl";
     public final String TB_FOCUSABLE_NODES_FILE_PATH = "tb_focusables.jsonl";
     public final String IS_LIVE_FILE_PATH_PATTERN = "is_live_%s.txt";
+    public final int CHANNEL_PORT = 8712;
     public final long GESTURE_DURATION = 200;
     public final long FOCUS_CHANGE_TIME = 100;
     public final long GESTURE_FINISH_WAIT_TIME = GESTURE_DURATION + FOCUS_CHANGE_TIME;
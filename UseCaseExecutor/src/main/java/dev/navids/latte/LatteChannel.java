@@ -0,0 +1,279 @@
+package dev.navids.latte;
+
+import android.os.Handler;
+import android.os.Looper;
+import android.util.Log;
+
+import java.io.BufferedInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.List;
+import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+
+/**
+ * A TCP server on the device (reachable from the host by `adb forward` or the `tcp:` service of adb) which receives
+ * the commands of Latte and pushes the result files to the clients as soon as they are written, so the clients do
+ * not need to send broadcasts or poll the files. The requests are
+ *  - "HELLO", answered by a "HELLO <version>" line.
+ *  - "WAIT <request_id> <file_name> <remove|keep>", the content of the file is sent once it's written (or right
+ *    away if it exists) as a "RESULT <request_id> <length>" line followed by the content.
+ *  - "CANCEL <request_id>", cancels a WAIT request, or a COMMAND request which is not executed yet (no DONE is sent).
+ *  - "COMMAND <request_id> <command_length> <extra_length>" followed by the command and its extra, the commands are
+ *    executed in the main thread in the order they are received, then a "DONE <request_id> <length>" line followed
+ *    by the status (OK or FAILED) is sent. The clients can send several commands without waiting for the responses.
+ * The lengths are in bytes, and the texts are encoded in UTF-8.
+ */
+public class LatteChannel {
+    public static final String TAG = LatteService.TAG + "_CHANNEL";
+    public static final int VERSION = 2;
+    private static LatteChannel instance;
+
+    private LatteChannel() {
+    }
+
+    public static LatteChannel v() {
+        if (instance == null)
+            instance = new LatteChannel();
+        return instance;
+    }
+
+    private static class Waiter {
+        final Client client;
+        final long requestId;
+        final boolean remove;
+
+        Waiter(Client client, long requestId, boolean remove) {
+            this.client = client;
+            this.requestId = requestId;
+            this.remove = remove;
+        }
+    }
+
+    private class Client implements Runnable {
+        final Socket socket;
+        // The responses are written in a separate thread since the files are usually created in the main thread
+        final ExecutorService writer = Executors.newSingleThreadExecutor();
+        // The ids of the received commands which are not executed or cancelled yet (guarded by the channel)
+        final Set<Long> pendingCommands = new HashSet<>();
+
+        Client(Socket socket) {
+            this.socket = socket;
+        }
+
+        void send(String header, byte[] content) {
+            writer.execute(() -> {
+                try {
+                    OutputStream outputStream = socket.getOutputStream();
+                    outputStream.write((header + "\n").getBytes(StandardCharsets.UTF_8));
+                    if (content != null)
+                        outputStream.write(content);
+                    outputStream.flush();
+                } catch (IOException e) {
+                    Log.e(TAG, "Error in sending " + header + ": " + e.getMessage());
+                    close();
+                }
+            });
+        }
+
+        void close() {
+            try {
+                socket.close();
+            } catch (IOException ignored) {
+            }
+        }
+
+        @Override
+        public void run() {
+            try {
+                DataInputStream inputStream = new DataInputStream(new BufferedInputStream(socket.getInputStream()));
+                String line;
+                while ((line = readLine(inputStream)) != null) {
+                    if (line.startsWith("COMMAND "))
+                        handleCommand(this, line, inputStream);
+                    else
+                        handleRequest(this, line);
+                }
+            } catch (IOException e) {
+                Log.i(TAG, "The client is disconnected: " + e.getMessage());
+            } finally {
+                removeClient(this);
+                close();
+                writer.shutdown();
+            }
+        }
+    }
+
+    private static String readLine(InputStream inputStream) throws IOException {
+        ByteArrayOutputStream line = new ByteArrayOutputStream();
+        int b;
+        while ((b = inputStream.read()) != -1 && b != '\n')
+            line.write(b);
+        if (b == -1 && line.size() == 0)
+            return null;
+        return new String(line.toByteArray(), StandardCharsets.UTF_8);
+    }
+
+    private final Handler mainHandler = new Handler(Looper.getMainLooper());
+    private ServerSocket serverSocket = null;
+    private final Set<Client> clients = new HashSet<>();
+    private final Map<String, List<Waiter>> waitersMap = new HashMap<>();
+
+    public synchronized void start(int port) {
+        if (serverSocket != null)
+            return;
+        try {
+            serverSocket = new ServerSocket(port, 50, InetAddress.getLoopbackAddress());
+        } catch (IOException e) {
+            Log.e(TAG, "The channel could not be started on port " + port + ": " + e.getMessage());
+            return;
+        }
+        ServerSocket server = serverSocket;
+        new Thread(() -> {
+            Log.i(TAG, "The channel is listening on port " + port);
+            while (!server.isClosed()) {
+                try {
+                    Client client = new Client(server.accept());
+                    synchronized (this) {
+                        clients.add(client);
+                    }
+                    new Thread(client, "LatteChannelClient").start();
+                } catch (IOException e) {
+                    if (!server.isClosed())
+                        Log.e(TAG, "Error in accepting a client: " + e.getMessage());
+                }
+            }
+        }, "LatteChannel").start();
+    }
+
+    public synchronized void stop() {
+        if (serverSocket == null)
+            return;
+        try {
+            serverSocket.close();
+        } catch (IOException ignored) {
+        }
+        serverSocket = null;
+        for (Client client : new ArrayList<>(clients))
+            client.close();
+        clients.clear();
+        waitersMap.clear();
+    }
+
+    /**
+     * Should be called after the file is written (while holding the lock of the channel), sends the content to the
+     * waiting clients and removes the file if one of them asked so.
+     */
+    public synchronized void publish(String fileName, String content) {
+        List<Waiter> waiters = waitersMap.remove(fileName);
+        if (waiters == null)
+            return;
+        byte[] contentBytes = content.getBytes(StandardCharsets.UTF_8);
+        boolean remove = false;
+        for (Waiter waiter : waiters) {
+            waiter.client.send("RESULT " + waiter.requestId + " " + contentBytes.length, contentBytes);
+            remove |= waiter.remove;
+        }
+        if (remove)
+            Utils.deleteFile(fileName);
+    }
+
+    private synchronized void handleRequest(Client client, String line) {
+        String[] parts = line.trim().split(" ");
+        try {
+            switch (parts[0]) {
+                case "HELLO":
+                    client.send("HELLO " + VERSION, null);
+                    break;
+                case "WAIT":
+                    waitForFile(client, Long.parseLong(parts[1]), parts[2], parts[3].equals("remove"));
+                    break;
+                case "CANCEL":
+                    cancel(client, Long.parseLong(parts[1]));
+                    break;
+                default:
+                    Log.e(TAG, "Unknown request: " + line);
+            }
+        } catch (IndexOutOfBoundsException | NumberFormatException e) {
+            Log.e(TAG, "Malformed request: " + line);
+        }
+    }
+
+    // The payload is read without holding the lock, so the files can be written in the meantime
+    private void handleCommand(Client client, String line, DataInputStream inputStream) throws IOException {
+        String[] parts = line.trim().split(" ");
+        long requestId;
+        byte[] commandBytes, extraBytes;
+        try {
+            requestId = Long.parseLong(parts[1]);
+            commandBytes = new byte[Integer.parseInt(parts[2])];
+            extraBytes = new byte[Integer.parseInt(parts[3])];
+        } catch (IndexOutOfBoundsException | NumberFormatException e) {
+            // The rest of the stream cannot be parsed
+            throw new IOException("Malformed command: " + line);
+        }
+        inputStream.readFully(commandBytes);
+        inputStream.readFully(extraBytes);
+        String command = new String(commandBytes, StandardCharsets.UTF_8);
+        String extra = new String(extraBytes, StandardCharsets.UTF_8);
+        synchronized (this) {
+            client.pendingCommands.add(requestId);
+        }
+        mainHandler.post(() -> {
+            synchronized (this) {
+                if (!client.pendingCommands.remove(requestId))
+                    return;
+            }
+            MessageReceiver receiver = LatteService.getInstance().receiver;
+            boolean successful = receiver != null && receiver.executeCommand(command, extra);
+            byte[] status = (successful ? "OK" : "FAILED").getBytes(StandardCharsets.UTF_8);
+            client.send("DONE " + requestId + " " + status.length, status);
+        });
+    }
+
+    private void waitForFile(Client client, long requestId, String fileName, boolean remove) {
+        String dir = LatteService.getInstance().getBaseContext().getFilesDir().getPath();
+        File file = new File(dir, fileName);
+        if (file.exists()) {
+            try {
+                byte[] content = Files.readAllBytes(file.toPath());
+                client.send("RESULT " + requestId + " " + content.length, content);
+                if (remove)
+                    file.delete();
+                return;
+            } catch (IOException e) {
+                Log.e(TAG, "Error in reading " + fileName + ": " + e.getMessage());
+            }
+        }
+        waitersMap.computeIfAbsent(fileName, k -> new ArrayList<>()).add(new Waiter(client, requestId, remove));
+    }
+
+    private void cancel(Client client, long requestId) {
+        client.pendingCommands.remove(requestId);
+        for (List<Waiter> waiters : waitersMap.values())
+            waiters.removeIf(waiter -> waiter.client == client && waiter.requestId == requestId);
+        waitersMap.values().removeIf(List::isEmpty);
+    }
+
+    private synchronized void removeClient(Client client) {
+        clients.remove(client);
+        client.pendingCommands.clear();
+        for (List<Waiter> waiters : waitersMap.values())
+            waiters.removeIf(waiter -> waiter.client == client);
+        waitersMap.values().removeIf(List::isEmpty);
+    }
+}
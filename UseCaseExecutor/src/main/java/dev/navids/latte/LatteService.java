@@ -111,11 +111,13 @@ public class LatteService extends AccessibilityService {
         addController("tb_api", new Controller(new TalkBackAPILocator(), new TalkBackActionPerformer()));
         addController("tb_touch", new Controller(new TalkBackTouchLocator(), new TalkBackActionPerformer()));
         selectedController = getController("touch");
+        LatteChannel.v().start(Config.v().CHANNEL_PORT);
     }
 
     @Override
     public void onDestroy() {
         connected = false;
+        LatteChannel.v().stop();
         unregisterReceiver(receiver);
         super.onDestroy();
     }
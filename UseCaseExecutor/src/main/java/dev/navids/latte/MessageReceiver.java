@@ -235,6 +235,11 @@ public class MessageReceiver extends BroadcastReceiver {
     public void onReceive(Context context, Intent intent) {
         String message = intent.getStringExtra(MESSAGE_CODE);
         String extra = intent.getStringExtra(MESSAGE_EXTRA_CODE);
+
+        if (message == null || extra == null) {
+            Log.e(LatteService.TAG, "The command or extra message is null!");
+            return;
+        }
         // De-sanitizing extra value ["\s\,]
         extra = extra.replace("__^__", "\"")
                 .replace("__^^__", " ")
@@ -246,12 +251,17 @@ public class MessageReceiver extends BroadcastReceiver {
                 .replace("__^-^^__", "*")
                 .replace("__^^_^__", "&")
                 .replace("__^^-^__", "[")
-                .replace("__^^^^^__", "]"); // TODO: Configurable
+                .replace("__^^^^^__", "]")
+                .replace("__^o^__", "(")
+                .replace("__^c^__", ")"); // TODO: Configurable
+        executeCommand(message, extra);
+    }
 
-        if (message == null || extra == null) {
-            Log.e(LatteService.TAG, "The command or extra message is null!");
-            return;
-        }
+    /**
+     * Executes the command (either received by a broadcast or the Latte channel) in the current thread, returns
+     * false if the command is unknown or failed.
+     */
+    public boolean executeCommand(String message, String extra) {
         Log.i(LatteService.TAG, String.format("The command %s received!", message + (extra.equals("NONE") ? "" : " - " + extra)));
         try {
             if (message.equals("sequence")) {
@@ -273,14 +283,18 @@ public class MessageReceiver extends BroadcastReceiver {
 
                 } catch (ParseException e) {
                     e.printStackTrace();
+                    return false;
                 }
             } else {
-                if (messageEventMap.containsKey(message))
-                    messageEventMap.get(message).doAction(extra);
+                if (!messageEventMap.containsKey(message))
+                    return false;
+                messageEventMap.get(message).doAction(extra);
             }
         }
         catch (Exception e){
             Log.e(LatteService.TAG, "Exception happens during command receiver execution", e);
+            return false;
         }
+        return true;
     }
 }
@@ -36,13 +36,18 @@ public class Utils {
         File file = new File(dir, fileName);
         Log.i(LatteService.TAG, "Output Path: " + file.getAbsolutePath());
         FileWriter myWriter = null;
-        try {
-            myWriter = new FileWriter(file);
-            myWriter.write(message);
-            myWriter.close();
-        } catch (IOException ex) {
-            ex.printStackTrace();
-            Log.e(LatteService.TAG + "_RESULT", "Error: " + ex.getMessage());
+        // The Latte channel should not read the file while it's being written
+        synchronized (LatteChannel.v()) {
+            try {
+                myWriter = new FileWriter(file);
+                myWriter.write(message);
+                myWriter.close();
+            } catch (IOException ex) {
+                ex.printStackTrace();
+                Log.e(LatteService.TAG + "_RESULT", "Error: " + ex.getMessage());
+                return;
+            }
+            LatteChannel.v().publish(fileName, message);
         }
     }
 
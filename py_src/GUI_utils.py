@@ -1,14 +1,24 @@
+import bisect
+import hashlib
+import io
 import logging
+import mmap
+import os
 import re
+import struct
+import threading
+import time
 import traceback
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict, deque
+from itertools import repeat
 from pathlib import Path
-from typing import Callable, List, Union, Tuple, Dict
+from typing import Callable, List, Union, Tuple, Dict, Sequence, Iterable
 import json
+import numpy as np
 from lxml import etree
 import xml.etree.ElementTree  # BlindSimmer
 
-from json_util import JSONSerializable
+from json_util import JSONSerializable, is_json_equal
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +44,170 @@ def calculate_overlap(bounds: Tuple[int, int, int, int],
     return None
 
 
+# Below this number of boxes, checking the boxes one by one is faster than vector operations
+VECTORIZED_OCCLUSION_THRESHOLD = 32
+# The maximum number of cells in the (children x drawn boxes) matrices of calculate_occlusion
+VECTORIZED_OCCLUSION_BLOCK_CELLS = 1 << 18
+
+
+def calculate_occlusion(covered_bounds: Sequence[Tuple[int, int, int, int]],
+                        children_bounds: Sequence[Tuple[int, int, int, int]]) \
+        -> Tuple[List[bool], List[Sequence[Tuple[int, int, int, int]]]]:
+    """
+    Simulates drawing a list of boxes (the children bounds, sorted by their drawing order) on top of already drawn
+    boxes (the covered bounds). A child is covered if one of the already drawn boxes or the boxes of prior children
+    completely includes it. Since inclusion is transitive, a prior child that is covered itself can be kept in the
+    drawn boxes without changing the result, so the whole sibling list can be processed with vector operations.
+
+    :param covered_bounds: The boxes that are drawn before the children, either a list or an (M x 4) array
+    :param children_bounds: The children boxes in the order of drawing
+    :return: For each child, whether it's covered, and the (non-empty) overlaps of the prior boxes with the child,
+            which are the covered bounds of the child's subtree. The overlaps of covered children are empty.
+    """
+    if len(covered_bounds) + len(children_bounds) <= VECTORIZED_OCCLUSION_THRESHOLD:
+        drawn_bounds = [tuple(bounds) for bounds in covered_bounds]
+        covered = []
+        overlaps = []
+        for child_bounds in children_bounds:
+            child_overlaps = []
+            child_covered = False
+            for bounds in drawn_bounds:
+                if bounds_included(bounds, child_bounds):
+                    child_covered = True
+                    child_overlaps = []
+                    break
+                overlap_bounds = calculate_overlap(bounds, child_bounds)
+                if overlap_bounds:
+                    child_overlaps.append(overlap_bounds)
+            covered.append(child_covered)
+            overlaps.append(child_overlaps)
+            drawn_bounds.append(child_bounds)
+        return covered, overlaps
+
+    covered_count = len(covered_bounds)
+    all_bounds = np.concatenate([np.array(covered_bounds, dtype=np.int64).reshape(-1, 4),
+                                 np.array(children_bounds, dtype=np.int64).reshape(-1, 4)])
+    covered = []
+    overlaps = []
+    # The children are processed in blocks to keep the (block x drawn boxes) matrices small
+    block_size = max(1, VECTORIZED_OCCLUSION_BLOCK_CELLS // len(all_bounds))
+    for start in range(covered_count, len(all_bounds), block_size):
+        end = min(start + block_size, len(all_bounds))
+        drawn_bounds = all_bounds[:end - 1]
+        block_bounds = all_bounds[start:end]
+        # Only the boxes drawn before each child are considered
+        prior = np.arange(end - 1)[np.newaxis, :] < np.arange(start, end)[:, np.newaxis]
+        x0 = np.maximum(drawn_bounds[np.newaxis, :, 0], block_bounds[:, np.newaxis, 0])
+        y0 = np.maximum(drawn_bounds[np.newaxis, :, 1], block_bounds[:, np.newaxis, 1])
+        x1 = np.minimum(drawn_bounds[np.newaxis, :, 2], block_bounds[:, np.newaxis, 2])
+        y1 = np.minimum(drawn_bounds[np.newaxis, :, 3], block_bounds[:, np.newaxis, 3])
+        # A child is included in a drawn box iff their overlap is the child itself
+        included = prior & \
+            (x0 == block_bounds[:, np.newaxis, 0]) & (y0 == block_bounds[:, np.newaxis, 1]) & \
+            (x1 == block_bounds[:, np.newaxis, 2]) & (y1 == block_bounds[:, np.newaxis, 3])
+        block_covered = included.any(axis=1)
+        non_empty = prior & ~block_covered[:, np.newaxis] & (x0 < x1) & (y0 < y1)
+        rows, columns = np.nonzero(non_empty)
+        block_overlaps = np.stack([x0[rows, columns], y0[rows, columns], x1[rows, columns], y1[rows, columns]],
+                                  axis=1)
+        split_indices = np.cumsum(np.bincount(rows, minlength=end - start))[:-1]
+        covered.extend(block_covered.tolist())
+        overlaps.extend(np.split(block_overlaps, split_indices))
+    return covered, overlaps
+
+
+_MISSING = object()
+_BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)]\[(-?\d+),(-?\d+)]")
+_BRACKET_BOUNDS_PATTERN = re.compile(r"\[-?\d+,-?\d+]\[-?\d+,-?\d+]")
+_SPACE_BOUNDS_PATTERN = re.compile(r"-?\d+\s-?\d+\s-?\d+\s-?\d")
+
+
+def _decode_int(value: Union[int, str]) -> int:
+    return int(value) if isinstance(value, str) else value
+
+
+def _decode_bool(value: Union[bool, str]) -> bool:
+    return value == 'true' if isinstance(value, str) else value
+
+
+def _decode_text(value: str) -> str:
+    return '' if value == 'null' else value
+
+
+def _decode_bounds(value: Union[Tuple[int, int, int, int], str]) -> Tuple[int, int, int, int]:
+    if isinstance(value, str):
+        match = _BOUNDS_PATTERN.fullmatch(value)
+        if match is not None:
+            return tuple([int(x) for x in match.groups()])
+        value = value.strip()
+        if _BRACKET_BOUNDS_PATTERN.search(value):
+            return tuple([int(x) for x in value.replace("][", ",")[1:-1].split(",")])
+        elif _SPACE_BOUNDS_PATTERN.search(value):
+            return tuple([int(x) for x in value.split()])
+        else:
+            raise Exception(f"Problem with bounds! {value}")
+    return value
+
+
+def _decode_a11y_actions(value: Union[List[int], str, None]) -> List[int]:
+    if value is None:
+        return []
+    elif isinstance(value, str):
+        return [] if len(value.strip()) == 0 else [int(x) for x in value.split("-")]
+    elif isinstance(value, list):
+        return [int(x) for x in value]
+    return value
+
+
+def _decode_xpath(value: str) -> str:
+    if value.startswith("/hierarchy"):
+        return value[len("/hierarchy"):]
+    return value
+
+
+_set_slot = object.__setattr__
+
+# The attributes that are never serialized
+NON_SERIALIZABLE_ATTRIBUTES = ['xml_element', 'parent_node', 'children_nodes', 'visible_descendant_count',
+                               'has_clickable_descendant', 'has_text_descendant']
+# The attributes that are ignored to determine two nodes are practically equal
+# TODO: not sure if it should be added or be configurable
+PRACTICALLY_EQUAL_EXCLUDED_ATTRIBUTES = ['focused', 'bounds', 'index', 'drawing_order', 'a11y_actions']
+# The attributes that are ignored to determine two layouts are in the same state
+SAME_STATE_EXCLUDED_ATTRIBUTES = ['xpath', 'naf', 'focused', 'bounds', 'index', 'drawing_order', 'a11y_actions',
+                                  'invalid']
+# The attributes that are ignored (in addition to SAME_STATE_EXCLUDED_ATTRIBUTES) to determine if two snapshots are
+# in the same state
+SNAPSHOT_STATE_EXCLUDED_ATTRIBUTES = ['checked', 'selected', 'text', 'content_desc', 'visible']
+
+
 class Node(JSONSerializable):
+    """
+    A GUI element. The attributes of the layout are decoded lazily, i.e., a Node keeps the raw attributes (an XML
+    element or a dict) and decodes all of them at the first access to any of them. Then the raw attributes are
+    released and the attributes are normal slots.
+    """
+    # The attributes which are decoded from the raw attributes
+    LAYOUT_ATTRIBUTES = ['index', 'class_name', 'text', 'resource_id', 'content_desc', 'visible', 'clickable',
+                         'long_clickable', 'checkable', 'checked', 'enabled', 'focusable', 'focused', 'invalid',
+                         'clickable_span', 'context_clickable', 'naf', 'important_for_accessibility', 'bounds',
+                         'drawing_order', 'a11y_actions', 'pkg_name', 'xpath']
+    # The attributes which are not in the layout
+    EXTRA_ATTRIBUTES = [
+        # --- Latte ----
+        # TODO: Move it to another class
+        'located_by', 'skip', 'action',
+        # --- Extra ----
+        'xml_element', 'parent_node', 'children_nodes', 'covered', 'is_ad',
+        # --- Subtree aggregates (NodesFactory.with_subtree_aggregation) ----
+        'visible_descendant_count', 'has_clickable_descendant', 'has_text_descendant']
+    ATTRIBUTES = LAYOUT_ATTRIBUTES + EXTRA_ATTRIBUTES
+    SERIALIZABLE_ATTRIBUTES = ATTRIBUTES
+    _LAYOUT_ATTRIBUTES_SET = frozenset(LAYOUT_ATTRIBUTES)
+    # The serialized attributes and their values in an empty Node, it's created at the first call of `is_none`
+    _none_items = None
+    __slots__ = ['_raw_attributes', '_fingerprints'] + ATTRIBUTES
+
     @staticmethod
     def createNodeFromDict(attributes: dict) -> 'Node':
         if attributes is None or len(attributes) == 0:
@@ -45,131 +218,153 @@ class Node(JSONSerializable):
     def createNodeFromXmlElement(element: Union[xml.etree.ElementTree.Element, etree.Element]) -> 'Node':
         if element is None:
             return Node()
-        node = Node(**element.attrib)
-        node.xml_element = element
+        node = Node.__new__(Node)
+        node._initialize(element)
+        _set_slot(node, 'xml_element', element)
         return node
 
-    def __init__(self,
-                 index: Union[int, str] = -1,
-                 text: str = "",
-                 class_name: str = "",
-                 resource_id: str = "",
-                 content_desc: str = "",
-                 visible: Union[bool, str] = True,
-                 clickable: Union[bool, str] = False,
-                 long_clickable: Union[bool, str] = False,
-                 checkable: Union[bool, str] = False,
-                 checked: Union[bool, str] = False,
-                 enabled: Union[bool, str] = False,
-                 focusable: Union[bool, str] = False,
-                 focused: Union[bool, str] = False,
-                 invalid: Union[bool, str] = False,
-                 clickable_span: Union[bool, str] = False,
-                 context_clickable: Union[bool, str] = False,
-                 naf: Union[bool, str] = False,
-                 important_for_accessibility: Union[bool, str] = False,
-                 bounds: Union[Tuple[int, int, int, int], str] = (0, 0, 0, 0),
-                 drawing_order: Union[int, str] = -1,
-                 a11y_actions: Union[List[int], str] = None,
-                 xpath: str = "",
-                 pkg_name: str = "",
-                 **kwargs):
-        class_name = kwargs.get('class', class_name)
-        resource_id = kwargs.get('resource-id', resource_id)
-        content_desc = kwargs.get('content-desc', content_desc)
-        pkg_name = kwargs.get('package', pkg_name)
-        clickable_span = kwargs.get('clickableSpan', clickable_span)
-        long_clickable = kwargs.get('long-clickable', long_clickable)
-        context_clickable = kwargs.get('contextClickable', context_clickable)
-        naf = kwargs.get('NAF', naf)
-        important_for_accessibility = kwargs.get('importantForAccessibility', important_for_accessibility)
-        a11y_actions = kwargs.get('actionList', a11y_actions)
-        drawing_order = kwargs.get('drawingOrder', drawing_order)
-
-        if isinstance(index, str):
-            index = int(index)
-        if isinstance(visible, str):
-            visible = visible == 'true'
-        if isinstance(clickable, str):
-            clickable = clickable == 'true'
-        if isinstance(long_clickable, str):
-            long_clickable = long_clickable == 'true'
-        if isinstance(checkable, str):
-            checkable = checkable == 'true'
-        if isinstance(checked, str):
-            checked = checked == 'true'
-        if isinstance(enabled, str):
-            enabled = enabled == 'true'
-        if isinstance(focusable, str):
-            focusable = focusable == 'true'
-        if isinstance(focused, str):
-            focused = focused == 'true'
-        if isinstance(invalid, str):
-            invalid = invalid == 'true'
-        if isinstance(clickable_span, str):
-            clickable_span = clickable_span == 'true'
-        if isinstance(context_clickable, str):
-            context_clickable = context_clickable == 'true'
-        if isinstance(naf, str):
-            naf = naf == 'true'
-        if isinstance(important_for_accessibility, str):
-            important_for_accessibility = important_for_accessibility == 'true'
-        if isinstance(bounds, str):
-            bounds = bounds.strip()
-            if re.search(r"\[-?\d+,-?\d+]\[-?\d+,-?\d+]", bounds):
-                bounds = tuple([int(x) for x in bounds.replace("][", ",")[1:-1].split(",")])
-            elif re.search(r"-?\d+\s-?\d+\s-?\d+\s-?\d", bounds):
-                bounds = tuple([int(x) for x in bounds.split()])
-            else:
-                raise Exception(f"Problem with bounds! {bounds}")
-
-        if isinstance(drawing_order, str):
-            drawing_order = int(drawing_order)
-        if a11y_actions is None:
-            a11y_actions = []
-        elif isinstance(a11y_actions, str):
-            a11y_actions = [] if len(a11y_actions.strip()) == 0 else [int(x) for x in a11y_actions.split("-")]
-        elif isinstance(a11y_actions, list):
-            a11y_actions = [int(x) for x in a11y_actions]
-        self.index = index
-        self.class_name = class_name
-        self.text = '' if text == 'null' else text
-        self.resource_id = '' if resource_id == 'null' else resource_id
-        self.content_desc = '' if content_desc == 'null' else content_desc
-        self.visible = visible
-        self.clickable = clickable
-        self.long_clickable = long_clickable
-        self.checkable = checkable
-        self.checked = checked
-        self.enabled = enabled
-        self.focusable = focusable
-        self.focused = focused
-        self.invalid = invalid
-        self.clickable_span = clickable_span
-        self.context_clickable = context_clickable
-        self.naf = naf
-        self.important_for_accessibility = important_for_accessibility
-        self.bounds = bounds
-        self.drawing_order = drawing_order
-        self.a11y_actions = a11y_actions
-        self.pkg_name = '' if pkg_name == 'null' else pkg_name
-        if xpath.startswith("/hierarchy"):
-            xpath = xpath[len("/hierarchy"):]
-        self.xpath = xpath
-        # --- Latte ----
-        # TODO: Move it to another class
-        self.located_by = 'xpath'
-        self.skip = False
-        self.action = 'click'
-        # --- Extra ----
-        self.xml_element = None
-        self.parent_node = None
-        self.children_nodes = []
-        self.covered = False
-        self.is_ad = False
+    def __init__(self, **attributes):
+        """
+        The attributes can be given by their names in Node (e.g., class_name=...), or their names in the
+        uiautomator dumps (e.g., **{'class': ...}), where the latter has the priority. The other keys are ignored.
+        """
+        self._initialize(attributes)
+
+    def _initialize(self, raw_attributes) -> None:
+        _set_slot(self, '_raw_attributes', raw_attributes)
+        _set_slot(self, '_fingerprints', None)
+        _set_slot(self, 'located_by', 'xpath')
+        _set_slot(self, 'skip', False)
+        _set_slot(self, 'action', 'click')
+        _set_slot(self, 'xml_element', None)
+        _set_slot(self, 'parent_node', None)
+        _set_slot(self, 'children_nodes', [])
+        _set_slot(self, 'covered', False)
+        _set_slot(self, 'is_ad', False)
+        _set_slot(self, 'visible_descendant_count', None)
+        _set_slot(self, 'has_clickable_descendant', None)
+        _set_slot(self, 'has_text_descendant', None)
+
+    def decode_attributes(self) -> None:
+        """
+        Decodes the attributes from the raw attributes (if it's not done yet) and releases the raw attributes.
+        The names of attributes in the uiautomator dumps have the priority, e.g., 'class' over 'class_name'.
+        """
+        raw_attributes = self._raw_attributes
+        if raw_attributes is None:
+            return
+        _set_slot(self, '_raw_attributes', None)
+        if not isinstance(raw_attributes, dict):
+            # Reading all attributes of an XML element at once is faster than reading them one by one
+            raw_attributes = dict(raw_attributes.items())
+        get = raw_attributes.get
+        class_name = get('class', _MISSING)
+        if class_name is _MISSING:
+            class_name = get('class_name', "")
+        resource_id = get('resource-id', _MISSING)
+        if resource_id is _MISSING:
+            resource_id = get('resource_id', "")
+        content_desc = get('content-desc', _MISSING)
+        if content_desc is _MISSING:
+            content_desc = get('content_desc', "")
+        pkg_name = get('package', _MISSING)
+        if pkg_name is _MISSING:
+            pkg_name = get('pkg_name', "")
+        clickable_span = get('clickableSpan', _MISSING)
+        if clickable_span is _MISSING:
+            clickable_span = get('clickable_span', False)
+        long_clickable = get('long-clickable', _MISSING)
+        if long_clickable is _MISSING:
+            long_clickable = get('long_clickable', False)
+        context_clickable = get('contextClickable', _MISSING)
+        if context_clickable is _MISSING:
+            context_clickable = get('context_clickable', False)
+        naf = get('NAF', _MISSING)
+        if naf is _MISSING:
+            naf = get('naf', False)
+        important_for_accessibility = get('importantForAccessibility', _MISSING)
+        if important_for_accessibility is _MISSING:
+            important_for_accessibility = get('important_for_accessibility', False)
+        a11y_actions = get('actionList', _MISSING)
+        if a11y_actions is _MISSING:
+            a11y_actions = get('a11y_actions', None)
+        drawing_order = get('drawingOrder', _MISSING)
+        if drawing_order is _MISSING:
+            drawing_order = get('drawing_order', -1)
+
+        _set_slot(self, 'index', _decode_int(get('index', -1)))
+        _set_slot(self, 'class_name', class_name)
+        _set_slot(self, 'text', _decode_text(get('text', "")))
+        _set_slot(self, 'resource_id', _decode_text(resource_id))
+        _set_slot(self, 'content_desc', _decode_text(content_desc))
+        _set_slot(self, 'visible', _decode_bool(get('visible', True)))
+        _set_slot(self, 'clickable', _decode_bool(get('clickable', False)))
+        _set_slot(self, 'long_clickable', _decode_bool(long_clickable))
+        _set_slot(self, 'checkable', _decode_bool(get('checkable', False)))
+        _set_slot(self, 'checked', _decode_bool(get('checked', False)))
+        _set_slot(self, 'enabled', _decode_bool(get('enabled', False)))
+        _set_slot(self, 'focusable', _decode_bool(get('focusable', False)))
+        _set_slot(self, 'focused', _decode_bool(get('focused', False)))
+        _set_slot(self, 'invalid', _decode_bool(get('invalid', False)))
+        _set_slot(self, 'clickable_span', _decode_bool(clickable_span))
+        _set_slot(self, 'context_clickable', _decode_bool(context_clickable))
+        _set_slot(self, 'naf', _decode_bool(naf))
+        _set_slot(self, 'important_for_accessibility', _decode_bool(important_for_accessibility))
+        _set_slot(self, 'bounds', _decode_bounds(get('bounds', (0, 0, 0, 0))))
+        _set_slot(self, 'drawing_order', _decode_int(drawing_order))
+        _set_slot(self, 'a11y_actions', _decode_a11y_actions(a11y_actions))
+        _set_slot(self, 'pkg_name', _decode_text(pkg_name))
+        _set_slot(self, 'xpath', _decode_xpath(get('xpath', "")))
+
+    def __getattr__(self, name: str):
+        # It's only called when the slot is not set, i.e., the attributes are not decoded yet
+        if name in Node._LAYOUT_ATTRIBUTES_SET and self._raw_attributes is not None:
+            self.decode_attributes()
+            return getattr(self, name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __setattr__(self, name: str, value) -> None:
+        # The other attributes should be decoded before an attribute is changed
+        if name in Node._LAYOUT_ATTRIBUTES_SET and self._raw_attributes is not None:
+            self.decode_attributes()
+        if self._fingerprints is not None:
+            _set_slot(self, '_fingerprints', None)
+        _set_slot(self, name, value)
+
+    def __copy__(self) -> 'Node':
+        node = Node.__new__(Node)
+        for name, value in self._get_slots().items():
+            _set_slot(node, name, value)
+        return node
+
+    def __getstate__(self) -> dict:
+        """
+        The attributes are decoded, and the XML element is not kept since it cannot be pickled
+        """
+        state = self._get_slots()
+        state['xml_element'] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        for name, value in state.items():
+            _set_slot(self, name, value)
+
+    def _get_slots(self) -> dict:
+        self.decode_attributes()
+        return {name: getattr(self, name) for name in Node.__slots__}
 
     def is_none(self) -> bool:
-        return self.toJSONStr() == Node().toJSONStr()
+        """
+        Checks if the serialized attributes of the Node are the same as an empty Node
+        """
+        if Node._none_items is None:
+            none_node = Node()
+            Node._none_items = [(name, getattr(none_node, name)) for name in Node.ATTRIBUTES
+                                if name not in NON_SERIALIZABLE_ATTRIBUTES]
+        for name, none_value in Node._none_items:
+            if not is_json_equal(getattr(self, name), none_value):
+                return False
+        return True
 
     def area(self):
         return (self.bounds[2] - self.bounds[0]) * (self.bounds[3] - self.bounds[1])
@@ -182,7 +377,10 @@ class Node(JSONSerializable):
     def is_practically_invisible(self):
         if self.covered or not self.visible or not self.is_valid_bounds():
             return True
-        if self.xml_element is not None:
+        if self.visible_descendant_count is not None:
+            if "Layout" in self.class_name or "ViewGroup" in self.class_name:
+                return self.visible_descendant_count == 0
+        elif self.xml_element is not None:
             if "Layout" in self.class_name or "ViewGroup" in self.class_name:
                 return len(self.xml_element.findall('.//node[@visible="true"]')) == 0
         return False
@@ -224,11 +422,28 @@ class Node(JSONSerializable):
         """
         if other is None:
             return False
-        if excluded_attrs is None:
-            excluded_attrs = []
-        # TODO: not sure if it should be added or be configurable
-        excluded_attrs.extend(['focused', 'bounds', 'index', 'drawing_order', 'a11y_actions'])
-        return self.toJSONStr(excluded_attrs) == other.toJSONStr(excluded_attrs)
+        excluded_attributes = PRACTICALLY_EQUAL_EXCLUDED_ATTRIBUTES
+        if excluded_attrs is not None:
+            excluded_attributes = excluded_attributes + excluded_attrs
+        return self.fingerprint(excluded_attributes) == other.fingerprint(excluded_attributes)
+
+    def fingerprint(self, excluded_attributes: List[str] = None) -> str:
+        """
+        Returns a hash of the serialized node without the excluded attributes, i.e., two nodes have the same
+        fingerprint iff `toJSONStr(excluded_attributes)` of them are equal. The fingerprint of each set of
+        excluded attributes is cached until an attribute of the node is changed (changing the content of an attribute,
+        e.g., `a11y_actions.append(...)`, is not detected).
+        """
+        key = frozenset(excluded_attributes) if excluded_attributes else frozenset()
+        fingerprints = self._fingerprints
+        if fingerprints is None:
+            fingerprints = {}
+            _set_slot(self, '_fingerprints', fingerprints)
+        node_fingerprint = fingerprints.get(key, None)
+        if node_fingerprint is None:
+            node_fingerprint = hashlib.blake2b(self.toJSONStr(list(key)).encode('utf-8'), digest_size=16).hexdigest()
+            fingerprints[key] = node_fingerprint
+        return node_fingerprint
 
     def same_identifiers(self, other: 'Node') -> bool:
         """
@@ -259,39 +474,769 @@ class Node(JSONSerializable):
     def toJSONStr(self, excluded_attributes: List[str] = None) -> str:
         if excluded_attributes is None:
             excluded_attributes = []
-        excluded_attributes.extend(['xml_element', 'parent_node', 'children_nodes'])
-        return super().toJSONStr(excluded_attributes)
+        return super().toJSONStr(excluded_attributes + NON_SERIALIZABLE_ATTRIBUTES)
 
     def toJSON(self, excluded_attributes: List[str] = None) -> dict:
         if excluded_attributes is None:
             excluded_attributes = []
-        excluded_attributes.extend(['xml_element', 'parent_node', 'children_nodes'])
-        return super().toJSON(excluded_attributes)
+        return super().toJSON(excluded_attributes + NON_SERIALIZABLE_ATTRIBUTES)
 
     def __str__(self):
         return self.toJSONStr(excluded_attributes=['xpath'])
 
 
+class NodeTable:
+    """
+        A columnar (struct-of-arrays) representation of a list of Nodes. The numerical attributes are kept in NumPy
+        arrays, i.e., bounds (N x 4), drawing order, index, the index of the parent node (-1 for the top nodes), and
+        the number of visible descendants (used by `Node.is_practically_invisible`, since the Nodes of a table have no
+        XML element), the boolean attributes are packed in a bitmask column, and the string attributes are interned,
+        i.e., each string column keeps the codes of the strings in `strings`. The accessibility actions are stored as
+        offsets and values (the actions of the i-th node are `actions_values[actions_offsets[i]:actions_offsets[i+1]]`).
+
+        The columns can be used to filter the nodes with vectorized queries, e.g.,
+        `table.flag('clickable') & ~table.flag('is_ad')`, and the Nodes are created lazily by `node(i)`.
+    """
+    FLAG_ATTRIBUTES = ['visible', 'clickable', 'long_clickable', 'checkable', 'checked', 'enabled', 'focusable',
+                       'focused', 'invalid', 'clickable_span', 'context_clickable', 'naf',
+                       'important_for_accessibility', 'covered', 'is_ad', 'skip']
+    STRING_ATTRIBUTES = ['class_name', 'resource_id', 'text', 'content_desc', 'pkg_name', 'xpath',
+                         'located_by', 'action']
+    # The binary file of a table: the magic, the version and the size of the header (a JSON describing the
+    # arrays), the header, and the arrays, each one is aligned to 8 bytes
+    FILE_MAGIC = b'AXNT'
+    FILE_VERSION = 2
+    _FILE_PREFIX = struct.Struct('<4sII')
+
+    def __init__(self,
+                 bounds: np.ndarray,
+                 flags: np.ndarray,
+                 drawing_order: np.ndarray,
+                 index: np.ndarray,
+                 parent: np.ndarray,
+                 visible_descendant_count: np.ndarray,
+                 string_columns: Dict[str, np.ndarray],
+                 strings: List[str],
+                 actions_offsets: np.ndarray,
+                 actions_values: np.ndarray,
+                 nodes: List[Node] = None,
+                 metadata: Dict = None):
+        self.bounds = bounds
+        self.flags = flags
+        self.drawing_order = drawing_order
+        self.index = index
+        self.parent = parent
+        self.visible_descendant_count = visible_descendant_count
+        self.string_columns = string_columns
+        self.strings = strings
+        self.actions_offsets = actions_offsets
+        self.actions_values = actions_values
+        self._string_codes = {s: i for i, s in enumerate(strings)}
+        self._nodes = nodes if nodes is not None else [None] * len(self.flags)
+        # Arbitrary JSON information about the source of the table, which is stored in its file
+        self.metadata = metadata if metadata is not None else {}
+
+    def __getstate__(self) -> Dict:
+        # The created Nodes (and their XML elements) are not pickled, they are created again by `node(i)`
+        state = self.__dict__.copy()
+        del state['_string_codes']
+        state['_nodes'] = None
+        return state
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self._string_codes = {s: i for i, s in enumerate(self.strings)}
+        self._nodes = [None] * len(self.flags)
+
+    @staticmethod
+    def createTableFromNodes(nodes: List[Node]) -> 'NodeTable':
+        count = len(nodes)
+        node_to_index = {node: i for i, node in enumerate(nodes)}
+        strings = []
+        string_codes = {}
+        string_columns = {attr: np.zeros(count, dtype=np.int32) for attr in NodeTable.STRING_ATTRIBUTES}
+        bounds = np.zeros((count, 4), dtype=np.int32)
+        flags = np.zeros(count, dtype=np.uint32)
+        drawing_order = np.zeros(count, dtype=np.int32)
+        index = np.zeros(count, dtype=np.int32)
+        parent = np.full(count, -1, dtype=np.int32)
+        # Similar to `with_subtree_aggregation`, a node is counted if its layout has visible="true"
+        layout_visible = np.zeros(count, dtype=np.int32)
+        visible_descendant_count = np.full(count, -1, dtype=np.int32)
+        actions_offsets = np.zeros(count + 1, dtype=np.int64)
+        actions_values = []
+        for i, node in enumerate(nodes):
+            bounds[i] = node.bounds
+            node_flags = 0
+            for bit, attr in enumerate(NodeTable.FLAG_ATTRIBUTES):
+                if getattr(node, attr):
+                    node_flags |= 1 << bit
+            flags[i] = node_flags
+            drawing_order[i] = node.drawing_order
+            index[i] = node.index
+            parent[i] = node_to_index.get(node.parent_node, -1)
+            if node.xml_element is not None:
+                layout_visible[i] = node.xml_element.get('visible') == 'true'
+            else:
+                layout_visible[i] = node.visible
+            if node.visible_descendant_count is not None:
+                visible_descendant_count[i] = node.visible_descendant_count
+            for attr in NodeTable.STRING_ATTRIBUTES:
+                value = getattr(node, attr)
+                if value not in string_codes:
+                    string_codes[value] = len(strings)
+                    strings.append(value)
+                string_columns[attr][i] = string_codes[value]
+            actions_values.extend(node.a11y_actions)
+            actions_offsets[i + 1] = len(actions_values)
+        # The missing counts are aggregated bottom-up, the parents precede their children (as in NodesFactory)
+        aggregated_count = np.zeros(count, dtype=np.int32)
+        for i in range(count - 1, -1, -1):
+            if visible_descendant_count[i] < 0:
+                visible_descendant_count[i] = aggregated_count[i]
+            if parent[i] >= 0:
+                aggregated_count[parent[i]] += visible_descendant_count[i] + layout_visible[i]
+        return NodeTable(bounds=bounds,
+                         flags=flags,
+                         drawing_order=drawing_order,
+                         index=index,
+                         parent=parent,
+                         visible_descendant_count=visible_descendant_count,
+                         string_columns=string_columns,
+                         strings=strings,
+                         actions_offsets=actions_offsets,
+                         actions_values=np.array(actions_values, dtype=np.int64),
+                         nodes=list(nodes))
+
+    @staticmethod
+    def createTableFromFile(path: Union[str, Path]) -> Union['NodeTable', None]:
+        """
+        Loads a table written by `write_to_file`. The file is memory-mapped and the arrays are read-only views of it,
+        only the strings are decoded. Returns None if the file is not readable or has another version or schema.
+        """
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, header_size = NodeTable._FILE_PREFIX.unpack_from(buffer, 0)
+            if magic != NodeTable.FILE_MAGIC or version != NodeTable.FILE_VERSION:
+                return None
+            data_offset = NodeTable._FILE_PREFIX.size + header_size
+            header = json.loads(bytes(buffer[NodeTable._FILE_PREFIX.size:data_offset]))
+            if header['flag_attributes'] != NodeTable.FLAG_ATTRIBUTES or \
+                    header['string_attributes'] != NodeTable.STRING_ATTRIBUTES:
+                return None
+            arrays = {}
+            for name, dtype, shape, offset in header['arrays']:
+                arrays[name] = np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)),
+                                             offset=data_offset + offset).reshape(shape)
+            string_offsets = arrays['string_offsets']
+            string_data = arrays['string_data'].tobytes()
+            strings = [string_data[string_offsets[i]:string_offsets[i + 1]].decode('utf-8')
+                       for i in range(len(string_offsets) - 1)]
+            return NodeTable(bounds=arrays['bounds'],
+                             flags=arrays['flags'],
+                             drawing_order=arrays['drawing_order'],
+                             index=arrays['index'],
+                             parent=arrays['parent'],
+                             visible_descendant_count=arrays['visible_descendant_count'],
+                             string_columns={attr: arrays[f'string_{attr}'] for attr in NodeTable.STRING_ATTRIBUTES},
+                             strings=strings,
+                             actions_offsets=arrays['actions_offsets'],
+                             actions_values=arrays['actions_values'],
+                             metadata=header['metadata'])
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            logger.error(f"The node table could not be loaded from {path}: {e}")
+            return None
+
+    def write_to_file(self, path: Union[str, Path]) -> None:
+        """
+        Writes the table and its metadata in a binary file (see `createTableFromFile`). The file is replaced
+        atomically.
+        """
+        encoded_strings = [string.encode('utf-8') for string in self.strings]
+        string_offsets = np.zeros(len(encoded_strings) + 1, dtype=np.int64)
+        string_offsets[1:] = np.cumsum([len(string) for string in encoded_strings])
+        arrays = [('bounds', self.bounds),
+                  ('flags', self.flags),
+                  ('drawing_order', self.drawing_order),
+                  ('index', self.index),
+                  ('parent', self.parent),
+                  ('visible_descendant_count', self.visible_descendant_count),
+                  ('actions_offsets', self.actions_offsets),
+                  ('actions_values', self.actions_values),
+                  ('string_offsets', string_offsets),
+                  ('string_data', np.frombuffer(b''.join(encoded_strings), dtype=np.uint8))]
+        arrays.extend((f'string_{attr}', self.string_columns[attr]) for attr in NodeTable.STRING_ATTRIBUTES)
+        arrays = [(name, np.ascontiguousarray(array)) for name, array in arrays]
+        entries = []
+        offset = 0
+        for name, array in arrays:
+            entries.append((name, array.dtype.str, list(array.shape), offset))
+            offset += (array.nbytes + 7) // 8 * 8
+        header = json.dumps({'flag_attributes': NodeTable.FLAG_ATTRIBUTES,
+                             'string_attributes': NodeTable.STRING_ATTRIBUTES,
+                             'metadata': self.metadata,
+                             'arrays': entries}).encode('utf-8')
+        # The offsets of the arrays are relative to the end of the header, which is padded to be aligned
+        header = header.ljust((NodeTable._FILE_PREFIX.size + len(header) + 7) // 8 * 8 - NodeTable._FILE_PREFIX.size)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(NodeTable._FILE_PREFIX.pack(NodeTable.FILE_MAGIC, NodeTable.FILE_VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays:
+                f.write(array.tobytes())
+                f.write(b'\0' * ((8 - array.nbytes % 8) % 8))
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def flag(self, attr: str) -> np.ndarray:
+        """
+        Returns a boolean mask of the nodes whose boolean attribute `attr` is true
+        """
+        bit = NodeTable.FLAG_ATTRIBUTES.index(attr)
+        return (self.flags & np.uint32(1 << bit)) != 0
+
+    def string_equals(self, attr: str, value: str) -> np.ndarray:
+        """
+        Returns a boolean mask of the nodes whose string attribute `attr` is equal to `value`
+        """
+        if value not in self._string_codes:
+            return np.zeros(len(self), dtype=bool)
+        return self.string_columns[attr] == self._string_codes[value]
+
+    def string_mask(self, attr: str, query: Callable[[str], bool]) -> np.ndarray:
+        """
+        Returns a boolean mask of the nodes whose string attribute `attr` satisfies `query`. The query is
+        evaluated once per distinct string.
+        """
+        codes = self.string_columns[attr]
+        unique_codes = np.unique(codes)
+        satisfied = np.zeros(len(self.strings), dtype=bool)
+        for code in unique_codes:
+            satisfied[code] = query(self.strings[code])
+        return satisfied[codes]
+
+    def string_values(self, attr: str) -> List[str]:
+        return [self.strings[code] for code in self.string_columns[attr]]
+
+    def has_action(self, action: int) -> np.ndarray:
+        """
+        Returns a boolean mask of the nodes that `action in node.a11y_actions`
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        if not isinstance(action, (int, np.integer)):  # The actions of the nodes are integers
+            return mask
+        node_indices = np.searchsorted(self.actions_offsets,
+                                       np.nonzero(self.actions_values == action)[0],
+                                       side='right') - 1
+        mask[node_indices] = True
+        return mask
+
+    def area(self) -> np.ndarray:
+        # The bounds are int32, the area of large (or bogus) bounds does not fit in it
+        bounds = self.bounds.astype(np.int64)
+        return (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+
+    def is_out_of_bounds(self, screen_bounds: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        The vectorized version of `Node.is_out_of_bounds`
+        """
+        [min_x, min_y, max_x, max_y] = screen_bounds
+        xs = self.bounds[:, [0, 2]]
+        ys = self.bounds[:, [1, 3]]
+        return ((xs < min_x) | (xs > max_x)).any(axis=1) | ((ys < min_y) | (ys > max_y)).any(axis=1)
+
+    def _create_nodes(self, indices: np.ndarray) -> None:
+        """
+        Creates the Nodes of the given rows. The columns of the rows are converted to Python objects at once, and the
+        attributes are set directly as decoded attributes.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = indices.tolist()
+        bounds = list(map(tuple, self.bounds[indices].tolist()))
+        drawing_orders = self.drawing_order[indices].tolist()
+        node_indices = self.index[indices].tolist()
+        flags = self.flags[indices]
+        flag_columns = [((flags >> bit) & 1).astype(bool).tolist() for bit in range(len(NodeTable.FLAG_ATTRIBUTES))]
+        strings = self.strings
+        string_columns = [[strings[code] for code in self.string_columns[attr][indices].tolist()]
+                          for attr in NodeTable.STRING_ATTRIBUTES]
+        starts = self.actions_offsets[indices].tolist()
+        ends = self.actions_offsets[indices + 1].tolist()
+        actions_values = self.actions_values.tolist()
+        new_nodes = [Node.__new__(Node) for _ in rows]
+        for node in new_nodes:
+            node._initialize(None)
+        columns = [('index', node_indices), ('bounds', bounds), ('drawing_order', drawing_orders),
+                   ('visible_descendant_count', self.visible_descendant_count[indices].tolist()),
+                   ('a11y_actions', [actions_values[start:end] for start, end in zip(starts, ends)])]
+        columns.extend(zip(NodeTable.STRING_ATTRIBUTES, string_columns))
+        columns.extend(zip(NodeTable.FLAG_ATTRIBUTES, flag_columns))
+        for attr, column in columns:
+            # Setting the slots column by column, without a Python loop per Node
+            deque(map(_set_slot, new_nodes, repeat(attr), column), maxlen=0)
+        for i, node in zip(rows, new_nodes):
+            self._nodes[i] = node
+
+    def node(self, i: int) -> Node:
+        """
+        Returns the Node of the i-th row, the Node is created at the first access. The created Nodes are not linked
+        to their parent and children, use `to_nodes` to have the whole linked tree.
+        """
+        if self._nodes[i] is None:
+            self._create_nodes([i])
+        return self._nodes[i]
+
+    def nodes(self, mask_or_indices: np.ndarray = None) -> List[Node]:
+        """
+        Returns the Nodes selected by a boolean mask or an array of indices (all Nodes if it's None)
+        """
+        if mask_or_indices is None:
+            indices = np.arange(len(self))
+        elif isinstance(mask_or_indices, np.ndarray) and mask_or_indices.dtype == bool:
+            indices = np.nonzero(mask_or_indices)[0]
+        else:
+            indices = np.asarray(mask_or_indices, dtype=np.int64)
+        missing_indices = [i for i in indices.tolist() if self._nodes[i] is None]
+        if missing_indices:
+            self._create_nodes(missing_indices)
+        return [self._nodes[i] for i in indices.tolist()]
+
+    def to_nodes(self) -> List[Node]:
+        """
+        Returns all Nodes, each Node is linked to its parent and children
+        """
+        nodes = self.nodes()
+        for i, node in enumerate(nodes):
+            parent_index = self.parent[i]
+            if parent_index >= 0 and node.parent_node is None:
+                node.parent_node = nodes[parent_index]
+                nodes[parent_index].children_nodes.append(node)
+        return nodes
+
+
+class SpatialIndex:
+    """
+        A static R-tree over a list of bounds (e.g., the bounds of the nodes in a layout), which is bulk loaded by
+        sort-tile-recursive packing. Each level keeps the bounding boxes of groups of `fan_out` consecutive entries
+        of the level below, and a query visits the levels top-down with vectorized checks, so only the branches
+        that may have a result are expanded.
+
+        All queries return the (sorted) indices of the matched bounds, e.g., to be used by `NodeTable.nodes`. The
+        bounds are considered as closed rectangles for inclusion, similar to `bounds_included`, while two bounds
+        intersect only if their overlap has a positive area, similar to `calculate_overlap`.
+    """
+
+    def __init__(self, bounds: np.ndarray, fan_out: int = 16):
+        self.bounds = np.array(bounds, dtype=np.int64).reshape(-1, 4)
+        self.fan_out = fan_out
+        count = len(self.bounds)
+        # Sort-tile-recursive: sort by the x of centers, cut into vertical slices, and sort each slice by y
+        centers = self.bounds[:, :2] + self.bounds[:, 2:]
+        slice_size = fan_out * max(1, int(np.ceil(np.sqrt(count / fan_out)))) if count > 0 else 1
+        order = np.argsort(centers[:, 0], kind='stable')
+        for start in range(0, count, slice_size):
+            slice_order = order[start:start + slice_size]
+            order[start:start + slice_size] = slice_order[np.argsort(centers[slice_order, 1], kind='stable')]
+        self.order = order
+        self.levels = [self.bounds[order]]
+        while len(self.levels[-1]) > fan_out:
+            level = self.levels[-1]
+            group_starts = np.arange(0, len(level), fan_out)
+            self.levels.append(np.concatenate([np.minimum.reduceat(level[:, :2], group_starts),
+                                               np.maximum.reduceat(level[:, 2:], group_starts)], axis=1))
+
+    @staticmethod
+    def createIndexFromNodes(nodes: List[Node]) -> 'SpatialIndex':
+        return SpatialIndex(np.array([node.bounds for node in nodes], dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def _query(self, predicate: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Returns the indices of the bounds that satisfy the predicate. The predicate gets an (M x 4) array of boxes
+        and returns a boolean mask; it should be true for a bounding box of a group if it's true for any member.
+        """
+        if len(self.bounds) == 0:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.arange(len(self.levels[-1]))
+        for level_index in range(len(self.levels) - 1, -1, -1):
+            candidates = candidates[predicate(self.levels[level_index][candidates])]
+            if level_index > 0:
+                candidates = (candidates[:, np.newaxis] * self.fan_out + np.arange(self.fan_out)).ravel()
+                candidates = candidates[candidates < len(self.levels[level_index - 1])]
+        return np.sort(self.order[candidates])
+
+    def containing(self, bounds: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Returns the indices of the bounds that include the given bounds
+        """
+        x0, y0, x1, y1 = bounds
+        return self._query(lambda boxes: (boxes[:, 0] <= x0) & (boxes[:, 1] <= y0) &
+                                         (boxes[:, 2] >= x1) & (boxes[:, 3] >= y1))
+
+    def containing_point(self, x: int, y: int) -> np.ndarray:
+        """
+        Returns the indices of the bounds that include the point (x, y)
+        """
+        return self.containing((x, y, x, y))
+
+    def inside(self, bounds: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Returns the indices of the bounds that are included in the given bounds
+        """
+        x0, y0, x1, y1 = bounds
+        candidates = self._query(lambda boxes: (boxes[:, 0] <= x1) & (boxes[:, 1] <= y1) &
+                                               (boxes[:, 2] >= x0) & (boxes[:, 3] >= y0))
+        candidate_bounds = self.bounds[candidates]
+        return candidates[(candidate_bounds[:, 0] >= x0) & (candidate_bounds[:, 1] >= y0) &
+                          (candidate_bounds[:, 2] <= x1) & (candidate_bounds[:, 3] <= y1)]
+
+    def intersecting(self, bounds: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Returns the indices of the bounds that have an overlap (with a positive area) with the given bounds
+        """
+        x0, y0, x1, y1 = bounds
+        return self._query(lambda boxes: (np.maximum(boxes[:, 0], x0) < np.minimum(boxes[:, 2], x1)) &
+                                         (np.maximum(boxes[:, 1], y0) < np.minimum(boxes[:, 3], y1)))
+
+
+class XPathIndex:
+    """
+        A trie over xpaths, where each trie node is an xpath prefix ending at a '/' (e.g., '/A/B[2]' is a child
+        of '/A'), with parent pointers. Similar to SpatialIndex, the queries return the indices of the given xpaths,
+        e.g., to be used by `Snapshot.nodes`. Unlike string prefixes, a descendant of '/A/B[1]' is never '/A/B[12]'.
+        The string prefix queries (`starting_with`) are answered by the xpaths in lexicographic order.
+    """
+
+    def __init__(self, xpaths: Sequence[str]):
+        self.xpaths = list(xpaths)
+        # For each trie node: its parent, its children, its depth, and the indices of the xpaths ending at it
+        self._parents = [-1]
+        self._children = [[]]
+        self._depths = [0]
+        self._entries = [[]]
+        self._trie_nodes = {"": 0}
+        # The xpaths (with their indices) in lexicographic order, created at the first string prefix query
+        self._sorted_entries = None
+        for index, xpath in enumerate(self.xpaths):
+            self._entries[self._insert(xpath)].append(index)
+        # The closest (the shallowest, then the smallest xpath) entry in the subtree of each trie node. Since a
+        # trie node is created after its parent, the children are visited before their parents in reverse order.
+        self._closest = [entries[0] if entries else -1 for entries in self._entries]
+        for trie_node in range(len(self._parents) - 1, 0, -1):
+            parent = self._parents[trie_node]
+            closest = self._closest[trie_node]
+            if closest < 0 or self._entries[parent]:
+                continue
+            parent_closest = self._closest[parent]
+            if parent_closest < 0 or self._closest_key(closest) < self._closest_key(parent_closest):
+                self._closest[parent] = closest
+
+    @staticmethod
+    def createIndexFromNodes(nodes: List[Node]) -> 'XPathIndex':
+        return XPathIndex([node.xpath for node in nodes])
+
+    def __len__(self) -> int:
+        return len(self.xpaths)
+
+    def _insert(self, xpath: str) -> int:
+        trie_node = self._trie_nodes.get(xpath, None)
+        if trie_node is not None:
+            return trie_node
+        parent = self._insert(xpath[:xpath.rfind("/")]) if "/" in xpath else 0
+        trie_node = len(self._parents)
+        self._parents.append(parent)
+        self._children.append([])
+        self._depths.append(self._depths[parent] + 1)
+        self._entries.append([])
+        self._children[parent].append(trie_node)
+        self._trie_nodes[xpath] = trie_node
+        return trie_node
+
+    def _closest_key(self, index: int) -> Tuple[int, str]:
+        xpath = self.xpaths[index]
+        return self._depths[self._trie_nodes[xpath]], xpath
+
+    def find(self, xpath: str) -> List[int]:
+        """
+        Returns the indices of the given xpath
+        """
+        trie_node = self._trie_nodes.get(xpath, None)
+        return [] if trie_node is None else list(self._entries[trie_node])
+
+    def ancestors(self, xpath: str, include_self: bool = False) -> List[int]:
+        """
+        Returns the indices of the ancestors of the given xpath, from the closest one to the root. The xpath does not
+        need to be indexed.
+        """
+        result = []
+        trie_node = self._trie_nodes.get(xpath, None)
+        if trie_node is None:
+            # Finding the longest indexed prefix
+            while trie_node is None and "/" in xpath:
+                xpath = xpath[:xpath.rfind("/")]
+                trie_node = self._trie_nodes.get(xpath, None)
+            trie_node = 0 if trie_node is None else trie_node
+        elif not include_self:
+            trie_node = self._parents[trie_node]
+        while trie_node >= 0:
+            result.extend(self._entries[trie_node])
+            trie_node = self._parents[trie_node]
+        return result
+
+    def descendants(self, xpath: str, include_self: bool = False) -> List[int]:
+        """
+        Returns the (sorted) indices of the descendants of the given xpath
+        """
+        trie_node = self._trie_nodes.get(xpath, None)
+        if trie_node is None:
+            return []
+        result = list(self._entries[trie_node]) if include_self else []
+        stack = list(self._children[trie_node])
+        while stack:
+            trie_node = stack.pop()
+            result.extend(self._entries[trie_node])
+            stack.extend(self._children[trie_node])
+        return sorted(result)
+
+    def starting_with(self, prefix: str) -> List[int]:
+        """
+        Returns the indices of the xpaths that start with the given string, in the lexicographic order of the xpaths
+        (and by index for the same xpath). Unlike `descendants`, it's not segment-aware, e.g., '/A/View' is a prefix
+        of '/A/ViewGroup', the same as `xpath.startswith(prefix)`.
+        """
+        if self._sorted_entries is None:
+            self._sorted_entries = sorted((xpath, index) for index, xpath in enumerate(self.xpaths))
+        result = []
+        for position in range(bisect.bisect_left(self._sorted_entries, (prefix, -1)), len(self._sorted_entries)):
+            xpath, index = self._sorted_entries[position]
+            if not xpath.startswith(prefix):
+                break
+            result.append(index)
+        return result
+
+    def closest_descendant(self, xpath: str) -> Union[int, None]:
+        """
+        Returns the index of the closest descendant of the given xpath (or itself), i.e., the shallowest one. Among
+        the descendants with the same depth, the smallest xpath is returned.
+        """
+        trie_node = self._trie_nodes.get(xpath, None)
+        if trie_node is None or self._closest[trie_node] < 0:
+            return None
+        return self._closest[trie_node]
+
+
+class LayoutCache:
+    """
+        A bounded LRU cache of the Nodes built by NodesFactory from layout files. An entry is keyed by the resolved
+        path of the layout, its modification time and size, and the passes and the streaming options of the factory,
+        so a modified layout file or a different set of passes never hits a stale entry. The cache is bounded by the
+        total number of cached Nodes; the least recently used entries are evicted first.
+
+        The cached Nodes are shared between all the builds that hit the same entry, so they must be treated as
+        read-only. Note that the Nodes of a non-released build keep their XML tree alive, too.
+    """
+
+    def __init__(self, max_nodes: int = 200000):
+        self.max_nodes = max_nodes
+        self._entries = OrderedDict()
+        self._node_count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def create_key(layout_path: Union[str, Path], options: Tuple) -> Union[Tuple, None]:
+        """
+        Returns the cache key of the layout file with the given build options, or None if the file cannot be accessed
+        """
+        try:
+            layout_path = os.path.realpath(layout_path)
+            stat = os.stat(layout_path)
+        except OSError:
+            return None
+        return layout_path, stat.st_mtime_ns, stat.st_size, options
+
+    def get(self, key: Tuple) -> Union[List[Node], None]:
+        with self._lock:
+            nodes = self._entries.get(key, None)
+            if nodes is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return list(nodes)
+
+    def put(self, key: Tuple, nodes: List[Node]) -> None:
+        if len(nodes) > self.max_nodes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._node_count -= len(self._entries.pop(key))
+            self._entries[key] = list(nodes)
+            self._node_count += len(nodes)
+            while self._node_count > self.max_nodes:
+                _, evicted_nodes = self._entries.popitem(last=False)
+                self._node_count -= len(evicted_nodes)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._node_count = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'nodes': self._node_count,
+                'max_nodes': self.max_nodes,
+            }
+
+
+LAYOUT_CACHE = LayoutCache()
+
+
+class NodesPass:
+    """
+    A pass of NodesFactory. A pre-order pass is called with the visiting Node, its extra attributes, its children,
+    and a map from each child to its extra attributes before its descendants are visited; it may read and write the
+    attributes of the Node and its children. A post-order pass is called with the visiting Node and its children after
+    its descendants are visited; it may read the attributes of the Node and its children but only writes the Node.
+
+    `reads` and `writes` are the Node attributes that the pass reads and writes. They are used to fuse consecutive
+    passes into one traversal. If the reads or writes of any pass are unknown (None), e.g., a plain function, nothing
+    is known about its dependencies, so all passes are applied in one traversal in the order they are added.
+    """
+    PRE_ORDER = 'pre_order'
+    POST_ORDER = 'post_order'
+
+    def __init__(self,
+                 name: str,
+                 function: Callable,
+                 order: str = PRE_ORDER,
+                 reads: Iterable[str] = None,
+                 writes: Iterable[str] = None):
+        if order not in [NodesPass.PRE_ORDER, NodesPass.POST_ORDER]:
+            raise ValueError(f"Unknown order of pass {name}: {order}")
+        self.name = name
+        self.function = function
+        self.order = order
+        self.reads = frozenset(reads) if reads is not None else None
+        self.writes = frozenset(writes) if writes is not None else None
+
+    @staticmethod
+    def createPassFromFunction(t_pass: Union['NodesPass', Callable]) -> 'NodesPass':
+        """
+        A plain function is considered as a pre-order pass with unknown reads and writes
+        """
+        if isinstance(t_pass, NodesPass):
+            return t_pass
+        return NodesPass(name=t_pass.__name__, function=t_pass)
+
+    def is_pre_order(self) -> bool:
+        return self.order == NodesPass.PRE_ORDER
+
+    def can_be_fused_after(self, passes: List['NodesPass']) -> bool:
+        """
+        Checks if applying this pass in the same traversal of the given passes (which are applied before this pass)
+        produces the same result of applying it in a separate traversal.
+        """
+        if self.reads is None or self.writes is None:
+            return False
+        for t_pass in passes:
+            if t_pass.reads is None or t_pass.writes is None:
+                return False
+            if self.is_pre_order():
+                # The pass visits a Node before the prior passes visit its descendants (and itself for post-order
+                # passes), so it can neither read their writes nor change what they read
+                if self.reads & t_pass.writes or self.writes & (t_pass.reads | t_pass.writes):
+                    return False
+            elif not t_pass.is_pre_order() and self.writes & t_pass.reads:
+                # A prior post-order pass reads the Node when visiting its parent, i.e., after this pass writes it
+                return False
+        return True
+
+
 class NodesFactory:
     """
         A factory class which inputs XML layout (either by file or string), then traverse the tree
         and generate a set of Nodes corresponding to XML elements. The traverse can be accompanied by
         passes to augment more information into Nodes. Each pass input the current visiting Node, its
         extra attribute (a dictionary to contain exclusive information for passes), the children, and
-        a map from each child node to its extra attribute.
+        a map from each child node to its extra attribute. Post-order passes input the visiting Node and its children,
+        and visit the children before their parent. The passes (see NodesPass) are applied in the order they are added,
+        the consecutive passes that do not depend on each other are fused into one iterative traversal.
     """
 
     def __init__(self):
         self.layout = None
+        self.layout_path = None
+        self.layout_cache = None
         self.passes = []
+        self.streaming = False
+        self.release_xml_elements = False
+        self.pass_timings = None
 
     def with_layout(self, layout: str) -> 'NodesFactory':
         self.layout = layout
+        self.layout_path = None
         return self
 
-    def with_layout_path(self, layout_path: Union[str, Path]) -> 'NodesFactory':
+    def with_layout_path(self, layout_path: Union[str, Path], use_cache: bool = False,
+                         layout_cache: LayoutCache = None) -> 'NodesFactory':
+        """
+        Reads the layout from the given file. If use_cache is true, the layout is read lazily and the built Nodes are
+        looked up (and stored) in the layout cache (LAYOUT_CACHE by default). The cached Nodes are shared between
+        builds, so they must not be modified.
+        """
+        if use_cache or layout_cache is not None:
+            self.layout = None
+            self.layout_path = layout_path
+            self.layout_cache = layout_cache if layout_cache is not None else LAYOUT_CACHE
+            return self
         with open(layout_path, "r") as f:
             self.layout = f.read()
+        self.layout_path = None
+        return self
+
+    def with_streaming(self, release_xml_elements: bool = False) -> 'NodesFactory':
+        """
+        Builds the Nodes with an incremental parser (`iterparse`) instead of parsing the whole layout and
+        querying the children of each element. The Nodes and their parent/children links are created while the
+        elements are opened, and the passes are applied with an iterative pre-order traversal once the tree is
+        closed. The produced list of Nodes is the same as the regular build.
+
+        :param release_xml_elements: If true, each XML element is decoded into its Node and cleared as soon as it's
+                                     closed, so the whole XML tree is never kept in memory, i.e., `xml_element` of
+                                     the Nodes is None. `visible_descendant_count` of the Nodes is counted while
+                                     parsing (for `is_practically_invisible`).
+        """
+        self.streaming = True
+        self.release_xml_elements = release_xml_elements
+        return self
+
+    def with_pass(self, nodes_pass: NodesPass) -> 'NodesFactory':
+        """
+        Adds a pass, it is applied after the passes which are added before.
+        """
+        self.passes.append(nodes_pass)
+        return self
+
+    def with_pass_timing(self) -> 'NodesFactory':
+        """
+        Measures the time spent in each pass, `pass_timings` maps the name of passes to the total seconds over builds
+        """
+        self.pass_timings = defaultdict(float)
         return self
 
     def with_xpath_pass(self) -> 'NodesFactory':
@@ -315,8 +1260,10 @@ class NodesFactory:
                                                           child_node.class_name,
                                                           class_counter[child_node.class_name])
 
-        self.passes.append(create_xpath)
-        return self
+        return self.with_pass(NodesPass(name=create_xpath.__name__,
+                                        function=create_xpath,
+                                        reads=['xpath', 'class_name'],
+                                        writes=['xpath']))
 
     def with_ad_detection(self) -> 'NodesFactory':
         """
@@ -348,13 +1295,50 @@ class NodesFactory:
                 for child_node in children_nodes:
                     child_node.is_ad = True
 
-        self.passes.append(detect_ad)
+        return self.with_pass(NodesPass(name=detect_ad.__name__,
+                                        function=detect_ad,
+                                        reads=['resource_id', 'class_name', 'text', 'is_ad'],
+                                        writes=['is_ad']))
+
+    def with_subtree_aggregation(self) -> 'NodesFactory':
+        """
+        Aggregates the facts of the subtree of each Node in a post-order pass, i.e., `visible_descendant_count` (the
+        number of descendants whose layout has visible="true"), `has_clickable_descendant`, and `has_text_descendant`.
+        """
+
+        def aggregate_subtree(node: Node, children_nodes: List[Node]) -> None:
+            visible_descendant_count = 0
+            has_clickable_descendant = False
+            has_text_descendant = False
+            for child_node in children_nodes:
+                # Similar to the query of `is_practically_invisible`, a missing 'visible' attribute is not counted
+                if child_node.xml_element is not None:
+                    child_visible = child_node.xml_element.get('visible') == 'true'
+                else:
+                    child_visible = child_node.visible
+                visible_descendant_count += child_node.visible_descendant_count + child_visible
+                has_clickable_descendant = has_clickable_descendant or child_node.clickable or \
+                    child_node.has_clickable_descendant
+                has_text_descendant = has_text_descendant or bool(child_node.text) or child_node.has_text_descendant
+            node.visible_descendant_count = visible_descendant_count
+            node.has_clickable_descendant = has_clickable_descendant
+            node.has_text_descendant = has_text_descendant
+
+        aggregated_attributes = ['visible_descendant_count', 'has_clickable_descendant', 'has_text_descendant']
+        if aggregate_subtree.__name__ not in [t_pass.name for t_pass in self._get_passes()]:
+            self.with_pass(NodesPass(name=aggregate_subtree.__name__,
+                                     function=aggregate_subtree,
+                                     order=NodesPass.POST_ORDER,
+                                     reads=['visible', 'clickable', 'text'] + aggregated_attributes,
+                                     writes=aggregated_attributes))
         return self
 
     def with_covered_pass(self) -> 'NodesFactory':
         """
-        Calculates `covered` value for children nodes.
+        Calculates `covered` value for children nodes. The subtree aggregates are used to find the practically
+        invisible nodes.
         """
+        self.with_subtree_aggregation()
         prefix = self.with_covered_pass.__name__
         covered_bounds_list_attr = f"{prefix}_covered_bounds_list"  # to distinguish with other passes
 
@@ -377,47 +1361,36 @@ class NodesFactory:
             :param child_to_extras_map: A map from children to their extras, this function
                                         uses attribute 'covered_bounds_list_attr'
             """
-            for child_node in children_nodes:
-                child_to_extras_map[child_node][covered_bounds_list_attr] = []
             if node.covered:
                 for child_node in children_nodes:
                     if not child_node.is_practically_invisible():
                         child_node.covered = True
-            else:
-                covered_bounds_so_far = list(extra.get(covered_bounds_list_attr, []))
-                for child_node in sorted(children_nodes, key=lambda x: -x.drawing_order):
-                    if child_node.is_practically_invisible():
-                        continue
-                    for covered_bounds in covered_bounds_so_far:
-                        if bounds_included(covered_bounds, child_node.bounds):
-                            child_node.covered = True
-                            break
-                        else:
-                            overlap_bounds = calculate_overlap(covered_bounds, child_node.bounds)
-                            if overlap_bounds:
-                                child_to_extras_map[child_node][covered_bounds_list_attr].append(overlap_bounds)
-                    if not child_node.covered:
-                        covered_bounds_so_far.append(child_node.bounds)
-
-        self.passes.append(calculate_covered)
-        return self
+                return
+            drawn_children = [child_node for child_node in sorted(children_nodes, key=lambda x: -x.drawing_order)
+                              if not child_node.is_practically_invisible()]
+            if len(drawn_children) == 0:
+                return
+            covered, overlaps = calculate_occlusion(extra.get(covered_bounds_list_attr, []),
+                                                    [child_node.bounds for child_node in drawn_children])
+            for child_node, child_covered, child_covered_bounds in zip(drawn_children, covered, overlaps):
+                if child_covered:
+                    child_node.covered = True
+                else:
+                    child_to_extras_map[child_node][covered_bounds_list_attr] = child_covered_bounds
+
+        return self.with_pass(NodesPass(name=calculate_covered.__name__,
+                                        function=calculate_covered,
+                                        reads=['covered', 'visible', 'bounds', 'drawing_order', 'class_name',
+                                               'visible_descendant_count'],
+                                        writes=['covered']))
 
     def build(self) -> List[Node]:
+        if self.layout_path is not None:
+            return self._build_cached()
         if not self.layout:
             return []
-
-        def dfs(node: Node, extra: Dict) -> List[Node]:
-            nodes = [node]
-            children_xml_elements = node.xml_element.findall("node")
-            children_nodes = [Node.createNodeFromXmlElement(child_element) for child_element in children_xml_elements]
-            child_to_extra_map = defaultdict(dict)
-            for t_pass in self.passes:
-                t_pass(node, extra, children_nodes, child_to_extra_map)
-            for child_node in children_nodes:
-                child_node.parent_node = node
-                node.children_nodes.append(child_node)
-                nodes.extend(dfs(child_node, child_to_extra_map[child_node]))
-            return nodes
+        if self.streaming:
+            return self._build_streaming()
 
         try:
             layout_utf8 = self.layout.encode('utf-8')
@@ -425,32 +1398,286 @@ class NodesFactory:
             dummy_root_xml = etree.fromstring(layout_utf8, parser)
             dummy_root_node = Node.createNodeFromXmlElement(dummy_root_xml)
             dummy_root_node.xpath = f""
-            return dfs(dummy_root_node, {})[1:]
+            node_count = 1
+            stack = [dummy_root_node]
+            while stack:
+                node = stack.pop()
+                for child_element in node.xml_element.findall("node"):
+                    child_node = Node.createNodeFromXmlElement(child_element)
+                    child_node.parent_node = node
+                    node.children_nodes.append(child_node)
+                node_count += len(node.children_nodes)
+                stack.extend(node.children_nodes)
+            return self._apply_passes(dummy_root_node, node_count)[1:]
         except Exception as e:
             tb = traceback.format_exc()
             logger.error(f"Exception in building Nodes from Layout: {e} {tb}")
         return []
 
+    def _build_cached(self) -> List[Node]:
+        options = (tuple(t_pass.name for t_pass in self._get_passes()),
+                   self.streaming, self.release_xml_elements)
+        key = LayoutCache.create_key(self.layout_path, options)
+        if key is not None:
+            nodes = self.layout_cache.get(key)
+            if nodes is not None:
+                return nodes
+        with open(self.layout_path, "r") as f:
+            self.layout = f.read()
+        self.layout_path = None
+        nodes = self.build()
+        # The layout may have been modified while it was being read
+        if key is not None and len(nodes) > 0 and key == LayoutCache.create_key(key[0], options):
+            self.layout_cache.put(key, nodes)
+        return nodes
 
-def is_in_same_state_with_nodes(nodes1: List[Node], nodes2: List[Node], extra_excluded_attributes: List[str] = None,
-                                package_name: str = None) -> bool:
+    def build_table(self) -> NodeTable:
+        return NodeTable.createTableFromNodes(self.build())
+
+    def _get_passes(self) -> List[NodesPass]:
+        return [NodesPass.createPassFromFunction(t_pass) for t_pass in self.passes]
+
+    def _plan_traversals(self) -> List[List[NodesPass]]:
+        """
+        Groups the passes into traversals, a pass is fused into the traversal of its prior passes if it does not
+        depend on them. If a pass has unknown reads or writes, all passes are applied in one traversal, i.e., the
+        pre-order passes are called for each Node in the order they are added.
+        """
+        passes = self._get_passes()
+        if any(t_pass.reads is None or t_pass.writes is None for t_pass in passes):
+            return [passes]
+        traversals = []
+        for t_pass in passes:
+            if traversals and t_pass.can_be_fused_after(traversals[-1]):
+                traversals[-1].append(t_pass)
+            else:
+                traversals.append([t_pass])
+        return traversals
+
+    def _get_pass_function(self, t_pass: NodesPass) -> Callable:
+        if self.pass_timings is None:
+            return t_pass.function
+        pass_function = t_pass.function
+        pass_timings = self.pass_timings
+
+        def timed_pass_function(*args):
+            start_time = time.perf_counter()
+            pass_function(*args)
+            pass_timings[t_pass.name] += time.perf_counter() - start_time
+
+        return timed_pass_function
+
+    def _apply_passes(self, root_node: Node, node_count: int) -> List[Node]:
+        """
+        Applies the passes on the tree of root_node (which has node_count Nodes), returns the Nodes in pre-order
+        """
+        nodes = [None] * node_count
+        traversals = self._plan_traversals()
+        for i, traversal in enumerate(traversals or [[]]):
+            pre_order_passes = [self._get_pass_function(t_pass) for t_pass in traversal if t_pass.is_pre_order()]
+            post_order_passes = [self._get_pass_function(t_pass) for t_pass in traversal if not t_pass.is_pre_order()]
+            if i > 0 and not pre_order_passes:
+                # Each Node is visited after its descendants in the reversed pre-order
+                for node in reversed(nodes):
+                    for t_pass in post_order_passes:
+                        t_pass(node, node.children_nodes)
+                continue
+            index = 0
+            # Each entry is a Node, its extra, and whether its descendants are visited
+            stack = [(root_node, {}, False)]
+            while stack:
+                node, extra, is_exiting = stack.pop()
+                if is_exiting:
+                    for t_pass in post_order_passes:
+                        t_pass(node, node.children_nodes)
+                    continue
+                if i == 0:
+                    nodes[index] = node
+                index += 1
+                if post_order_passes:
+                    stack.append((node, extra, True))
+                if pre_order_passes:
+                    child_to_extra_map = defaultdict(dict)
+                    for t_pass in pre_order_passes:
+                        t_pass(node, extra, node.children_nodes, child_to_extra_map)
+                    for child_node in reversed(node.children_nodes):
+                        stack.append((child_node, child_to_extra_map[child_node], False))
+                else:
+                    stack.extend((child_node, None, False) for child_node in reversed(node.children_nodes))
+        return nodes
+
+    def _build_streaming(self) -> List[Node]:
+        try:
+            layout_utf8 = self.layout.encode('utf-8')
+            dummy_root_node = None
+            node_count = 0
+            # Each entry is the Node of an opened element (or None if the element is not a part of the tree), and the
+            # number of its descendant elements with visible="true" which is counted while the elements are closed
+            opened_nodes = []
+            for event, element in etree.iterparse(io.BytesIO(layout_utf8),
+                                                  events=("start", "end"),
+                                                  recover=True,
+                                                  encoding='utf-8'):
+                if event == "end":
+                    node, visible_descendant_count = opened_nodes.pop()
+                    if not self.release_xml_elements:
+                        continue
+                    if opened_nodes:
+                        opened_nodes[-1][1] += visible_descendant_count + \
+                                               (element.tag == "node" and element.get('visible') == 'true')
+                    if node is not None:
+                        # The same as the query of `is_practically_invisible` on the XML element
+                        if node.visible_descendant_count is None:
+                            node.visible_descendant_count = visible_descendant_count
+                        node.decode_attributes()
+                        node.xml_element = None
+                    # The element and its consumed previous siblings are not needed anymore
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                    continue
+                if dummy_root_node is None:
+                    dummy_root_node = Node.createNodeFromXmlElement(element)
+                    dummy_root_node.xpath = f""
+                    node_count += 1
+                    opened_nodes.append([dummy_root_node, 0])
+                    continue
+                parent_node = opened_nodes[-1][0] if opened_nodes else None
+                if parent_node is None or element.tag != "node":
+                    opened_nodes.append([None, 0])
+                    continue
+                node = Node.createNodeFromXmlElement(element)
+                node.parent_node = parent_node
+                parent_node.children_nodes.append(node)
+                node_count += 1
+                opened_nodes.append([node, 0])
+            if dummy_root_node is None:
+                return []
+            return self._apply_passes(dummy_root_node, node_count)[1:]
+        except Exception as e:
+            tb = traceback.format_exc()
+            logger.error(f"Exception in building Nodes from Layout: {e} {tb}")
+        return []
+
+
+def get_layout_fingerprint(nodes: List[Node], excluded_attributes: List[str] = None) -> str:
+    """
+    Returns a rolling hash of the fingerprints of the nodes (in order), i.e., two lists of nodes have the same
+    layout fingerprint iff their nodes are pairwise equal without the excluded attributes.
+    """
+    layout_hash = hashlib.blake2b(digest_size=16)
+    for node in nodes:
+        layout_hash.update(node.fingerprint(excluded_attributes).encode('ascii'))
+    return layout_hash.hexdigest()
+
+
+def get_state_fingerprint(nodes: List[Node], extra_excluded_attributes: List[str] = None,
+                          package_name: str = None) -> Union[str, None]:
+    """
+    Returns the layout fingerprint of the nodes, excluding the ads, the nodes of other packages (if package_name is
+    given), and the attributes in SAME_STATE_EXCLUDED_ATTRIBUTES and extra_excluded_attributes.
+    Returns None if no node remains.
+    """
     filter_queries = [lambda node: not node.is_ad]
     if package_name:
         filter_queries.append(lambda node: node.belongs(package_name))
-    nodes1 = [x for x in nodes1 if all(query(x) for query in filter_queries)]
-    nodes2 = [x for x in nodes2 if all(query(x) for query in filter_queries)]
-    if len(nodes1) == 0 or len(nodes2) == 0:
-        return False
-    if len(nodes1) != len(nodes2):
-        return False
-    excluded_attributes = ['xpath', 'naf', 'focused', 'bounds', 'index', 'drawing_order',
-                           'a11y_actions', 'invalid']
+    nodes = [x for x in nodes if all(query(x) for query in filter_queries)]
+    if len(nodes) == 0:
+        return None
+    excluded_attributes = SAME_STATE_EXCLUDED_ATTRIBUTES
     if extra_excluded_attributes is not None:
-        excluded_attributes.extend(extra_excluded_attributes)
-    for node1, node2 in zip(nodes1, nodes2):
-        if not node1.practically_equal(node2, excluded_attrs=excluded_attributes):
-            return False
-    return True
+        excluded_attributes = excluded_attributes + extra_excluded_attributes
+    return get_layout_fingerprint(nodes, excluded_attributes)
+
+
+def is_in_same_state_with_nodes(nodes1: List[Node], nodes2: List[Node], extra_excluded_attributes: List[str] = None,
+                                package_name: str = None) -> bool:
+    fingerprint1 = get_state_fingerprint(nodes1, extra_excluded_attributes=extra_excluded_attributes,
+                                         package_name=package_name)
+    if fingerprint1 is None:
+        return False
+    return fingerprint1 == get_state_fingerprint(nodes2, extra_excluded_attributes=extra_excluded_attributes,
+                                                 package_name=package_name)
+
+
+class LayoutSignature:
+    """
+        The signature of a layout, which is enough to determine if two layouts are in the same state without parsing
+        them. For each node (in order), it keeps whether it's an ad, its package name, and its fingerprint for each
+        profile of excluded attributes (in addition to SAME_STATE_EXCLUDED_ATTRIBUTES):
+        'layout' is used to compare the layouts of a snapshot's actions (is_in_same_state_layout), and 'state' is
+        used to compare snapshots (Snapshot.is_in_same_state_as).
+    """
+    VERSION = 1
+    PROFILES = {
+        'layout': [],
+        'state': SNAPSHOT_STATE_EXCLUDED_ATTRIBUTES,
+    }
+
+    def __init__(self, is_ad: List[bool], pkg_names: List[str], fingerprints: Dict[str, List[str]]):
+        self.is_ad = is_ad
+        self.pkg_names = pkg_names
+        self.fingerprints = fingerprints
+
+    @staticmethod
+    def createSignatureFromNodes(nodes: List[Node]) -> 'LayoutSignature':
+        fingerprints = {}
+        for profile, extra_excluded_attributes in LayoutSignature.PROFILES.items():
+            excluded_attributes = SAME_STATE_EXCLUDED_ATTRIBUTES + extra_excluded_attributes
+            fingerprints[profile] = [node.fingerprint(excluded_attributes) for node in nodes]
+        return LayoutSignature(is_ad=[node.is_ad for node in nodes],
+                               pkg_names=[node.pkg_name for node in nodes],
+                               fingerprints=fingerprints)
+
+    @staticmethod
+    def createSignatureFromLayout(layout: str) -> 'LayoutSignature':
+        nodes = NodesFactory() \
+            .with_layout(layout) \
+            .with_xpath_pass() \
+            .with_ad_detection() \
+            .with_streaming(release_xml_elements=True) \
+            .build()
+        return LayoutSignature.createSignatureFromNodes(nodes)
+
+    @staticmethod
+    def createSignatureFromDict(signature: dict) -> Union['LayoutSignature', None]:
+        """
+        Returns None if the signature is created by another version or with other profiles
+        """
+        if signature.get('version', None) != LayoutSignature.VERSION or \
+                signature.get('profiles', None) != LayoutSignature.PROFILES:
+            return None
+        return LayoutSignature(is_ad=signature['is_ad'],
+                               pkg_names=signature['pkg_names'],
+                               fingerprints=signature['fingerprints'])
+
+    def toJSON(self) -> dict:
+        return {
+            'version': LayoutSignature.VERSION,
+            'profiles': LayoutSignature.PROFILES,
+            'is_ad': self.is_ad,
+            'pkg_names': self.pkg_names,
+            'fingerprints': self.fingerprints,
+        }
+
+    def get_state_fingerprint(self, profile: str, package_name: str = None) -> Union[str, None]:
+        """
+        Returns the same value as `get_state_fingerprint` of the nodes with the extra excluded attributes of the
+        profile, i.e., the ads and the nodes of other packages are filtered and None is returned if no node remains.
+        """
+        layout_hash = hashlib.blake2b(digest_size=16)
+        is_empty = True
+        for is_ad, pkg_name, node_fingerprint in zip(self.is_ad, self.pkg_names, self.fingerprints[profile]):
+            if is_ad or (package_name and pkg_name != package_name):
+                continue
+            layout_hash.update(node_fingerprint.encode('ascii'))
+            is_empty = False
+        return None if is_empty else layout_hash.hexdigest()
+
+    def is_in_same_state(self, other: 'LayoutSignature', profile: str = 'layout', package_name: str = None) -> bool:
+        state_fingerprint = self.get_state_fingerprint(profile, package_name)
+        return state_fingerprint is not None and \
+            state_fingerprint == other.get_state_fingerprint(profile, package_name)
 
 
 def is_in_same_state_layout(layout1: str, layout2: str, extra_excluded_attributes: List[str] = None,
@@ -473,12 +1700,12 @@ def is_in_same_state_with_layout_path(layout_path1: Union[Path, str], layout_pat
                                       extra_excluded_attributes: List[str] = None,
                                       package_name: str = None) -> bool:
     nodes1 = NodesFactory() \
-        .with_layout_path(layout_path1) \
+        .with_layout_path(layout_path1, use_cache=True) \
         .with_xpath_pass() \
         .with_ad_detection() \
         .build()
     nodes2 = NodesFactory() \
-        .with_layout_path(layout_path2) \
+        .with_layout_path(layout_path2, use_cache=True) \
         .with_xpath_pass() \
         .with_ad_detection() \
         .build()
@@ -486,6 +1713,178 @@ def is_in_same_state_with_layout_path(layout_path1: Union[Path, str], layout_pat
                                        package_name=package_name)
 
 
+# The attributes that only show the position of a node in the layout, a node that is moved has different values
+POSITION_ATTRIBUTES = ['xpath', 'index', 'bounds', 'drawing_order']
+
+
+class LayoutDiff:
+    """
+        The structural difference between two layouts: the removed nodes (only in the first layout), the added nodes
+        (only in the second layout), and the modified nodes, i.e., the pairs of matched nodes with their attribute
+        deltas ({attribute: (first value, second value)}).
+    """
+
+    def __init__(self,
+                 added: List[Node] = None,
+                 removed: List[Node] = None,
+                 modified: List[Tuple[Node, Node, Dict[str, Tuple]]] = None):
+        self.added = added if added is not None else []
+        self.removed = removed if removed is not None else []
+        self.modified = modified if modified is not None else []
+
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.modified) == 0
+
+    def summary(self) -> Dict[str, int]:
+        return {'added': len(self.added), 'removed': len(self.removed), 'modified': len(self.modified)}
+
+    def toJSON(self) -> dict:
+        return {
+            'added': [node.toJSON() for node in self.added],
+            'removed': [node.toJSON() for node in self.removed],
+            'modified': [{'node': node2.toJSON(),
+                          'changes': {name: list(values) for name, values in deltas.items()}}
+                         for _, node2, deltas in self.modified],
+        }
+
+
+def diff_nodes(nodes1: List[Node], nodes2: List[Node], excluded_attributes: List[str] = None) -> LayoutDiff:
+    """
+    Matches the nodes of two layouts and returns their structural difference, the excluded attributes are not
+    compared. The nodes are matched in four rounds, each one among the nodes which are not matched yet:
+    (1) the same xpath and fingerprint (unchanged nodes), (2) the same fingerprint without the position attributes
+    (moved nodes), (3) the same xpath, (4) the same identifiers (class_name, resource_id, text, content_desc).
+    In each round, the nodes are bucketed by their keys and matched in order, so it runs in linear time.
+    """
+    if excluded_attributes is None:
+        excluded_attributes = []
+    position_free_excluded_attributes = excluded_attributes + POSITION_ATTRIBUTES
+    if get_layout_fingerprint(nodes1, excluded_attributes) == get_layout_fingerprint(nodes2, excluded_attributes) \
+            and len(nodes1) == len(nodes2):
+        return LayoutDiff()
+
+    match_keys = [
+        lambda node: (node.xpath, node.fingerprint(excluded_attributes)),
+        lambda node: node.fingerprint(position_free_excluded_attributes),
+        lambda node: node.xpath,
+        lambda node: (node.class_name, node.resource_id, node.text, node.content_desc),
+    ]
+    remaining1 = list(range(len(nodes1)))
+    remaining2 = list(range(len(nodes2)))
+    matches = []
+    for match_key in match_keys:
+        buckets = defaultdict(list)
+        for index2 in reversed(remaining2):
+            buckets[match_key(nodes2[index2])].append(index2)
+        unmatched1 = []
+        matched2 = set()
+        for index1 in remaining1:
+            bucket = buckets.get(match_key(nodes1[index1]), None)
+            if bucket:
+                index2 = bucket.pop()
+                matched2.add(index2)
+                matches.append((index1, index2))
+            else:
+                unmatched1.append(index1)
+        remaining1 = unmatched1
+        remaining2 = [index2 for index2 in remaining2 if index2 not in matched2]
+
+    modified = []
+    for index1, index2 in sorted(matches):
+        node1, node2 = nodes1[index1], nodes2[index2]
+        if node1.fingerprint(excluded_attributes) == node2.fingerprint(excluded_attributes):
+            continue
+        attributes1 = node1.toJSON(excluded_attributes)
+        attributes2 = node2.toJSON(excluded_attributes)
+        deltas = {name: (value, attributes2.get(name, None)) for name, value in attributes1.items()
+                  if value != attributes2.get(name, None)}
+        modified.append((node1, node2, deltas))
+    return LayoutDiff(added=[nodes2[index2] for index2 in remaining2],
+                      removed=[nodes1[index1] for index1 in remaining1],
+                      modified=modified)
+
+
+LAYOUT_DIFF_CACHE_SIZE = 128
+_layout_diff_cache = OrderedDict()
+_layout_diff_cache_lock = threading.Lock()
+
+
+def _get_cached_diff(key: Tuple, create_diff: Callable[[], LayoutDiff]) -> LayoutDiff:
+    with _layout_diff_cache_lock:
+        layout_diff = _layout_diff_cache.get(key, None)
+        if layout_diff is not None:
+            _layout_diff_cache.move_to_end(key)
+            return layout_diff
+    layout_diff = create_diff()
+    with _layout_diff_cache_lock:
+        _layout_diff_cache[key] = layout_diff
+        while len(_layout_diff_cache) > LAYOUT_DIFF_CACHE_SIZE:
+            _layout_diff_cache.popitem(last=False)
+    return layout_diff
+
+
+def diff_layouts(layout1: str, layout2: str, excluded_attributes: List[str] = None) -> LayoutDiff:
+    """
+    Returns the structural difference of two layouts (see `diff_nodes`). The results are cached per pair of layouts,
+    so the returned LayoutDiff must not be modified.
+    """
+    def create_diff() -> LayoutDiff:
+        nodes1 = NodesFactory().with_layout(layout1).with_xpath_pass().with_ad_detection().build()
+        nodes2 = NodesFactory().with_layout(layout2).with_xpath_pass().with_ad_detection().build()
+        return diff_nodes(nodes1, nodes2, excluded_attributes)
+
+    key = (hashlib.blake2b(layout1.encode('utf-8'), digest_size=16).digest(),
+           hashlib.blake2b(layout2.encode('utf-8'), digest_size=16).digest(),
+           tuple(excluded_attributes) if excluded_attributes else ())
+    return _get_cached_diff(key, create_diff)
+
+
+def diff_layout_paths(layout_path1: Union[Path, str], layout_path2: Union[Path, str],
+                      excluded_attributes: List[str] = None) -> LayoutDiff:
+    """
+    Returns the structural difference of two layout files (see `diff_nodes`). The nodes are built through the layout
+    cache and the results are cached per pair of files (and their modification times), so the returned LayoutDiff
+    must not be modified.
+    """
+    def create_diff() -> LayoutDiff:
+        nodes1 = NodesFactory().with_layout_path(layout_path1, use_cache=True).with_xpath_pass().with_ad_detection() \
+            .build()
+        nodes2 = NodesFactory().with_layout_path(layout_path2, use_cache=True).with_xpath_pass().with_ad_detection() \
+            .build()
+        return diff_nodes(nodes1, nodes2, excluded_attributes)
+
+    key1 = LayoutCache.create_key(layout_path1, ())
+    key2 = LayoutCache.create_key(layout_path2, ())
+    if key1 is None or key2 is None:
+        return create_diff()
+    return _get_cached_diff((key1, key2, tuple(excluded_attributes) if excluded_attributes else ()), create_diff)
+
+
+XPATH_INDEX_PATTERN = re.compile(r'\[\d+\]')
+
+
+def max_subsequence_substring(string_1: str, string_2: str) -> int:
+    """
+    Returns the length of the longest substring of string_2 which is a subsequence of string_1. For each end of the
+    substring, its characters are matched from the end to the last possible positions of string_1, which is what
+    the dynamic programming of the link below computes, without its (quadratic) table.
+    https://www.geeksforgeeks.org/find-length-longest-subsequence-one-string-substring-another-string/
+    """
+    result = 0
+    for end in range(len(string_2), 0, -1):
+        if end <= result:
+            break
+        position = len(string_1)
+        start = end
+        while start > 0:
+            position = string_1.rfind(string_2[start - 1], 0, position)
+            if position < 0:
+                break
+            start -= 1
+        result = max(result, end - start)
+    return result
+
+
 def get_xpath_from_xml_element(xml_element):
     def __get_element_class(my_xml_element):
         # for XPATH we have to count only for nodes with same type!
@@ -508,11 +1907,39 @@ def get_xpath_from_xml_element(xml_element):
     return path
 
 
+_XPATH_SEGMENT_PATTERN = re.compile(r"(.*)\[(\d+)]")
+
+
 def get_element_from_xpath(layout: str, xpath: str) -> Union[etree.ElementTree, None]:
-    possible_nodes = get_nodes(layout, filter_query=lambda node: node.xpath == xpath)
-    if len(possible_nodes) != 1:
+    """
+    Returns the XML element of the layout with the given xpath (as created by `NodesFactory.with_xpath_pass`), or
+    None if it doesn't exist. Instead of creating Nodes for the whole layout, it follows the segments of the xpath
+    from the root, and only looks at the children of the elements on the path.
+    """
+    try:
+        parser = etree.XMLParser(ns_clean=True, recover=True, encoding='utf-8')
+        element = etree.fromstring(layout.encode('utf-8'), parser)
+    except Exception as e:
+        logger.error(f"Exception in parsing the layout: {e}")
+        return None
+    if element is None or not xpath.startswith("/"):
         return None
-    return possible_nodes[0].xml_element
+    for segment in xpath[1:].split("/"):
+        segment_match = _XPATH_SEGMENT_PATTERN.fullmatch(segment)
+        class_name, position = (segment_match.group(1), int(segment_match.group(2))) if segment_match \
+            else (segment, None)
+        same_class_children = [child for child in element.findall("node")
+                               if child.get('class', child.get('class_name', "")) == class_name]
+        if position is None:
+            # Without the position, the class should be unique among siblings
+            if len(same_class_children) != 1:
+                return None
+            element = same_class_children[0]
+        else:
+            if len(same_class_children) < 2 or not (1 <= position <= len(same_class_children)):
+                return None
+            element = same_class_children[position - 1]
+    return element
 
 
 def is_clickable_element_or_none(dom: str, xpath: str) -> bool:
@@ -1,106 +1,231 @@
 import logging
 import asyncio
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 # TODO: Need to decompose latte_utils into latte_comms and latte_navigations
-from latte_utils import is_latte_live
-from consts import DEVICE_NAME
-from shell_utils import run_bash
+from latte_utils import get_latte_heartbeat
+from consts import DEVICE_NAME, A11Y_SERVICE_READY_TIMEOUT, A11Y_SERVICE_POLL_INTERVAL, LATTE_HEARTBEAT_INTERVAL
+from adb_transport import run_device_shell
 
 logger = logging.getLogger(__name__)
 
 
+class A11yServiceState:
+    """
+    The last known enabled accessibility services of a device, which is updated whenever the services are read or
+    written by A11yServiceManager. If the device is changed by others (e.g., an emulator snapshot is loaded), the
+    state should be invalidated.
+    """
+
+    def __init__(self, device_name: str):
+        self.device_name = device_name
+        self.enabled_services: Optional[List[str]] = None
+
+    def is_known(self) -> bool:
+        return self.enabled_services is not None
+
+
 class A11yServiceManager:
     services = {"tb": "com.google.android.marvin.talkback/com.google.android.marvin.talkback.TalkBackService",
                 "latte": "dev.navids.latte/dev.navids.latte.app.MyLatteService"}
+    # The labels of the services in the bound services of `dumpsys accessibility`
+    service_labels = {"tb": "TalkBack"}
+    _states: Dict[str, A11yServiceState] = {}
 
     @staticmethod
-    async def get_enabled_services(simplify: bool = False, device_name: str = DEVICE_NAME) -> List[str]:
-        _, enabled_services, _ = \
-            await run_bash(f"adb -s {device_name} shell settings get secure enabled_accessibility_services")
-        if 'null' in enabled_services:
-            return []
+    def get_state(device_name: str = DEVICE_NAME) -> A11yServiceState:
+        if device_name not in A11yServiceManager._states:
+            A11yServiceManager._states[device_name] = A11yServiceState(device_name)
+        return A11yServiceManager._states[device_name]
+
+    @staticmethod
+    def invalidate(device_name: str = DEVICE_NAME) -> None:
+        """
+        Forgets the enabled services of the device, the next call reads them from the device
+        """
+        A11yServiceManager.get_state(device_name).enabled_services = None
+
+    @staticmethod
+    def _simplify(service_names: List[str]) -> List[str]:
         result = []
-        for service in enabled_services.strip().split(':'):
-            service_name = service
-            if simplify:
-                for key, value in A11yServiceManager.services.items():
-                    if value == service_name:
-                        service_name = key
-                        break
+        for service_name in service_names:
+            for key, value in A11yServiceManager.services.items():
+                if value == service_name:
+                    service_name = key
+                    break
             result.append(service_name)
         return result
 
     @staticmethod
-    async def is_enabled(service_name: str, device_name: str = DEVICE_NAME) -> bool:
-        if service_name not in A11yServiceManager.services:
-            return False
-        enabled_services = await A11yServiceManager.get_enabled_services(device_name=device_name)
-        return A11yServiceManager.services[service_name] in enabled_services
+    async def get_enabled_services(simplify: bool = False,
+                                   use_cache: bool = False,
+                                   device_name: str = DEVICE_NAME) -> List[str]:
+        state = A11yServiceManager.get_state(device_name)
+        if not (use_cache and state.is_known()):
+            _, enabled_services, _ = \
+                await run_device_shell("settings get secure enabled_accessibility_services", device_name=device_name)
+            if 'null' in enabled_services or len(enabled_services.strip()) == 0:
+                state.enabled_services = []
+            else:
+                state.enabled_services = enabled_services.strip().split(':')
+        result = list(state.enabled_services)
+        return A11yServiceManager._simplify(result) if simplify else result
 
     @staticmethod
-    async def enable(service_names: Union[str, List[str]], device_name: str = DEVICE_NAME) -> int:
-        if isinstance(service_names, str):
-            service_names = [service_names]
-        enabled_services = await A11yServiceManager.get_enabled_services(device_name=device_name)
-        requested_services = []
-        for service_name in service_names:
+    async def _put_enabled_services(enabled_services: List[str], device_name: str = DEVICE_NAME) -> bool:
+        enabled_services_str = ":".join(enabled_services)
+        if len(enabled_services_str) == 0:
+            r_code, *_ = await run_device_shell("settings delete secure enabled_accessibility_services",
+                                                device_name=device_name)
+        else:
+            r_code, *_ = await run_device_shell(
+                f"settings put secure enabled_accessibility_services {enabled_services_str}", device_name=device_name)
+        if r_code == 0:
+            A11yServiceManager.get_state(device_name).enabled_services = list(enabled_services)
+        else:
+            A11yServiceManager.invalidate(device_name)
+        return r_code == 0
+
+    @staticmethod
+    async def update_services(enabled_service_names: List[str] = None,
+                              disabled_service_names: List[str] = None,
+                              use_cache: bool = True,
+                              device_name: str = DEVICE_NAME) -> int:
+        """
+        Enables and disables the given services (e.g., 'tb' and 'latte') with one write to the settings, if they are
+        not already in the requested state. Returns the number of changed services, or -1 if the settings could not
+        be written.
+        """
+        enabled_service_names = enabled_service_names if enabled_service_names is not None else []
+        disabled_service_names = disabled_service_names if disabled_service_names is not None else []
+        enabled_services = await A11yServiceManager.get_enabled_services(use_cache=use_cache, device_name=device_name)
+        requested_services = [service for service in enabled_services
+                              if all(A11yServiceManager.services.get(service_name, None) != service
+                                     for service_name in disabled_service_names)]
+        disabled_count = len(enabled_services) - len(requested_services)
+        enabled_count = 0
+        for service_name in enabled_service_names:
             if service_name not in A11yServiceManager.services:
                 continue
             actual_service_name = A11yServiceManager.services[service_name]
-            if actual_service_name in enabled_services:
+            if actual_service_name in requested_services:
                 continue
             requested_services.append(actual_service_name)
-        if len(requested_services) == 0:
+            enabled_count += 1
+        if enabled_count + disabled_count == 0:
             return 0
+        if not await A11yServiceManager._put_enabled_services(requested_services, device_name=device_name):
+            return -1
+        return enabled_count + disabled_count
+
+    @staticmethod
+    async def is_enabled(service_name: str, use_cache: bool = False, device_name: str = DEVICE_NAME) -> bool:
+        """
+        Returns if the service is enabled on the device, the services are read from the device unless `use_cache` is
+        True and they're known (see A11yServiceState)
+        """
+        if service_name not in A11yServiceManager.services:
+            return False
+        enabled_services = await A11yServiceManager.get_enabled_services(use_cache=use_cache, device_name=device_name)
+        return A11yServiceManager.services[service_name] in enabled_services
 
-        enabled_services_str = ":".join(enabled_services + requested_services)
-        r_code, *_ = await run_bash(
-            f"adb -s {device_name} shell settings put secure enabled_accessibility_services {enabled_services_str}")
-        return len(requested_services) if r_code == 0 else -1
+    @staticmethod
+    async def is_bound(service_name: str, device_name: str = DEVICE_NAME) -> bool:
+        """
+        Returns if the service is bound by the accessibility manager, i.e., it's running, not only enabled in the
+        settings
+        """
+        if service_name not in A11yServiceManager.services:
+            return False
+        _, dumpsys_output, _ = await run_device_shell("dumpsys accessibility", device_name=device_name)
+        package_name = A11yServiceManager.services[service_name].split("/")[0]
+        label = A11yServiceManager.service_labels.get(service_name, None)
+        for line in dumpsys_output.splitlines():
+            line = line.strip()
+            if not line.startswith("Bound services:"):
+                continue
+            if package_name in line or (label is not None and f"label={label}," in line):
+                return True
+        return False
+
+    @staticmethod
+    async def wait_for_bound_state(service_name: str,
+                                   is_bound: bool,
+                                   timeout: float = A11Y_SERVICE_READY_TIMEOUT,
+                                   device_name: str = DEVICE_NAME) -> bool:
+        """
+        Waits until the service is bound (or unbound if `is_bound` is False), at most `timeout` seconds. Returns False
+        if the service is not in the requested state.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while await A11yServiceManager.is_bound(service_name, device_name=device_name) != is_bound:
+            if loop.time() >= deadline:
+                logger.warning(f"The service {service_name} is not {'bound' if is_bound else 'unbound'} on "
+                               f"{device_name} after {timeout} seconds")
+                return False
+            await asyncio.sleep(A11Y_SERVICE_POLL_INTERVAL)
+        return True
+
+    @staticmethod
+    async def enable(service_names: Union[str, List[str]], device_name: str = DEVICE_NAME) -> int:
+        if isinstance(service_names, str):
+            service_names = [service_names]
+        return await A11yServiceManager.update_services(enabled_service_names=service_names, device_name=device_name)
 
     @staticmethod
     async def disable(service_name: str, device_name: str = DEVICE_NAME) -> bool:
         if service_name not in A11yServiceManager.services:
             return False
-        enabled_services = await A11yServiceManager.get_enabled_services(device_name=device_name)
-        if A11yServiceManager.services[service_name] not in enabled_services:
+        return await A11yServiceManager.update_services(disabled_service_names=[service_name],
+                                                        device_name=device_name) >= 0
+
+    @staticmethod
+    async def wait_for_latte(timeout: float = A11Y_SERVICE_READY_TIMEOUT, device_name: str = DEVICE_NAME) -> bool:
+        """
+        Waits until the heartbeat of Latte finds it live (at most `timeout` seconds), returns False if it's not alive
+        """
+        if await get_latte_heartbeat(device_name).wait_until_live(timeout):
             return True
-        enabled_services.remove(A11yServiceManager.services[service_name])
-        enabled_services_str = ":".join(enabled_services)
-        if len(enabled_services_str) == 0:
-            r_code, *_ = await run_bash(
-                f"adb -s {device_name} shell settings delete secure enabled_accessibility_services")
-        else:
-            r_code, *_ = await run_bash(
-                f"adb -s {device_name} shell settings put secure enabled_accessibility_services {enabled_services_str}")
-        return r_code == 0
+        logger.warning(f"Latte is not alive on {device_name} after {timeout} seconds")
+        return False
 
     @staticmethod
     async def setup_latte_a11y_services(tb=False, device_name: str = DEVICE_NAME) -> None:
+        """
+        Enables Latte (and TalkBack if `tb` is True, otherwise disables it) and waits until Latte is alive. The
+        settings are written only if the services on the device (which are cached) are not in the requested state,
+        then it waits until TalkBack is bound or unbound.
+        """
         requested_services = ["latte"]
+        disabled_services = []
         if tb:
             requested_services.append("tb")
-        elif await A11yServiceManager.is_enabled("tb", device_name=device_name):
-            logger.debug("Disabling TalkBack...")
-            await A11yServiceManager.disable("tb", device_name=device_name)
-            await asyncio.sleep(1)
-        for i in range(3):
-            enabled_count = await A11yServiceManager.enable(requested_services, device_name=device_name)
-            if enabled_count > 0:
-                logger.debug(f"{enabled_count} services are enabled from {requested_services}")
-                await asyncio.sleep(1)
-                break
-            elif enabled_count == 0:
-                break
-            else:
+        else:
+            disabled_services.append("tb")
+        for use_cache in [True, False]:
+            changed_count = -1
+            for i in range(3):
+                changed_count = await A11yServiceManager.update_services(requested_services,
+                                                                         disabled_services,
+                                                                         use_cache=use_cache and i == 0,
+                                                                         device_name=device_name)
+                if changed_count >= 0:
+                    break
                 logger.warning(f"There was an issue with enabling services {requested_services}, Try: {i}")
-        live_latte = False
-        for i in range(10):
-            if await is_latte_live(device_name=device_name):
-                live_latte = True
-                break
-            else:
-                logger.info(f"Waiting for Latte to be alive...")
-        if not live_latte:
-            # TODO: too harsh, it's better to return live_latte and let the outer method decides
-            raise "Latte is not alive"
+            if use_cache and changed_count == 0:
+                # The cached services are already in the requested state, which is confirmed if Latte is alive
+                if await A11yServiceManager.wait_for_latte(timeout=LATTE_HEARTBEAT_INTERVAL, device_name=device_name):
+                    return
+                A11yServiceManager.invalidate(device_name)
+                continue
+            if changed_count > 0:
+                logger.debug(f"{changed_count} services are changed, enabled: {requested_services}, "
+                             f"disabled: {disabled_services}")
+                get_latte_heartbeat(device_name).invalidate()
+                # Latte is usually connected already, the commands of TalkBack need it to be (un)bound as well
+                await A11yServiceManager.wait_for_bound_state("tb", tb, device_name=device_name)
+            if await A11yServiceManager.wait_for_latte(device_name=device_name):
+                return
+            break
+        # TODO: too harsh, it's better to return live_latte and let the outer method decides
+        raise Exception("Latte is not alive")
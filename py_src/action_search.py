@@ -47,9 +47,10 @@ class SearchActionQuery:
     def contains_layout_with_attrs(self, attr_names: List[str], attr_queries: List[str]):
         def layout_attr_satisfies(address_book: AddressBook, action_result: ActionResult) -> bool:
             nodes = NodesFactory() \
-                .with_layout_path(address_book.get_layout_path(AddressBook.BASE_MODE, AddressBook.INITIAL)) \
+                .with_layout_path(address_book.get_layout_path(AddressBook.BASE_MODE, AddressBook.INITIAL), use_cache=True) \
                 .with_xpath_pass() \
                 .with_ad_detection() \
+                .with_streaming(release_xml_elements=True) \
                 .build()
             return contains_node_with_attrs(nodes, attr_names, attr_queries)
         if attr_names and attr_queries:
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import shlex
+import time
+import uuid
+import weakref
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from ppadb.connection_async import ConnectionAsync
+
+from consts import DEVICE_NAME, ADB_HOST, ADB_PORT, DEVICE_SHELL_POOL_SIZE
+from shell_utils import run_bash
+
+logger = logging.getLogger(__name__)
+
+
+class ShellSessionClosedError(ConnectionError):
+    """
+    The session is closed, `received_output` is true if any output of the command had arrived before
+    """
+
+    def __init__(self, message: str, received_output: bool = False):
+        super().__init__(message)
+        self.received_output = received_output
+
+
+class ShellSessionOpenError(ConnectionError):
+    pass
+
+
+class ShellSession:
+    """
+    A persistent shell (`sh`) on the device over a connection to the ADB server. The commands are written to the
+    standard input of the shell one by one, and the end of the output of each command is detected by a marker which
+    is printed with the exit code after the command. Similar to `adb exec-out`, the standard error is merged into
+    the output.
+    """
+
+    def __init__(self, device_name: str = DEVICE_NAME, adb_host: str = ADB_HOST, adb_port: int = ADB_PORT):
+        self.device_name = device_name
+        self.adb_host = adb_host
+        self.adb_port = adb_port
+        self.connection = None
+        self.marker = f"__AXER_SHELL_{uuid.uuid4().hex}__"
+        self._buffer = bytearray()
+
+    def is_open(self) -> bool:
+        return self.connection is not None
+
+    async def open(self) -> 'ShellSession':
+        connection = await ConnectionAsync(self.adb_host, self.adb_port).connect()
+        try:
+            await connection.send(f"host:transport:{self.device_name}")
+            await connection.send("shell:sh")
+        except BaseException:
+            await connection.close()
+            raise
+        self.connection = connection
+        return self
+
+    async def close(self) -> None:
+        connection = self.connection
+        self.connection = None
+        if connection is not None:
+            await connection.close()
+
+    async def execute(self, command: str) -> Tuple[int, str]:
+        """
+        Executes the command and returns its exit code and output. The command is executed in a subshell without
+        standard input, so it cannot change the state of the session.
+        """
+        if self.connection is None:
+            raise ShellSessionClosedError(f"The shell session of {self.device_name} is closed")
+        # The new line before ')' ends a possible comment in the command
+        script = f"( {command}\n) </dev/null 2>&1; printf '\\n{self.marker} %d\\n' $?\n"
+        end_pattern = f"\n{self.marker} ".encode('utf-8')
+        received_output = False
+        try:
+            await self.connection.write(script.encode('utf-8'))
+            while True:
+                end_index = self._buffer.find(end_pattern)
+                if end_index >= 0:
+                    line_end_index = self._buffer.find(b"\n", end_index + len(end_pattern))
+                    if line_end_index >= 0:
+                        output = bytes(self._buffer[:end_index])
+                        return_code = int(self._buffer[end_index + len(end_pattern):line_end_index])
+                        del self._buffer[:line_end_index + 1]
+                        return return_code, output.decode('utf-8')
+                data = await self.connection.read(4096)
+                if not data:
+                    raise ShellSessionClosedError(f"The shell session of {self.device_name} is closed by the device",
+                                                  received_output=received_output)
+                received_output = True
+                self._buffer += data
+        except OSError as e:
+            await self.close()
+            if isinstance(e, ShellSessionClosedError):
+                raise
+            raise ShellSessionClosedError(f"The shell session of {self.device_name} is broken: {e}",
+                                          received_output=received_output) from e
+
+
+class CommandLatency:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0
+        self.max_time = 0
+
+    def add(self, latency: float) -> None:
+        self.count += 1
+        self.total_time += latency
+        self.max_time = max(self.max_time, latency)
+
+    def toJSON(self) -> dict:
+        return {'count': self.count,
+                'mean_time': self.total_time / self.count if self.count > 0 else 0,
+                'max_time': self.max_time}
+
+
+class DeviceShellPool:
+    """
+    Keeps up to `size` persistent shell sessions of a device and executes the commands on the idle sessions, i.e.,
+    up to `size` commands are executed at the same time and the others wait. The sessions are opened lazily, and
+    a session is discarded if its command fails or is cancelled. If an idle session was closed by the device while
+    it was idle (i.e., it's closed before any output of the command arrives), the command is executed again on a new
+    session once. The latency of commands is recorded per program
+    (the first word of the command, e.g., 'dumpsys') in `latencies`.
+    """
+
+    def __init__(self,
+                 device_name: str = DEVICE_NAME,
+                 size: int = DEVICE_SHELL_POOL_SIZE,
+                 adb_host: str = ADB_HOST,
+                 adb_port: int = ADB_PORT):
+        self.device_name = device_name
+        self.size = size
+        self.adb_host = adb_host
+        self.adb_port = adb_port
+        self.latencies: Dict[str, CommandLatency] = defaultdict(CommandLatency)
+        self._idle_sessions: List[ShellSession] = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def execute(self, command: str, timeout: float = None) -> Tuple[int, str, str]:
+        """
+        Executes the command on the device, returns the exit code, the output, and an empty string (the standard
+        error is merged into the output) similar to `run_bash`. Raises ShellSessionOpenError if a new session cannot
+        be opened, i.e., the command is not executed.
+        """
+        async with self._semaphore:
+            is_reused = bool(self._idle_sessions)
+            session = self._idle_sessions.pop() if is_reused else await self._open_session()
+            start_time = time.perf_counter()
+            try:
+                try:
+                    return_code, output = await asyncio.wait_for(session.execute(command), timeout)
+                except ShellSessionClosedError as e:
+                    if not is_reused or e.received_output:
+                        raise
+                    logger.warning(f"The idle shell session of {self.device_name} was closed, executing '{command}' "
+                                   f"on a new session")
+                    session = await self._open_session()
+                    remaining_timeout = None if timeout is None else \
+                        max(timeout - (time.perf_counter() - start_time), 0)
+                    return_code, output = await asyncio.wait_for(session.execute(command), remaining_timeout)
+            except BaseException:
+                await session.close()
+                raise
+            latency = time.perf_counter() - start_time
+            self._idle_sessions.append(session)
+        program = command.split(maxsplit=1)[0] if command.strip() else ""
+        self.latencies[program].add(latency)
+        logger.debug(f"Executed '{command}' on {self.device_name} in {latency * 1000:.1f} ms")
+        return return_code, output, ""
+
+    async def _open_session(self) -> ShellSession:
+        try:
+            return await ShellSession(self.device_name, self.adb_host, self.adb_port).open()
+        except (OSError, RuntimeError) as e:
+            raise ShellSessionOpenError(f"The shell session of {self.device_name} could not be opened: {e!r}") from e
+
+    def latency_summary(self) -> Dict[str, dict]:
+        return {program: latency.toJSON() for program, latency in self.latencies.items()}
+
+    async def close(self) -> None:
+        sessions = self._idle_sessions
+        self._idle_sessions = []
+        for session in sessions:
+            await session.close()
+
+
+# The pools of each event loop (the streams cannot be shared between loops, e.g., between `synch_run` calls)
+_shell_pools = weakref.WeakKeyDictionary()
+
+
+def get_shell_pool(device_name: str = DEVICE_NAME) -> DeviceShellPool:
+    pools = _shell_pools.setdefault(asyncio.get_running_loop(), {})
+    if device_name not in pools:
+        pools[device_name] = DeviceShellPool(device_name)
+    return pools[device_name]
+
+
+async def run_device_shell(command: str, device_name: str = DEVICE_NAME, timeout: float = None) -> (int, str, str):
+    """
+    Executes the shell command on the device through the pool of persistent shell sessions. If the session cannot be
+    opened (e.g., the ADB server is not reachable with ppadb), a new `adb shell` process executes the command. A
+    command which is started but not completed (e.g., it times out, or its session is closed after some of its output
+    arrives) is not executed again.
+    """
+    try:
+        return await get_shell_pool(device_name).execute(command, timeout=timeout)
+    except ShellSessionOpenError as e:
+        logger.warning(f"{e}, executing with adb")
+        return await run_bash(f"adb -s {device_name} shell {shlex.quote(command)}")
+    except ShellSessionClosedError as e:
+        logger.error(f"The command '{command}' could not be completed: {e}")
+        return 255, "", str(e)
+    except asyncio.TimeoutError:
+        # It must be caught before OSError, since TimeoutError is an OSError from Python 3.11
+        logger.error(f"The command '{command}' did not complete in {timeout} seconds")
+        return 124, "", f"Timeout after {timeout} seconds"
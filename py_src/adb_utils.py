@@ -6,6 +6,8 @@ import xmlformatter
 import random
 from typing import Optional, Union
 from consts import DEVICE_NAME
+from adb_transport import run_device_shell
+from latte_channel import wait_for_latte_file, LatteChannelClosedError
 from shell_utils import run_bash
 
 logger = logging.getLogger(__name__)
@@ -54,21 +56,46 @@ async def save_snapshot(snapshot_name, device_name: str = DEVICE_NAME) -> None:
     await run_bash(cmd)
 
 
+ACTIVITY_NAME_PATTERN = "mObscuringWindow"
+
+
 async def get_current_activity_name(device_name: str = DEVICE_NAME) -> str:
-    cmd = f"adb -s {device_name} shell dumpsys window windows  | grep 'mObscuringWindow'"
-    r_code, stdout, stderr = await run_bash(cmd)
+    cmd = f"dumpsys window windows | grep '{ACTIVITY_NAME_PATTERN}'"
+    r_code, stdout, stderr = await run_device_shell(cmd, device_name=device_name)
     return stdout
 
 
+def extract_activity_name(windows: str) -> str:
+    """
+    Returns the same result as `get_current_activity_name` from the output of `get_windows`
+    """
+    return "".join(f"{line}\n" for line in windows.split("\n") if ACTIVITY_NAME_PATTERN in line)
+
+
+async def is_boot_completed(device_name: str = DEVICE_NAME) -> bool:
+    r_code, stdout, _ = await run_device_shell("getprop sys.boot_completed", device_name=device_name)
+    return r_code == 0 and stdout.strip() == "1"
+
+
+async def get_focused_windows(device_name: str = DEVICE_NAME) -> str:
+    """
+    Returns the focused window and app of the device (from `dumpsys window windows`), which changes while an app is
+    being loaded
+    """
+    cmd = "dumpsys window windows | grep -E 'mCurrentFocus|mFocusedApp'"
+    r_code, stdout, _ = await run_device_shell(cmd, device_name=device_name)
+    return stdout.strip() if r_code == 0 else ""
+
+
 async def get_windows(device_name: str = DEVICE_NAME) -> str:
-    cmd = f"adb -s {device_name} shell dumpsys window windows"
-    r_code, stdout, stderr = await run_bash(cmd)
+    cmd = "dumpsys window windows"
+    r_code, stdout, stderr = await run_device_shell(cmd, device_name=device_name)
     return stdout
 
 
 async def get_activities(device_name: str = DEVICE_NAME) -> str:
-    cmd = f"adb -s {device_name} shell dumpsys activity activities"
-    r_code, stdout, stderr = await run_bash(cmd)
+    cmd = "dumpsys activity activities"
+    r_code, stdout, stderr = await run_device_shell(cmd, device_name=device_name)
     return stdout
 
 
@@ -84,14 +111,14 @@ async def is_android_activity_on_top(device_name: str = DEVICE_NAME) -> bool:
 async def local_android_file_exists(file_path: str,
                                     pkg_name: str = LATTE_PKG_NAME,
                                     device_name: str = DEVICE_NAME) -> bool:
-    cmd = f"adb -s {device_name} exec-out run-as {pkg_name} ls files/{file_path}"
-    _, stdout, _ = await run_bash(cmd)
+    cmd = f"run-as {pkg_name} ls files/{file_path}"
+    _, stdout, _ = await run_device_shell(cmd, device_name=device_name)
     return "No such file or directory" not in stdout
 
 
 async def remove_local_android_file(file_path: str, pkg_name: str = LATTE_PKG_NAME, device_name: str = DEVICE_NAME):
-    rm_cmd = f"adb -s {device_name} exec-out run-as {pkg_name} rm files/{file_path}"
-    await run_bash(rm_cmd)
+    rm_cmd = f"run-as {pkg_name} rm files/{file_path}"
+    await run_device_shell(rm_cmd, device_name=device_name)
 
 
 async def read_local_android_file(file_path: str,
@@ -99,6 +126,19 @@ async def read_local_android_file(file_path: str,
                                   wait_time: int = -1,
                                   remove_after_read: bool = True,
                                   device_name: str = DEVICE_NAME) -> Optional[str]:
+    """
+    Waits for the file in the local directory of the package and returns its content, or None if it's not created
+    in `wait_time` seconds (non-positive means no limit). The files of Latte are pushed through the Latte channel,
+    if it's not available the file is polled.
+    """
+    if pkg_name == LATTE_PKG_NAME:
+        try:
+            return await wait_for_latte_file(file_path,
+                                             wait_time=wait_time,
+                                             remove_after_read=remove_after_read,
+                                             device_name=device_name)
+        except LatteChannelClosedError as e:
+            logger.debug(f"Polling {file_path} since the Latte channel is not available: {e}")
     sleep_time = 0.5
     index = 0
     while not await local_android_file_exists(file_path, pkg_name, device_name=device_name):
@@ -108,8 +148,8 @@ async def read_local_android_file(file_path: str,
         if index % 4 == 0:
             logger.debug(f"Waiting {int(index * sleep_time)} seconds for {file_path}")
         await asyncio.sleep(sleep_time)
-    cmd = f"adb -s {device_name} exec-out run-as {pkg_name} cat files/{file_path}"
-    _, content, _ = await run_bash(cmd)
+    cmd = f"run-as {pkg_name} cat files/{file_path}"
+    _, content, _ = await run_device_shell(cmd, device_name=device_name)
     if remove_after_read:
         await remove_local_android_file(file_path, pkg_name, device_name=device_name)
     return content
@@ -120,8 +160,8 @@ async def get_file_nums(dir_path: str, device_name: str = DEVICE_NAME) -> int:
         Takes the directory path in Android, returns the number of files in that directory.
        Method uses for Sugilite
    """
-    cmd = f"adb -s {device_name} shell ls sdcard/{dir_path} | adb -s {device_name} shell grep . -c"
-    _, stdout, _ = await run_bash(cmd)
+    cmd = f"ls sdcard/{dir_path} | grep . -c"
+    _, stdout, _ = await run_device_shell(cmd, device_name=device_name)
     return stdout
 
 
@@ -135,8 +175,8 @@ async def get_most_recent_file(dir_path: str, prev_num: int, sleep_time: int, de
     while (cur_num == prev_num):
         cur_num = await get_file_nums(dir_path)
         await asyncio.sleep(sleep_time)
-    cmd = f"adb -s {device_name} shell ls -t sdcard/{dir_path} | adb -s {device_name} shell head -n1"
-    _, most_recent_name, _ = await run_bash(cmd)
+    cmd = f"ls -t sdcard/{dir_path} | head -n1"
+    _, most_recent_name, _ = await run_device_shell(cmd, device_name=device_name)
     most_recent_name = most_recent_name.strip()
     return most_recent_name
 
@@ -165,6 +205,6 @@ async def launch_specified_application(pkg_name: str, device_name: str = DEVICE_
     ''' Starts the android application based on the provided package name
         Method uses for Sugilite
     '''
-    cmd = f"adb -s {device_name} shell monkey -p {pkg_name} 1"
-    return_code, _, _ = await run_bash(cmd)
+    cmd = f"monkey -p {pkg_name} 1"
+    return_code, _, _ = await run_device_shell(cmd, device_name=device_name)
     return return_code == 0
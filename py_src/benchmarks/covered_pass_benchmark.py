@@ -0,0 +1,80 @@
+"""
+Compares the vectorized covered pass of NodesFactory with the previous (pure Python) implementation on synthetic
+layouts with 5k+ nodes. It checks that both produce the same `covered` values and reports the timings.
+
+Usage (from py_src): python -m benchmarks.covered_pass_benchmark
+"""
+from typing import Dict, List
+
+from GUI_utils import NodesFactory, NodesPass, Node, bounds_included, calculate_overlap
+from benchmarks.synthetic_layouts import create_synthetic_layouts
+
+
+def with_legacy_covered_pass(factory: NodesFactory) -> NodesFactory:
+    """
+    The previous implementation of `NodesFactory.with_covered_pass` which checks each child against all boxes drawn
+    so far one by one.
+    """
+    covered_bounds_list_attr = "legacy_covered_bounds_list"
+
+    def calculate_covered(node: Node,
+                          extra: Dict,
+                          children_nodes: List[Node],
+                          child_to_extras_map: Dict[Node, Dict]) -> None:
+        for child_node in children_nodes:
+            child_to_extras_map[child_node][covered_bounds_list_attr] = []
+        if node.covered:
+            for child_node in children_nodes:
+                if not child_node.is_practically_invisible():
+                    child_node.covered = True
+        else:
+            covered_bounds_so_far = list(extra.get(covered_bounds_list_attr, []))
+            for child_node in sorted(children_nodes, key=lambda x: -x.drawing_order):
+                if child_node.is_practically_invisible():
+                    continue
+                for covered_bounds in covered_bounds_so_far:
+                    if bounds_included(covered_bounds, child_node.bounds):
+                        child_node.covered = True
+                        break
+                    else:
+                        overlap_bounds = calculate_overlap(covered_bounds, child_node.bounds)
+                        if overlap_bounds:
+                            child_to_extras_map[child_node][covered_bounds_list_attr].append(overlap_bounds)
+                if not child_node.covered:
+                    covered_bounds_so_far.append(child_node.bounds)
+
+    return factory.with_pass(NodesPass(name=calculate_covered.__name__,
+                                       function=calculate_covered,
+                                       reads=['covered', 'visible', 'bounds', 'drawing_order', 'class_name'],
+                                       writes=['covered']))
+
+
+def time_covered_pass(factory: NodesFactory, repeat: int) -> (float, List[Node]):
+    """
+    Builds the nodes `repeat` times and returns the best total time spent in the covered pass (the last pass)
+    """
+    covered_pass_name = factory.passes[-1].name
+    factory.with_pass_timing()
+    pass_times = []
+    nodes = []
+    for _ in range(repeat):
+        factory.pass_timings.clear()
+        nodes = factory.build()
+        pass_times.append(factory.pass_timings[covered_pass_name])
+    return min(pass_times), nodes
+
+
+def main(repeat: int = 3):
+    for name, layout in create_synthetic_layouts():
+        legacy_time, legacy_nodes = time_covered_pass(with_legacy_covered_pass(NodesFactory().with_layout(layout)),
+                                                      repeat)
+        new_time, new_nodes = time_covered_pass(NodesFactory().with_layout(layout).with_covered_pass(), repeat)
+        if [node.covered for node in legacy_nodes] != [node.covered for node in new_nodes]:
+            raise Exception(f"The covered values are different in layout {name}!")
+        covered_count = sum(node.covered for node in new_nodes)
+        print(f"{name}: {len(new_nodes)} nodes, {covered_count} covered | "
+              f"legacy pass: {legacy_time * 1000:.1f} ms, vectorized pass: {new_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures the construction time and the memory of Nodes created from the elements of a synthetic layout, and the
+time of accessing all of their attributes (e.g., by serializing them).
+
+Usage (from py_src): python -m benchmarks.node_benchmark
+"""
+import gc
+import time
+import tracemalloc
+
+from lxml import etree
+
+from GUI_utils import Node
+from benchmarks.synthetic_layouts import create_synthetic_layout
+
+
+def main(repeat: int = 5):
+    layout = create_synthetic_layout(children_count=80, depth=4)
+    elements = list(etree.fromstring(layout.encode('utf-8')).iter('node'))
+    print(f"{len(elements)} elements")
+
+    construction_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        nodes = [Node.createNodeFromXmlElement(element) for element in elements]
+        elapsed = time.perf_counter() - start_time
+        construction_time = elapsed if construction_time is None else min(construction_time, elapsed)
+    print(f"Construction: {construction_time / len(elements) * 1e6:.2f} us per node")
+
+    nodes = None
+    gc.collect()
+    tracemalloc.start()
+    nodes = [Node.createNodeFromXmlElement(element) for element in elements]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Memory: {memory / len(elements):.0f} bytes per node (after construction)")
+
+    start_time = time.perf_counter()
+    for node in nodes:
+        node.toJSONStr()
+    elapsed = time.perf_counter() - start_time
+    print(f"Serialization (decodes all attributes): {elapsed / len(elements) * 1e6:.2f} us per node")
+
+    gc.collect()
+    tracemalloc.start()
+    nodes = [Node.createNodeFromXmlElement(element) for element in elements]
+    for node in nodes:
+        node.toJSONStr()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Memory: {memory / len(elements):.0f} bytes per node (all attributes decoded)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Reports the peak memory (the maximum resident set size) of building the nodes of a large synthetic layout with the
+regular build, the streaming build, and the streaming build which releases the XML elements while parsing. Each
+build runs in a separate process, and the memory of the process before the build is subtracted.
+
+Usage (from py_src): python -m benchmarks.streaming_memory_benchmark
+"""
+import multiprocessing
+import resource
+
+from GUI_utils import NodesFactory
+from benchmarks.synthetic_layouts import create_synthetic_layout
+
+
+def measure_peak_memory(layout: str, streaming: bool, release_xml_elements: bool, queue: multiprocessing.Queue):
+    start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    factory = NodesFactory().with_layout(layout).with_xpath_pass().with_ad_detection().with_covered_pass()
+    if streaming:
+        factory.with_streaming(release_xml_elements=release_xml_elements)
+    nodes = factory.build()
+    queue.put((len(nodes), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_memory))
+
+
+def main():
+    layout = create_synthetic_layout(children_count=400, depth=4, fan_out=5)
+    context = multiprocessing.get_context("fork")
+    print(f"Layout: {len(layout) / 1024 / 1024:.1f} MB")
+    for name, streaming, release_xml_elements in [("regular", False, False),
+                                                   ("streaming", True, False),
+                                                   ("streaming (release)", True, True)]:
+        queue = context.Queue()
+        process = context.Process(target=measure_peak_memory,
+                                  args=(layout, streaming, release_xml_elements, queue))
+        process.start()
+        node_count, peak_memory = queue.get()
+        process.join()
+        # ru_maxrss is in kilobytes on Linux
+        print(f"{name:>20}: {node_count} nodes, peak memory +{peak_memory / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import random
+from typing import List, Tuple
+
+CLASS_NAMES = ["android.widget.TextView",
+               "android.widget.ImageView",
+               "android.widget.Button",
+               "android.widget.LinearLayout",
+               "android.widget.FrameLayout",
+               "android.view.ViewGroup"]
+
+
+def create_synthetic_layout(children_count: int = 60,
+                            depth: int = 3,
+                            fan_out: int = 4,
+                            screen_bounds: Tuple[int, int, int, int] = (0, 0, 1080, 1920),
+                            seed: int = 0) -> str:
+    """
+    Creates a random layout in the format of uiautomator dumps. The root node has `children_count` children and
+    the rest of the nodes have `fan_out` children until the tree reaches `depth`. The bounds of each child are picked
+    randomly inside its parent, so siblings overlap each other quite often.
+    """
+    rnd = random.Random(seed)
+    lines = ["<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>", '<hierarchy rotation="0">']
+
+    def create_node(index: int, remaining_depth: int, bounds: Tuple[int, int, int, int], count: int):
+        x0, y0, x1, y1 = bounds
+        class_name = rnd.choice(CLASS_NAMES)
+        clickable = rnd.choice(["true", "false"])
+        visible = rnd.choice(["true", "true", "true", "false"])
+        lines.append(f'<node index="{index}" text="text{rnd.randint(0, 99)}" '
+                     f'resource-id="com.example:id/res{rnd.randint(0, 20)}" class="{class_name}" '
+                     f'package="com.example" content-desc="" checkable="false" checked="false" '
+                     f'clickable="{clickable}" enabled="true" focusable="false" focused="false" '
+                     f'long-clickable="false" visible="{visible}" bounds="[{x0},{y0}][{x1},{y1}]" '
+                     f'drawingOrder="{rnd.randint(0, 50)}" importantForAccessibility="true" '
+                     f'actionList="{"4-16" if clickable == "true" else "4"}">')
+        if remaining_depth > 0:
+            for child_index in range(count):
+                cx0 = rnd.randint(x0, max(x0, x1 - 10))
+                cy0 = rnd.randint(y0, max(y0, y1 - 10))
+                create_node(child_index, remaining_depth - 1,
+                            (cx0, cy0, rnd.randint(cx0, x1), rnd.randint(cy0, y1)), fan_out)
+        lines.append('</node>')
+
+    create_node(0, depth, screen_bounds, children_count)
+    lines.append('</hierarchy>')
+    return "\n".join(lines)
+
+
+def create_synthetic_layouts() -> List[Tuple[str, str]]:
+    """
+    :return: A list of (name, layout) of synthetic layouts with 5k+ nodes with different shapes
+    """
+    return [
+        ("wide (5000 siblings)", create_synthetic_layout(children_count=5000, depth=1)),
+        ("feed (80 x 4 x 4 x 4)", create_synthetic_layout(children_count=80, depth=4)),
+        ("deep (4^7)", create_synthetic_layout(children_count=4, depth=7)),
+    ]
@@ -6,11 +6,21 @@ TB_NAVIGATE_TIMEOUT = 4
 TB_SELECT_TIMEOUT = 4
 REGULAR_EXECUTE_TIMEOUT_TIME = 6
 IS_LIVE_TIMEOUT_TIME = 1
+A11Y_SERVICE_READY_TIMEOUT = 10
+LATTE_CHANNEL_HANDSHAKE_TIMEOUT = 1
+LATTE_CHANNEL_COMMAND_TIMEOUT = 10
+LOGCAT_MARKER_TIMEOUT = 5
+SNAPSHOT_READY_TIMEOUT = 10
 # Delays
-CAPTURE_SCREENSHOT_DELAY = 0.5
 CAPTURE_STATE_DELAY = 0.5
+# The time Latte may log the events of an action after it's returned
+LOGCAT_SETTLE_TIME = 1
 REGULAR_EXECUTOR_INTERVAL = 1000
 TB_EXECUTOR_INTERVAL = 1000
+LATTE_HEARTBEAT_INTERVAL = 2
+LATTE_HEARTBEAT_RETRY_INTERVAL = 0.5
+SNAPSHOT_READY_POLL_INTERVAL = 0.2
+A11Y_SERVICE_POLL_INTERVAL = 0.2
 # Retry
 TB_NAVIGATE_RETRY_COUNT = 3
 ACTION_EXECUTION_RETRY_COUNT = 2
@@ -19,15 +29,24 @@ BLIND_MONKEY_TAG = "LATTE_SERVICE"
 BLIND_MONKEY_EVENTS_TAG = "LATTE_A11Y_EVENT_TAG"
 BLIND_MONKEY_INSTRUMENTED_TAG = "BM_INSTRUMENTED"
 TB_TREELIST_TAG = "talkback: TreeDebug:"
+LOGCAT_MARKER_TAG = "AXER_LOGCAT_MARKER"
 # Other Limits
 EXPLORE_VISIT_LIMIT = 3
 MAX_DIRECTIONAL_NAVIGATION = 50
+DEVICE_SHELL_POOL_SIZE = 3
+SCREENSHOT_CACHE_SIZE = 4
+LAST_SCREENSHOTS_CACHE_SIZE = 32
+SCREENSHOT_ENCODER_WORKERS = 2
+LOGCAT_BUFFER_SIZE = 20000
 # Others
 # SCREEN_BOUNDS = [0, 0, 1080, 2220]
 SCREEN_BOUNDS = [0, 0, 1080, 1920]
 DEVICE_NAME = "emulator-5554"
 ADB_HOST = "127.0.0.1"
 ADB_PORT = 5037
+LATTE_CHANNEL_PORT = 8712
+# The time to use file polling after the Latte channel could not be opened
+LATTE_CHANNEL_RETRY_INTERVAL = 5
 WS_IP = "0.0.0.0"
 WS_PORT = 8765
 UIED_PATH = os.getenv('UIED_PATH', None)
@@ -7,7 +7,7 @@ import pathlib
 import random
 import sys
 from collections import defaultdict, Counter, namedtuple
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 from ppadb.client_async import ClientAsync as AdbClient
 from ppadb.device_async import DeviceAsync
@@ -23,6 +23,7 @@ from genymotion_utils import create_instance, stop_instances
 from latte_executor_utils import talkback_tree_nodes, latte_capture_layout, \
     FINAL_ACITON_FILE, report_atf_issues, report_tb_focusables
 from latte_utils import is_latte_live
+from layout_ingestion import map_in_processes
 from padb_utils import ParallelADBLogger, save_screenshot
 from results_utils import AddressBook
 from utils import annotate_elements, synch_run
@@ -177,6 +178,19 @@ def get_data_set_info() -> Dict[str, AppInfo]:
     return apps
 
 
+def summarize_gh_snapshot(snapshot_path: pathlib.Path) -> Tuple[pathlib.Path, Optional[dict]]:
+    """
+    Returns the snapshot path and its numbers in the table of 'gh_latex_main', or None if the snapshot is ignored
+    """
+    address_book = AddressBook(snapshot_path)
+    if address_book.whelper.is_snapshot_ignored():
+        return snapshot_path, None
+    return snapshot_path, {"total_actions": address_book.whelper.get_action_count(),
+                           "gh_actions": address_book.whelper.get_actual_action_count(),
+                           "summary": address_book.whelper.oracle(),
+                           "atf_count": address_book.whelper.get_atf_count()}
+
+
 async def execute_latte_command(device: DeviceAsync, command: str, extra: str):
     padb_logger = ParallelADBLogger(device)
     if command == "tb_a11y_tree":
@@ -268,7 +282,8 @@ async def execute_latte_command(device: DeviceAsync, command: str, extra: str):
         all_results = defaultdict(int)
         app_infos = get_data_set_info()
         COLORED_CELL = "\\cellcolor{LightCyan}"
-        for pkg_name, app_info in app_infos.items():
+        app_paths = {}
+        for pkg_name in app_infos:
             app_path = result_path.joinpath(pkg_name)
             if not app_path.exists() or not app_path.is_dir():
                 continue
@@ -282,6 +297,16 @@ async def execute_latte_command(device: DeviceAsync, command: str, extra: str):
                 continue
             if "com.evozi.injector.lite" in app_path.name:
                 continue
+            app_paths[pkg_name] = app_path
+        # The snapshots are summarized in a pool of processes
+        snapshot_paths = [snapshot_path for app_path in app_paths.values() for snapshot_path in app_path.iterdir()
+                          if snapshot_path.is_dir()]
+        snapshot_results = dict(map_in_processes(summarize_gh_snapshot,
+                                                 snapshot_paths,
+                                                 progress_callback=lambda completed, total, _:
+                                                 logger.debug(f"Summarized snapshots: {completed}/{total}")))
+        for pkg_name, app_path in app_paths.items():
+            app_info = app_infos[pkg_name]
             # app_row = "\\texttt{" + app_path.name[:15] + "}" + ("..." if len(app_path.name) > 15 else "")
             all_results["app_count"] += 1
             # app_row = f"{app_info.type} & {app_info.name}  & {app_info.version_code} & {app_info.category} & {app_info.installs_str}"
@@ -289,16 +314,14 @@ async def execute_latte_command(device: DeviceAsync, command: str, extra: str):
             result = defaultdict(int)
             atf_count = 0
             for s_index, snapshot_path in enumerate(app_path.iterdir()):
-                if not snapshot_path.is_dir():
-                    continue
-                address_book = AddressBook(snapshot_path)
-                if address_book.whelper.is_snapshot_ignored():
+                snapshot_result = snapshot_results.get(snapshot_path)
+                if snapshot_result is None:
                     continue
 
                 result["snapshot_count"] += 1
-                result["total_actions"] += address_book.whelper.get_action_count()
-                result["gh_actions"] += address_book.whelper.get_actual_action_count()
-                snapshot_summary = address_book.whelper.oracle()
+                result["total_actions"] += snapshot_result["total_actions"]
+                result["gh_actions"] += snapshot_result["gh_actions"]
+                snapshot_summary = snapshot_result["summary"]
                 all_results['total_time'] += snapshot_summary["total_time"] if ("us.zoom" not in app_path.name) else 3000
                 all_results['actions_time'] += snapshot_summary["actions_time"] if ("us.zoom" not in app_path.name) else 3000 - snapshot_summary["explore_time"]
                 all_results['explore_time'] += snapshot_summary["explore_time"]
@@ -307,7 +330,7 @@ async def execute_latte_command(device: DeviceAsync, command: str, extra: str):
                 for issue in issue_names:
                     result[issue] += snapshot_summary[issue]
                     result[f"tp_{issue}"] += snapshot_summary[f"tp_{issue}"]
-                atf_count += address_book.whelper.get_atf_count()
+                atf_count += snapshot_result["atf_count"]
             if result["snapshot_count"] != 5:
                 logger.warning(f"App {pkg_name} has {result['snapshot_count']} snapshots!")
             app_row += f"& {result['total_actions']} "  # Total Actions
@@ -1,38 +1,171 @@
 import json
 from enum import Enum
-from typing import List, Union
+from operator import attrgetter
+from typing import Callable, Iterable, List, Union, Any, Tuple
+
+try:
+    # An optional faster parser, the results are the same as `json.loads`
+    import orjson
+except ImportError:
+    orjson = None
+
+_JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+# The types that are serialized without conversion
+_JSON_NATIVE_TYPES = frozenset(_JSON_SCALAR_TYPES + (list, tuple, dict))
+# The same as `json.dumps(..., sort_keys=True)` for the objects without any non-JSON value
+_SORTED_JSON_ENCODER = json.JSONEncoder(sort_keys=True)
+
+
+def json_loads(content: Union[str, bytes]) -> Any:
+    """
+    Same as `json.loads`, but uses orjson if it's installed. The content that orjson does not accept (e.g., NaN or
+    very large integers) is parsed by `json.loads`.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
 
 
 def unsafe_json_load(content: str) -> Union[dict, None]:
     try:
-        return json.loads(content)
+        return json_loads(content)
     except Exception as e:
         return None
 
 
+def _json_key(key) -> str:
+    # The keys of dictionaries in JSON are converted to string similar to `json.dumps`
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, float):
+        return float.__repr__(key)
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {type(key).__name__}')
+
+
+def _create_values_getter(names: List[str]) -> Callable[[Any], Tuple]:
+    # Returns a function which gets the values of the attributes at once
+    if len(names) == 0:
+        return lambda o: ()
+    if len(names) == 1:
+        getter = attrgetter(names[0])
+        return lambda o: (getter(o),)
+    return attrgetter(*names)
+
+
+def _get_items(o, excluded_attributes: List[str], root: 'JSONSerializable') -> dict:
+    """
+    The serialized attributes of the object, the nested JSONSerializable attributes are converted by their `toJSON`
+    (except the root to avoid infinite recursion) and Enums by their values.
+    """
+    if isinstance(o, JSONSerializable):
+        names, values_getter = o._serializable_fields(excluded_attributes)
+    else:
+        names = [k for k in o.__dict__.keys() if k not in excluded_attributes]
+        values_getter = _create_values_getter(names)
+    items = dict(zip(names, values_getter(o)))
+    for name, value in items.items():
+        if type(value) in _JSON_NATIVE_TYPES:
+            continue
+        if isinstance(value, JSONSerializable) and value != root:  # TODO: Possible infinite recursion
+            items[name] = value.toJSON()
+        elif isinstance(value, Enum):
+            items[name] = value.value
+    return items
+
+
+def _to_json_value(value, excluded_attributes: List[str], root: 'JSONSerializable'):
+    """
+    Returns `json.loads(json.dumps(value))` without creating the string for the common types
+    """
+    value_type = type(value)
+    if value_type in _JSON_SCALAR_TYPES:
+        return value
+    if value_type is list or value_type is tuple:
+        return [_to_json_value(item, excluded_attributes, root) for item in value]
+    if value_type is dict:
+        return {_json_key(key): _to_json_value(item, excluded_attributes, root)
+                for key, item in sorted(value.items(), key=lambda kv: kv[0])}
+    # The other objects (e.g., subclasses of builtin types) are converted the same way as `toJSONStr`
+    return json.loads(json.dumps(value,
+                                 default=lambda o: _get_items(o, excluded_attributes, root),
+                                 sort_keys=True))
+
+
+def is_json_equal(value_1, value_2) -> bool:
+    """
+    Checks if the JSON representations of the values are equal, e.g., a tuple and a list with the same items are
+    equal, but 1 and True are not.
+    """
+    if isinstance(value_1, (list, tuple)) and isinstance(value_2, (list, tuple)):
+        return len(value_1) == len(value_2) and all(map(is_json_equal, value_1, value_2))
+    if type(value_1) in _JSON_SCALAR_TYPES and type(value_2) in _JSON_SCALAR_TYPES:
+        return type(value_1) is type(value_2) and value_1 == value_2
+    return json.dumps(value_1, sort_keys=True) == json.dumps(value_2, sort_keys=True)
+
+
 class JSONSerializable:
+    """
+    The serialization of objects to JSON. The JSON dictionary of an object consists of its attributes (except the
+    excluded ones), where the nested JSONSerializable attributes are converted by their `toJSON` and Enums by their
+    values. The classes with fixed attributes (e.g., by `__slots__`) should set SERIALIZABLE_ATTRIBUTES, then the
+    list of serialized attributes is computed once per class and excluded attributes.
+    """
+    __slots__ = ()
+    SERIALIZABLE_ATTRIBUTES = None
+    # Maps the class and the excluded attributes to the sorted names of serialized attributes and their getter
+    _serializable_fields_cache = {}
+
+    def _serializable_attribute_names(self) -> Iterable[str]:
+        """
+        The names of the attributes that are serialized
+        """
+        if self.SERIALIZABLE_ATTRIBUTES is not None:
+            return self.SERIALIZABLE_ATTRIBUTES
+        return self.__dict__.keys()
+
+    def _serializable_fields(self, excluded_attributes: List[str]) -> Tuple[List[str], Callable[[Any], Tuple]]:
+        """
+        Returns the sorted names of the serialized attributes and a function that returns their values
+        """
+        if self.SERIALIZABLE_ATTRIBUTES is None:
+            names = sorted(k for k in self._serializable_attribute_names() if k not in excluded_attributes)
+            return names, _create_values_getter(names)
+        key = (type(self), tuple(excluded_attributes))
+        fields = JSONSerializable._serializable_fields_cache.get(key)
+        if fields is None:
+            names = sorted(k for k in self._serializable_attribute_names() if k not in excluded_attributes)
+            fields = (names, _create_values_getter(names))
+            JSONSerializable._serializable_fields_cache[key] = fields
+        return fields
+
     def toJSONStr(self, excluded_attributes: List[str] = None) -> str:
         if excluded_attributes is None:
             excluded_attributes = []
-
-        def get_items(o) -> dict:
-            res = {}
-            for (k, v) in o.__dict__.items():
-                if k in excluded_attributes:
-                    continue
-                if issubclass(type(v), JSONSerializable) and v != self:  # TODO: Possible infinite recursion
-                    v = v.toJSON()
-                if issubclass(type(v), Enum):
-                    v = v.value
-                res[k] = v
-            return res
-
-        return json.dumps(self,
-                          default=get_items,
-                          sort_keys=True)
+        items = _get_items(self, excluded_attributes, self)
+        try:
+            return _SORTED_JSON_ENCODER.encode(items)
+        except TypeError:
+            # There are nested objects that should be converted
+            return json.dumps(items,
+                              default=lambda o: _get_items(o, excluded_attributes, self),
+                              sort_keys=True)
 
     def toJSON(self, excluded_attributes: List[str] = None) -> dict:
-        return json.loads(self.toJSONStr(excluded_attributes))
+        if excluded_attributes is None:
+            excluded_attributes = []
+        return {name: _to_json_value(value, excluded_attributes, self)
+                for name, value in _get_items(self, excluded_attributes, self).items()}
 
     def __str__(self):
         return f"{type(self).__name__}({self.toJSONStr()[1:-1]})"
@@ -0,0 +1,227 @@
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from typing import Dict, Optional, List, Tuple
+
+from ppadb.connection_async import ConnectionAsync
+
+from consts import DEVICE_NAME, ADB_HOST, ADB_PORT, LATTE_CHANNEL_PORT, LATTE_CHANNEL_HANDSHAKE_TIMEOUT, \
+    LATTE_CHANNEL_RETRY_INTERVAL, LATTE_CHANNEL_COMMAND_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class LatteChannelClosedError(ConnectionError):
+    pass
+
+
+class LatteChannel:
+    """
+    A persistent connection to the channel of Latte, a TCP server on the device, through the `tcp:` service of the
+    ADB server (the same stream `adb forward` creates, without a forwarding rule on the host). Instead of polling a
+    result file of Latte, the client sends a request with an id for the file, and the content is pushed by Latte
+    (framed by the request id and length) as soon as the file is written. Similarly, the commands are sent with ids
+    instead of broadcasts, and several commands can be sent without waiting for the previous ones. See
+    `LatteChannel.java` for the protocol.
+    """
+
+    def __init__(self,
+                 device_name: str = DEVICE_NAME,
+                 adb_host: str = ADB_HOST,
+                 adb_port: int = ADB_PORT,
+                 device_port: int = LATTE_CHANNEL_PORT):
+        self.device_name = device_name
+        self.adb_host = adb_host
+        self.adb_port = adb_port
+        self.device_port = device_port
+        self.connection = None
+        self.last_failure_time = None
+        self._open_lock = asyncio.Lock()
+        self._reader_task = None
+        self._request_ids = itertools.count(1)
+        self._pending_requests: Dict[int, asyncio.Future] = {}
+
+    def is_open(self) -> bool:
+        return self.connection is not None
+
+    async def open(self) -> 'LatteChannel':
+        """
+        Opens the channel if it's not open. If Latte does not respond, the channel is not opened again in the next
+        LATTE_CHANNEL_RETRY_INTERVAL seconds.
+        """
+        async with self._open_lock:
+            if self.is_open():
+                return self
+            if self.last_failure_time is not None \
+                    and time.monotonic() - self.last_failure_time < LATTE_CHANNEL_RETRY_INTERVAL:
+                raise LatteChannelClosedError(f"The Latte channel of {self.device_name} is not available")
+            connection = None
+            try:
+                connection = await ConnectionAsync(self.adb_host, self.adb_port).connect()
+                await connection.send(f"host:transport:{self.device_name}")
+                await connection.send(f"tcp:{self.device_port}")
+                await connection.write(b"HELLO\n")
+                # If Latte is not listening, the stream is closed right away
+                response = await asyncio.wait_for(connection.reader.readline(), LATTE_CHANNEL_HANDSHAKE_TIMEOUT)
+                if not response.startswith(b"HELLO "):
+                    raise LatteChannelClosedError(f"Unexpected response from Latte: {response}")
+            except (OSError, RuntimeError, asyncio.TimeoutError) as e:
+                self.last_failure_time = time.monotonic()
+                if connection is not None:
+                    await connection.close()
+                if isinstance(e, LatteChannelClosedError):
+                    raise
+                raise LatteChannelClosedError(f"The Latte channel of {self.device_name} could not be opened: {e}")
+            self.last_failure_time = None
+            self.connection = connection
+            self._reader_task = asyncio.create_task(self._read_responses(connection))
+            logger.debug(f"The Latte channel of {self.device_name} is opened, version: {response[6:].strip()}")
+            return self
+
+    async def close(self) -> None:
+        connection = self.connection
+        self.connection = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if connection is not None:
+            await connection.close()
+        self._fail_pending_requests()
+
+    def _fail_pending_requests(self) -> None:
+        for future in self._pending_requests.values():
+            if not future.done():
+                future.set_exception(LatteChannelClosedError(f"The Latte channel of {self.device_name} is closed"))
+        self._pending_requests.clear()
+
+    async def _read_responses(self, connection: ConnectionAsync) -> None:
+        try:
+            while True:
+                header = await connection.reader.readline()
+                if not header:
+                    break
+                response_type, request_id, length = header.decode('utf-8').split()
+                content = await connection.reader.readexactly(int(length))
+                future = self._pending_requests.pop(int(request_id), None)
+                if future is not None and not future.done():
+                    future.set_result(content.decode('utf-8'))
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            logger.error(f"The Latte channel of {self.device_name} is broken: {e}")
+        if self.connection is connection:
+            self.connection = None
+            self._reader_task = None
+            await connection.close()
+            self._fail_pending_requests()
+
+    def _create_request(self) -> Tuple[int, asyncio.Future]:
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending_requests[request_id] = future
+        return request_id, future
+
+    async def send_commands(self,
+                            commands: List[Tuple[str, str]],
+                            timeout: float = LATTE_CHANNEL_COMMAND_TIMEOUT) -> List[bool]:
+        """
+        Sends the commands (with their extras) at once, and waits until Latte executes them in order. Returns if
+        each command is executed successfully, the commands that are not answered in `timeout` seconds are failed
+        and cancelled, i.e., Latte does not execute them later if they're not started yet. Raises
+        LatteChannelClosedError if the commands could not be sent.
+        """
+        if not self.is_open():
+            raise LatteChannelClosedError(f"The Latte channel of {self.device_name} is closed")
+        if len(commands) == 0:
+            return []
+        requests = []
+        frames = bytearray()
+        for command, extra in commands:
+            request_id, future = self._create_request()
+            requests.append((request_id, future))
+            command_bytes, extra_bytes = command.encode('utf-8'), extra.encode('utf-8')
+            frames += f"COMMAND {request_id} {len(command_bytes)} {len(extra_bytes)}\n".encode('utf-8')
+            frames += command_bytes + extra_bytes
+        try:
+            await self.connection.write(bytes(frames))
+            await asyncio.wait([future for _, future in requests], timeout=timeout)
+        except OSError as e:
+            await self.close()
+            raise LatteChannelClosedError(f"The Latte channel of {self.device_name} is broken: {e}") from e
+        finally:
+            for request_id, _ in requests:
+                self._pending_requests.pop(request_id, None)
+        results = []
+        cancel_requests = bytearray()
+        for (command, _), (request_id, future) in zip(commands, requests):
+            if not future.done():
+                logger.error(f"Timeout for the command {command} in the Latte channel of {self.device_name}")
+                future.cancel()
+                cancel_requests += f"CANCEL {request_id}\n".encode('utf-8')
+                results.append(False)
+            elif future.exception() is not None:
+                logger.error(f"The command {command} could not be completed: {future.exception()}")
+                results.append(False)
+            else:
+                results.append(future.result() == "OK")
+        if cancel_requests and self.is_open():
+            self.connection.writer.write(bytes(cancel_requests))
+        return results
+
+    async def wait_for_file(self, file_name: str, timeout: float = None, remove: bool = True) -> Optional[str]:
+        """
+        Waits for the result file of Latte and returns its content, or None if it's not written in `timeout` seconds.
+        If `remove` is True, the file is removed after it's sent.
+        """
+        if not self.is_open():
+            raise LatteChannelClosedError(f"The Latte channel of {self.device_name} is closed")
+        request_id, future = self._create_request()
+        try:
+            await self.connection.write(f"WAIT {request_id} {file_name} {'remove' if remove else 'keep'}\n"
+                                        .encode('utf-8'))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError as e:
+            await self.close()
+            if isinstance(e, LatteChannelClosedError):
+                raise
+            raise LatteChannelClosedError(f"The Latte channel of {self.device_name} is broken: {e}") from e
+        finally:
+            if self._pending_requests.pop(request_id, None) is not None and self.is_open():
+                # The request is not answered, Latte should not send (and remove) the file later
+                self.connection.writer.write(f"CANCEL {request_id}\n".encode('utf-8'))
+
+
+# The channels of each event loop (the streams cannot be shared between loops, e.g., between `synch_run` calls)
+_latte_channels = weakref.WeakKeyDictionary()
+
+
+def get_latte_channel(device_name: str = DEVICE_NAME) -> LatteChannel:
+    channels = _latte_channels.setdefault(asyncio.get_running_loop(), {})
+    if device_name not in channels:
+        channels[device_name] = LatteChannel(device_name)
+    return channels[device_name]
+
+
+async def send_latte_commands(commands: List[Tuple[str, str]], device_name: str = DEVICE_NAME) -> List[bool]:
+    """
+    Sends the commands with their extras to Latte at once, and returns if each of them is executed successfully.
+    Raises LatteChannelClosedError if the Latte channel is not available.
+    """
+    channel = await get_latte_channel(device_name).open()
+    return await channel.send_commands(commands)
+
+
+async def wait_for_latte_file(file_name: str,
+                              wait_time: float = -1,
+                              remove_after_read: bool = True,
+                              device_name: str = DEVICE_NAME) -> Optional[str]:
+    """
+    Returns the content of the result file of Latte once it's written, or None if it's not written in `wait_time`
+    seconds (non-positive means no limit). Raises LatteChannelClosedError if the Latte channel is not available.
+    """
+    channel = await get_latte_channel(device_name).open()
+    return await channel.wait_for_file(file_name,
+                                       timeout=wait_time if wait_time > 0 else None,
+                                       remove=remove_after_read)
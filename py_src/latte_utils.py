@@ -1,12 +1,17 @@
+import asyncio
 import json
 import logging
 import random
+import shlex
 import string
+import time
+import weakref
 from typing import Union, Tuple, List
 
 from adb_utils import read_local_android_file
-from consts import IS_LIVE_TIMEOUT_TIME, DEVICE_NAME
-from shell_utils import run_bash
+from consts import IS_LIVE_TIMEOUT_TIME, DEVICE_NAME, LATTE_HEARTBEAT_INTERVAL, LATTE_HEARTBEAT_RETRY_INTERVAL
+from adb_transport import run_device_shell
+from latte_channel import send_latte_commands, get_latte_channel, LatteChannelClosedError
 
 logger = logging.getLogger(__name__)
 
@@ -26,16 +31,25 @@ def _encode_latte_message(message: str) -> str:
         .replace("*", "__^-^^__") \
         .replace("&", "__^^_^__") \
         .replace("[", "__^^-^__") \
-        .replace("]", "__^^^^^__")
-    message = message.replace(")", "").replace("(", "")  # TODO: Must be changed
+        .replace("]", "__^^^^^__") \
+        .replace("(", "__^o^__") \
+        .replace(")", "__^c^__")
     return message
 
 
 async def send_command_to_latte(command: str, extra: str = "NONE", device_name: str = DEVICE_NAME) -> bool:
     logger.debug(f"Sending command {command} with extra {extra} to Latte!")
+    try:
+        return (await send_latte_commands([(command, extra)], device_name=device_name))[0]
+    except LatteChannelClosedError as e:
+        logger.debug(f"Broadcasting the command {command} since the Latte channel is not available: {e}")
+    return await _broadcast_command_to_latte(command, extra, device_name=device_name)
+
+
+async def _broadcast_command_to_latte(command: str, extra: str, device_name: str = DEVICE_NAME) -> bool:
     extra = _encode_latte_message(extra)
-    bash_cmd = f'adb -s {device_name} shell am broadcast -a {LATTE_INTENT} --es command "{command}" --es extra "{extra}"'
-    r_code, stdout, stderr = await run_bash(bash_cmd)
+    shell_cmd = f'am broadcast -a {LATTE_INTENT} --es command {shlex.quote(command)} --es extra {shlex.quote(extra)}'
+    r_code, stdout, stderr = await run_device_shell(shell_cmd, device_name=device_name)
     if r_code != 0:
         logger.error(f"Error in sending command {command} with extra {extra}! STDOUT: {stdout} STDERR: {stderr}")
     return r_code == 0
@@ -43,12 +57,21 @@ async def send_command_to_latte(command: str, extra: str = "NONE", device_name:
 
 async def send_commands_sequence_to_latte(command_sequence: List[Union[str, Tuple[str, str]]],
                                           device_name: str = DEVICE_NAME) -> bool:
-    command_extra = []
+    """
+    Sends the commands to Latte at once, they are executed in order. Returns True if all commands are executed
+    successfully.
+    """
+    commands = []
     for item in command_sequence:
         command = item if isinstance(item, str) else item[0]
         extra = item[1] if isinstance(item, tuple) and len(item) > 1 else "NONE"
-        command_extra.append({"command": command, "extra": extra})
-    return await send_command_to_latte('sequence', json.dumps(command_extra), device_name=device_name)
+        commands.append((command, extra))
+    try:
+        return all(await send_latte_commands(commands, device_name=device_name))
+    except LatteChannelClosedError as e:
+        logger.debug(f"Broadcasting the sequence of commands since the Latte channel is not available: {e}")
+    command_extra = [{"command": command, "extra": extra} for command, extra in commands]
+    return await _broadcast_command_to_latte('sequence', json.dumps(command_extra), device_name=device_name)
 
 
 async def is_latte_live(device_name: str = DEVICE_NAME) -> bool:
@@ -58,3 +81,138 @@ async def is_latte_live(device_name: str = DEVICE_NAME) -> bool:
     file_path = IS_LIVE_FILE_PATTERN.format(random_message)
     result = await read_local_android_file(file_path, wait_time=IS_LIVE_TIMEOUT_TIME, device_name=device_name)
     return result is not None
+
+
+class LatteHeartbeat:
+    """
+    Keeps the liveness of Latte on a device, so the callers can wait until Latte is live without probing it
+    themselves. Latte is probed (by `is_latte_live`) only on demand, i.e., while a caller waits for it, every
+    LATTE_HEARTBEAT_RETRY_INTERVAL seconds until it's live. Then, no command is sent to Latte (which would be logged
+    in the middle of the actions), and Latte is known to be live as long as the connection of the Latte channel which
+    answered the probe is open, since the channel is served by the Latte service. If the channel is not available
+    (e.g., older versions of Latte), the last probe is trusted for `interval` seconds.
+    """
+
+    def __init__(self, device_name: str = DEVICE_NAME, interval: float = LATTE_HEARTBEAT_INTERVAL):
+        self.device_name = device_name
+        self.interval = interval
+        self.is_live = False
+        self.last_check_time = None
+        self._live_connection = None
+        self._generation = 0
+        self._waiter_count = 0
+        self._live_event = asyncio.Event()
+        self._wakeup_event = asyncio.Event()
+        self._task = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> 'LatteHeartbeat':
+        """
+        Starts probing Latte until it's live, if it's not already started
+        """
+        if not self.is_running():
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_healthy(self) -> bool:
+        """
+        Returns True if Latte was live in the last probe, and the Latte channel that answered it is still open (or,
+        without the channel, the probe is not older than `interval` seconds)
+        """
+        if not self.is_live or self.last_check_time is None:
+            return False
+        if self._live_connection is not None:
+            return get_latte_channel(self.device_name).connection is self._live_connection
+        return time.monotonic() - self.last_check_time <= self.interval
+
+    def invalidate(self) -> None:
+        """
+        Forgets the liveness of Latte (e.g., when the accessibility services are changed), it's probed again if a
+        caller is waiting for it
+        """
+        self._generation += 1
+        self._set_live(False)
+        self._wakeup_event.set()
+
+    def _set_live(self, is_live: bool) -> None:
+        self.is_live = is_live
+        if is_live:
+            self._live_event.set()
+        else:
+            self._live_connection = None
+            self._live_event.clear()
+
+    async def _run(self) -> None:
+        while not self.is_live:
+            self._wakeup_event.clear()
+            generation = self._generation
+            try:
+                is_live = await is_latte_live(device_name=self.device_name)
+            except Exception as e:
+                logger.debug(f"The liveness probe of Latte on {self.device_name} failed: {e}")
+                is_live = False
+            # The result of a probe that was started before invalidating is discarded
+            if generation != self._generation:
+                continue
+            self.last_check_time = time.monotonic()
+            if is_live:
+                self._set_live(True)
+                self._live_connection = get_latte_channel(self.device_name).connection
+                break
+            try:
+                await asyncio.wait_for(self._wakeup_event.wait(), LATTE_HEARTBEAT_RETRY_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_until_live(self, timeout: float = None) -> bool:
+        """
+        Returns True right away if Latte is known to be live, otherwise probes it until it's live (at most `timeout`
+        seconds). Returns False if Latte is not live.
+        """
+        if self.is_healthy():
+            return True
+        if self.is_live:
+            # The last probe cannot be trusted anymore
+            self._set_live(False)
+        self._waiter_count += 1
+        try:
+            self.start()
+            await asyncio.wait_for(self._live_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiter_count -= 1
+            if self._waiter_count == 0:
+                # Nobody waits for Latte, the probes are stopped
+                await self.stop()
+
+
+# The heartbeats of each event loop (the tasks cannot be shared between loops, e.g., between `synch_run` calls)
+_latte_heartbeats = weakref.WeakKeyDictionary()
+
+
+def get_latte_heartbeat(device_name: str = DEVICE_NAME) -> LatteHeartbeat:
+    heartbeats = _latte_heartbeats.setdefault(asyncio.get_running_loop(), {})
+    if device_name not in heartbeats:
+        heartbeats[device_name] = LatteHeartbeat(device_name)
+    return heartbeats[device_name]
+
+
+async def stop_latte_heartbeats() -> None:
+    """
+    Stops the probes of the heartbeats of the running event loop, e.g., before the loop is closed
+    """
+    for heartbeat in _latte_heartbeats.get(asyncio.get_running_loop(), {}).values():
+        await heartbeat.stop()
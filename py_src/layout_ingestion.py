@@ -0,0 +1,178 @@
+import logging
+import multiprocessing
+import os
+import traceback
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Union, Tuple, Any
+
+from GUI_utils import NodesFactory, NodeTable
+
+logger = logging.getLogger(__name__)
+
+# The passes applied on the nodes of the stored node tables of layouts
+NODE_TABLE_PASSES = ['xpath', 'ad_detection']
+# The version of the stored node tables, it should be increased whenever the nodes of a stored table would be
+# different for the same layout, e.g., a pass is changed
+NODE_TABLE_VERSION = 1
+
+
+def get_node_table_metadata(layout_path: Union[str, Path]) -> dict:
+    """
+    The metadata of the node table of a layout file, a stored table is valid if its metadata is the same
+    """
+    layout_stat = Path(layout_path).stat()
+    return {'version': NODE_TABLE_VERSION,
+            'layout_size': layout_stat.st_size,
+            'layout_mtime_ns': layout_stat.st_mtime_ns,
+            'passes': NODE_TABLE_PASSES}
+
+
+def load_stored_node_table(cache_path: Union[str, Path], metadata: dict) -> Union[NodeTable, None]:
+    """
+    Returns the node table stored in cache_path if its metadata is the given one, i.e., it's created from the same
+    layout file by the same version, otherwise returns None.
+    """
+    if not Path(cache_path).exists():
+        return None
+    node_table = NodeTable.createTableFromFile(cache_path)
+    if node_table is None:
+        return None
+    if node_table.metadata.get('version', None) != metadata['version']:
+        logger.info(f"The node table {cache_path} has version {node_table.metadata.get('version', None)}, "
+                    f"it's created again with version {metadata['version']}")
+        return None
+    return node_table if node_table.metadata == metadata else None
+
+
+def load_node_table(layout_path: Union[str, Path], cache_path: Union[str, Path] = None) -> NodeTable:
+    """
+    Returns the node table of the layout file. If cache_path is given, the table is loaded from it when it's created
+    from the same layout, otherwise the table is built and written to cache_path.
+    """
+    metadata = get_node_table_metadata(layout_path)
+    if cache_path is not None:
+        node_table = load_stored_node_table(cache_path, metadata)
+        if node_table is not None:
+            return node_table
+    nodes = NodesFactory() \
+        .with_layout_path(layout_path) \
+        .with_xpath_pass() \
+        .with_ad_detection() \
+        .with_streaming(release_xml_elements=True) \
+        .build()
+    node_table = NodeTable.createTableFromNodes(nodes)
+    node_table.metadata = metadata
+    if cache_path is not None:
+        try:
+            node_table.write_to_file(cache_path)
+        except OSError as e:
+            logger.error(f"The node table of {layout_path} could not be written to {cache_path}: {e}")
+    return node_table
+
+
+class LayoutIngestionResult:
+    """
+    The node table of an ingested layout, or the error if the layout could not be ingested. The key identifies the
+    source of the layout, e.g., the snapshot path. The results are picklable, the node table has no Nodes or XML
+    elements until its nodes are requested.
+    """
+
+    def __init__(self, key: Any, layout_path: Union[str, Path], node_table: NodeTable = None, error: str = None):
+        self.key = key
+        self.layout_path = layout_path
+        self.node_table = node_table
+        self.error = error
+
+    def is_successful(self) -> bool:
+        return self.node_table is not None
+
+
+def ingest_layout(layout_item: Tuple[Any, Union[str, Path], Union[str, Path, None]]) -> LayoutIngestionResult:
+    """
+    Creates the node table of a layout, the item is the key, the layout path, and the path of the stored table
+    (or None). It's executed in the worker processes of `ingest_layouts`.
+    """
+    key, layout_path, cache_path = layout_item
+    try:
+        return LayoutIngestionResult(key=key,
+                                     layout_path=layout_path,
+                                     node_table=load_node_table(layout_path, cache_path))
+    except Exception as e:
+        return LayoutIngestionResult(key=key, layout_path=layout_path, error=f"{e} {traceback.format_exc()}")
+
+
+def map_in_processes(function: Callable,
+                     items: Iterable,
+                     processes: int = None,
+                     chunk_size: int = None,
+                     progress_callback: Callable[[int, int, Any], None] = None,
+                     ordered: bool = False) -> Iterator:
+    """
+    Applies the function on the items in a pool of processes and yields the results in the order of completion, or
+    in the order of the items if `ordered` is True.
+    The items are sharded in chunks of chunk_size between the processes (by default, each process receives about
+    four chunks). The function and the items must be picklable, the function must be defined at the top level
+    of a module.
+
+    :param function: The function which is applied on each item
+    :param items: The items
+    :param processes: The number of processes, by default it's the number of CPUs. If it's 1, the items are
+                      processed in the current process.
+    :param chunk_size: The number of items which are sent to a worker process at once
+    :param progress_callback: It's called after receiving each result with the number of completed items, the total
+                              number of items, and the result
+    :param ordered: If it's True, a result is yielded after the results of the previous items, so the consumer
+                    sees the same results regardless of the number of processes
+    """
+    items = list(items)
+    total = len(items)
+    if total == 0:
+        return
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, total))
+    if processes == 1:
+        results = map(function, items)
+        pool = None
+    else:
+        if chunk_size is None:
+            chunk_size = max(1, total // (processes * 4))
+        pool = multiprocessing.Pool(processes=processes)
+        if ordered:
+            results = pool.imap(function, items, chunksize=chunk_size)
+        else:
+            results = pool.imap_unordered(function, items, chunksize=chunk_size)
+    try:
+        for completed, result in enumerate(results, start=1):
+            if progress_callback is not None:
+                progress_callback(completed, total, result)
+            yield result
+    finally:
+        # The workers are stopped if the caller stops consuming the results
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def ingest_layouts(layout_items: Iterable[Tuple[Any, Union[str, Path], Union[str, Path, None]]],
+                   processes: int = None,
+                   chunk_size: int = None,
+                   progress_callback: Callable[[int, int, LayoutIngestionResult], None] = None,
+                   ordered: bool = False) \
+        -> Iterator[LayoutIngestionResult]:
+    """
+    Creates the node tables of many layouts in parallel (see `map_in_processes`), the results are yielded in the
+    order of completion, or in the order of the layout items if `ordered` is True.
+
+    :param layout_items: The layouts, each item is a key identifying the layout, the layout path, and the path of
+                         its stored node table (or None, see `load_node_table`)
+    """
+    for result in map_in_processes(ingest_layout,
+                                   layout_items,
+                                   processes=processes,
+                                   chunk_size=chunk_size,
+                                   progress_callback=progress_callback,
+                                   ordered=ordered):
+        if not result.is_successful():
+            logger.error(f"The layout {result.layout_path} could not be ingested: {result.error}")
+        yield result
@@ -11,6 +11,7 @@ from consts import DEVICE_NAME, ADB_HOST, ADB_PORT
 from ppadb.client_async import ClientAsync as AdbClient
 
 from controller import create_controller
+from latte_utils import stop_latte_heartbeats
 from results_utils import AddressBook
 from logger_utils import ColoredFormatter, initialize_logger
 from snapshot import EmulatorSnapshot, DeviceSnapshot, Snapshot
@@ -74,6 +75,8 @@ async def execute_snapshot_task(args, address_book: AddressBook):
             await ProcessScreenshotTask(snapshot).execute()
     except Exception as e:
         logger.error("Exception happened in analyzing the snapshot", exc_info=e)
+    finally:
+        await stop_latte_heartbeats()
 
 
 async def execute_app_task(args, app_path: Path):
@@ -124,6 +127,8 @@ async def execute_app_task(args, app_path: Path):
 
     except Exception as e:
         logger.error("Exception happened in analyzing the snapshot", exc_info=e)
+    finally:
+        await stop_latte_heartbeats()
 
 
 if __name__ == "__main__":
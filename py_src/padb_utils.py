@@ -1,63 +1,228 @@
+import itertools
 import logging
-from typing import Any, List, Union
+import re
+import uuid
+import weakref
+from collections import deque, defaultdict
+from typing import Any, List, Coroutine, Dict, NamedTuple, Iterator
 import asyncio
-import aiofiles
-from consts import BLIND_MONKEY_TAG, CAPTURE_SCREENSHOT_DELAY
+from consts import BLIND_MONKEY_TAG, LOGCAT_BUFFER_SIZE, LOGCAT_MARKER_TAG, LOGCAT_MARKER_TIMEOUT, LOGCAT_SETTLE_TIME
+from screenshot_utils import save_screenshot
 
 logger = logging.getLogger(__name__)
 
+# The format of `logcat -v threadtime`, e.g., "05-12 14:02:03.123  1234  1250 I LATTE_SERVICE: message"
+_THREADTIME_PATTERN = re.compile(r"^(\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+\d+\s+\d+\s+[VDIWEFS]\s+(.*?)\s*: (.*)$")
 
-async def save_screenshot(device, file_name) -> None:
-    try:
-        result = await device.screencap()
-        await asyncio.sleep(CAPTURE_SCREENSHOT_DELAY)
-        async with aiofiles.open(file_name, mode='wb') as f:
-            await f.write(result)
-    except Exception as e:
-        logger.error(f"The screenshot for {file_name} could not be taken. Exception: {e}")
 
+class LogcatRecord(NamedTuple):
+    sequence: int
+    timestamp: str
+    tag: str
+    message: str
+    line: str
 
-class ParallelADBLogger:
-    def __init__(self, device):
+    @staticmethod
+    def createRecordFromLine(sequence: int, line: str) -> 'LogcatRecord':
+        match = _THREADTIME_PATTERN.match(line)
+        if match is None:
+            # E.g., "--------- beginning of main"
+            return LogcatRecord(sequence=sequence, timestamp="", tag="", message=line, line=line)
+        return LogcatRecord(sequence=sequence,
+                            timestamp=match.group(1),
+                            tag=match.group(2),
+                            message=match.group(3),
+                            line=line)
+
+
+def _bisect_sequence(records: deque, sequence: int) -> int:
+    # The index of the first record whose sequence is greater than the given sequence
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if records[middle].sequence <= sequence:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class LogcatWindow:
+    """
+    The records of a LogcatReader between two markers (exclusive)
+    """
+
+    def __init__(self, reader: 'LogcatReader', start: int, end: int):
+        self.reader = reader
+        self.start = start
+        self.end = end
+
+    def records(self, tag: str = None) -> Iterator[LogcatRecord]:
+        """
+        The records in the window, if `tag` is given only the records with the exact tag (using the tag index)
+        """
+        records = self.reader.records if tag is None else self.reader.tag_records.get(tag, deque())
+        for index in range(_bisect_sequence(records, self.start), len(records)):
+            record = records[index]
+            if record.sequence >= self.end:
+                break
+            if record.tag != LOGCAT_MARKER_TAG:
+                yield record
+
+    def get_log_map(self, tags: List[str]) -> Dict[str, str]:
+        """
+        Maps each tag to the lines (joined by new line) of the records with the exact tag, using the tag index. A tag
+        can be followed by a prefix of the message, e.g., "talkback: TreeDebug:" is the records of the tag 'talkback'
+        whose messages start with 'TreeDebug:'.
+        """
+        log_map = {}
+        for tag in tags:
+            record_tag, _, message_prefix = tag.partition(": ")
+            log_map[tag] = "\n".join(record.line for record in self.records(record_tag)
+                                     if record.message.startswith(message_prefix))
+        return log_map
+
+
+class LogcatReader:
+    """
+    A long-lived `logcat` of a device. The lines are parsed into records, and the recent `buffer_size` records are
+    kept in a ring buffer, indexed by their tags. Instead of clearing the logcat, the callers write markers in the
+    logcat (by `mark`) and take the window between two markers.
+    """
+
+    def __init__(self, device, buffer_size: int = LOGCAT_BUFFER_SIZE):
         self.device = device
-        self.lock = None
-        self.log_message = ""
+        self.buffer_size = buffer_size
+        self.records = deque(maxlen=buffer_size)
+        self.tag_records: Dict[str, deque] = defaultdict(lambda: deque(maxlen=buffer_size))
+        self.next_sequence = 0
+        self._marker_prefix = uuid.uuid4().hex[:8]
+        self._marker_ids = itertools.count(1)
+        self._marker_futures: Dict[str, asyncio.Future] = {}
+        self._start_lock = asyncio.Lock()
+        self._task = None
 
-    async def _logcat(self) -> asyncio.coroutine:
-        async def logcat_handler(connection):
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> 'LogcatReader':
+        async with self._start_lock:
+            if not self.is_running():
+                connection = await self.device.create_connection(timeout=None)
+                # Starts from the last line instead of the whole buffer
+                await connection.send("shell:logcat -v threadtime -T 1")
+                self._task = asyncio.create_task(self._read_lines(connection))
+        return self
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _read_lines(self, connection) -> None:
+        buffer = bytearray()
+        try:
             while True:
-                data = await connection.read(1024)
+                data = await connection.read(65536)
                 if not data:
                     break
-                self.log_message += data.decode('utf-8')
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self._add_line(line.rstrip(b"\r").decode('utf-8', errors='replace'))
+        except OSError as e:
+            logger.error(f"The logcat of {self.device.serial} is broken: {e}")
+        finally:
             await connection.close()
-        conn = await self.device.create_connection(timeout=None)
-        cmd = "shell:{}".format("logcat -c; logcat")
-        await conn.send(cmd)
-        logcat_handler_task = asyncio.create_task(logcat_handler(conn))
-        return logcat_handler_task
+
+    def _add_line(self, line: str) -> None:
+        record = LogcatRecord.createRecordFromLine(self.next_sequence, line)
+        self.next_sequence += 1
+        self.records.append(record)
+        self.tag_records[record.tag].append(record)
+        if record.tag == LOGCAT_MARKER_TAG:
+            future = self._marker_futures.pop(record.message.strip(), None)
+            if future is not None and not future.done():
+                future.set_result(record.sequence)
+
+    async def mark(self) -> int:
+        """
+        Writes a marker in the logcat of the device and returns its sequence once it's read, i.e., all the lines
+        written before the marker are read.
+        """
+        await self.start()
+        marker = f"{self._marker_prefix}_{next(self._marker_ids)}"
+        future = asyncio.get_running_loop().create_future()
+        self._marker_futures[marker] = future
+        try:
+            await self.device.shell(f"log -t {LOGCAT_MARKER_TAG} {marker}")
+            return await asyncio.wait_for(future, LOGCAT_MARKER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"The logcat marker {marker} of {self.device.serial} is not read")
+            return self.next_sequence
+        finally:
+            self._marker_futures.pop(marker, None)
+
+    def window(self, start: int, end: int) -> LogcatWindow:
+        if self.records and self.records[0].sequence > start + 1:
+            logger.warning(f"The logcat window is truncated, {self.records[0].sequence - start - 1} records are "
+                           f"dropped from the ring buffer")
+        return LogcatWindow(self, start, end)
+
+
+# The readers of each event loop (the streams cannot be shared between loops, e.g., between `synch_run` calls)
+_logcat_readers = weakref.WeakKeyDictionary()
+
+
+def get_logcat_reader(device) -> LogcatReader:
+    readers = _logcat_readers.setdefault(asyncio.get_running_loop(), {})
+    if device.serial not in readers:
+        readers[device.serial] = LogcatReader(device)
+    return readers[device.serial]
+
+
+class ParallelADBLogger:
+    def __init__(self, device):
+        self.device = device
 
     async def execute_async_with_log(self,
-                                     coroutine_obj: asyncio.coroutine,
-                                     tags: List[str] = None) -> (dict, Any):
-        if self.lock is not None:
-            raise Exception("Cannot execute more than one coroutine while logging!")
+                                     coroutine_obj: Coroutine,
+                                     tags: List[str] = None,
+                                     settle_time: float = LOGCAT_SETTLE_TIME) -> (dict, Any):
+        """
+        Executes the coroutine and returns the lines of the logcat with each tag (BLIND_MONKEY_TAG by default, see
+        `LogcatWindow.get_log_map`) during the execution, along with the result of the coroutine. The window ends
+        `settle_time` seconds after the coroutine returns, so it includes the events Latte logs right after the
+        action (e.g., WindowContentChange).
+
+        The coroutines are not serialized, since a logged coroutine may execute another one (e.g., a controller
+        capturing the layout). The logs are taken from the window between two markers of the shared logcat, so the
+        logs of a coroutine include the logs (with the same tags) of the coroutines executed in the meantime, similar
+        to a nested execution.
+        """
+        if tags is None:
+            tags = [BLIND_MONKEY_TAG]
+        reader = get_logcat_reader(self.device)
+        try:
+            start = await reader.mark()
+        except Exception as e:
+            # The coroutine is executed without logs
+            logger.error(f"The logcat of {self.device.serial} could not be read, Exception: {e}")
+            reader, start = None, None
         try:
-            self.lock = coroutine_obj
-            self.log_message = ""
-            ll_task = await self._logcat()
             coroutine_result = await coroutine_obj
-            await asyncio.sleep(1)  # TODO: Add it to consts
-            ll_task.cancel()
-            self.lock = None
-            if tags is None:
-                tags = [BLIND_MONKEY_TAG]
-            logs = {}
-            for tag in tags:
-                logs[tag] = "\n".join(line for line in self.log_message.split("\n") if tag in line)
-            self.log_message = logs
+            if reader is not None:
+                await asyncio.sleep(settle_time)
+                end = await reader.mark()
+                log_message = reader.window(start, end).get_log_map(tags)
+            else:
+                log_message = {tag: "" for tag in tags}
         except Exception as e:
-            self.lock = None
-            self.log_message = "Error in Execution"
+            logger.error(f"Error in executing the coroutine with logs, Exception: {e}")
+            log_message = "Error in Execution"
             coroutine_result = None
-        return self.log_message, coroutine_result
+        return log_message, coroutine_result
@@ -3,16 +3,21 @@ import asyncio
 import json
 import datetime
 import shutil
+import time
 from collections import defaultdict
 from enum import Enum
 from pathlib import Path
-from typing import Optional, Union, Dict, List, Tuple
+from typing import Optional, Union, Dict, List, Tuple, Callable, Iterator, Awaitable
 
-from GUI_utils import Node, bounds_included, is_in_same_state_with_layout_path, NodesFactory
-from adb_utils import get_current_activity_name, get_windows, get_activities, adb_capture_layout
+import aiofiles
+
+from GUI_utils import Node, SpatialIndex, XPathIndex, NodesFactory, LayoutSignature, LayoutDiff, diff_layout_paths
+from adb_utils import get_current_activity_name, get_windows, get_activities, adb_capture_layout, \
+    extract_activity_name
 from command import LocatableCommandResponse
 from consts import BLIND_MONKEY_TAG, BLIND_MONKEY_EVENTS_TAG, CAPTURE_STATE_DELAY
-from json_util import JSONSerializable
+from json_util import JSONSerializable, json_loads, unsafe_json_load
+from layout_ingestion import LayoutIngestionResult, ingest_layouts
 from latte_executor_utils import latte_capture_layout
 from padb_utils import ParallelADBLogger, save_screenshot
 from utils import annotate_rectangle
@@ -156,6 +161,38 @@ class WebHelper:
 
     def __init__(self, address_book: 'AddressBook'):
         self.address_book = address_book
+        # The xpath indices of the result files, each one is kept with the modification time and size of its file
+        self._xpath_indices: Dict[Path, Tuple[Tuple[int, int], XPathIndex]] = {}
+
+    def _get_xpath_index(self, path: Path, read_xpaths: Callable[[], List[str]]) -> XPathIndex:
+        """
+        Returns the index of the xpaths of a result file, which is created again if the file is modified
+        """
+        path_stat = path.stat()
+        file_key = (path_stat.st_mtime_ns, path_stat.st_size)
+        if path not in self._xpath_indices or self._xpath_indices[path][0] != file_key:
+            self._xpath_indices[path] = (file_key, XPathIndex(read_xpaths()))
+        return self._xpath_indices[path][1]
+
+    def get_actions_xpath_index(self) -> XPathIndex:
+        """
+        The index of the xpaths of the nodes of `get_actions()`, i.e., the i-th xpath belongs to the i-th action
+        """
+        if not self.address_book.perform_actions_results_path.exists():
+            return XPathIndex([])
+        return self._get_xpath_index(self.address_book.perform_actions_results_path,
+                                     lambda: [ar.node.xpath for ar in self.get_actions()])
+
+    def get_tb_reachable_xpath_index(self) -> XPathIndex:
+        path = self.address_book.extract_actions_nodes[Actionables.TBReachable]
+        if not path.exists():
+            return XPathIndex([])
+
+        def read_xpaths() -> List[str]:
+            with open(path) as f:
+                return [json_loads(line).get('xpath', '') for line in f.readlines()]
+
+        return self._get_xpath_index(path, read_xpaths)
 
     def get_action_count(self) -> int:
         if not self.address_book.perform_actions_results_path.exists():
@@ -174,7 +211,7 @@ class WebHelper:
             return None
         with open(self.address_book.perform_actions_results_path) as f:
             for line in f.readlines():
-                result_json = json.loads(line.strip())
+                result_json = json_loads(line.strip())
                 if result_json['index'] == action_index:
                     return ActionResult.createFromDict(result_json)
         return None
@@ -185,7 +222,7 @@ class WebHelper:
         result = []
         with open(self.address_book.perform_actions_results_path) as f:
             for line in f.readlines():
-                result_json = json.loads(line.strip())
+                result_json = json_loads(line.strip())
                 result.append(ActionResult.createFromDict(result_json))
         return result
 
@@ -193,9 +230,18 @@ class WebHelper:
         return "ManualIgnored" in self.get_note()
 
     def is_same_layout(self, mode1, index1, mode2, index2):
-        layout_path1 = self.address_book.get_layout_path(mode1, index1)
-        layout_path2 = self.address_book.get_layout_path(mode2, index2)
-        return is_in_same_state_with_layout_path(layout_path1, layout_path2)
+        signature1 = self.address_book.get_layout_signature(mode1, index1)
+        signature2 = self.address_book.get_layout_signature(mode2, index2)
+        return signature1.is_in_same_state(signature2)
+
+    def get_layout_diff(self, mode1, index1, mode2, index2, excluded_attributes: List[str] = None) -> LayoutDiff:
+        """
+        Parses both layouts and returns their structural diff. It's computed on request (e.g., by the web
+        visualization), the summaries only compare the layout signatures.
+        """
+        return diff_layout_paths(self.address_book.get_layout_path(mode1, index1),
+                                 self.address_book.get_layout_path(mode2, index2),
+                                 excluded_attributes=excluded_attributes)
 
     def get_events_info(self, mode, index) -> dict:
         event_log_path = self.address_book.get_log_path(mode, index, extension=BLIND_MONKEY_EVENTS_TAG)
@@ -216,7 +262,7 @@ class WebHelper:
             if self.address_book.perform_actions_summary.exists():
                 with open(self.address_book.perform_actions_summary) as f:
                     for line in f.readlines():
-                        json_part = json.loads(line)
+                        json_part = json_loads(line)
                         if json_part['index'] == index:
                             return json_part['summary']
         summary = {}
@@ -233,14 +279,14 @@ class WebHelper:
         summary["tb_closest_reachable"] = None
         if self.address_book.extract_actions_nodes[Actionables.TBReachable].exists():
             closest_child = None
-            with open(self.address_book.extract_actions_nodes[Actionables.TBReachable]) as f:
-                for line in f.readlines():
-                    l_node = Node.createNodeFromDict(json.loads(line))
-                    if node is not None and node.xpath and l_node.xpath.startswith(node.xpath):
-                        if closest_child is None or l_node.xpath < closest_child.xpath:
-                            closest_child = l_node
+            if node is not None and node.xpath:
+                # The lexicographically smallest reachable xpath starting with the node's xpath
+                tb_reachable_index = self.get_tb_reachable_xpath_index()
+                closest_indices = tb_reachable_index.starting_with(node.xpath)
+                if closest_indices:
+                    closest_child = tb_reachable_index.xpaths[closest_indices[0]]
             if closest_child:
-                remaining = closest_child.xpath[len(node.xpath):]
+                remaining = closest_child[len(node.xpath):]
                 if remaining.count("/") < 3:
                     summary["tb_closest_reachable"] = remaining
                     is_tb_reachable = True
@@ -252,7 +298,7 @@ class WebHelper:
         finding_xpath = node.xpath + (summary["tb_closest_reachable"] if summary["tb_closest_reachable"] else "")
         with open(self.address_book.tb_explore_visited_nodes_path) as f:
             for i, line in enumerate(f.readlines()):
-                xpath = json.loads(line)['xpath']
+                xpath = json_loads(line)['xpath']
                 if xpath == finding_xpath and when_reached < 0:
                     when_reached = i+1
                 total_nodes += 1
@@ -262,8 +308,9 @@ class WebHelper:
 
         # ------------ End Calculation Time ---------
         children_nodes_action_indices = []
-        for ar in all_action_results:
-            if ar.index != action_result.index and node.xpath in ar.node.xpath:
+        for ar_index in sorted(self.get_actions_xpath_index().starting_with(node.xpath)):
+            ar = all_action_results[ar_index]
+            if ar.index != action_result.index:
                 children_nodes_action_indices.append(ar.index)
 
         summary['did_tb_click'] = mode_events_info['tb_touch']['did_tb_click']
@@ -429,7 +476,7 @@ class WebHelper:
 
         with open(self.address_book.perform_actions_results_path) as f:
             for line in f.readlines():
-                action = json.loads(line.strip())
+                action = json_loads(line.strip())
                 index = action['index']
                 summary = self.action_summary(index)
                 if summary[self.AUTO_IGNORED_NAME]:
@@ -509,9 +556,10 @@ class WebHelper:
 
     def get_clickable_span_nodes(self) -> List[Node]:
         nodes = NodesFactory() \
-            .with_layout_path(self.address_book.get_layout_path(AddressBook.BASE_MODE, AddressBook.INITIAL)) \
+            .with_layout_path(self.address_book.get_layout_path(AddressBook.BASE_MODE, AddressBook.INITIAL), use_cache=True) \
             .with_xpath_pass() \
             .with_ad_detection() \
+            .with_streaming(release_xml_elements=True) \
             .build()
         return [node for node in nodes if node.clickable_span and not node.clickable and node.text and node.visible]
 
@@ -521,7 +569,7 @@ class WebHelper:
         tags = set()
         with open(self.address_book.tags_path) as f:
             for line in f.readlines():
-                json_part = json.loads(line)
+                json_part = json_loads(line)
                 if json_part['index'] == action_index or action_index == -1:
                     tags.add(json_part['tag'])
         return list(tags)
@@ -625,6 +673,7 @@ class AddressBook:
         for mode in navigate_modes:
             self.mode_path_map[mode] = self.snapshot_result_path.joinpath(mode)
         self.initiated_path = self.snapshot_result_path.joinpath("initiated.txt")
+        self.node_table_cache_path = self.snapshot_result_path.joinpath("node_table.bin")
         self.ovsersight_path = self.snapshot_result_path.joinpath("OS")
         # self.atf_issues_path = self.mode_path_map['exp'].joinpath("atf_issues.jsonl")
         self.action_path = self.snapshot_result_path.joinpath("action.jsonl")
@@ -741,6 +790,39 @@ class AddressBook:
             index = 'INITIAL'
         return self._get_path(mode, f"{index}.xml", should_exists)
 
+    def get_layout_signature_path(self, mode: str, index: int, should_exists: bool = False):
+        if mode == 's_exp' or mode == AddressBook.BASE_MODE:
+            index = 'INITIAL'
+        return self._get_path(mode, f"{index}_layout_signature.json", should_exists)
+
+    def write_layout_signature(self, mode: str, index: int, layout: str) -> LayoutSignature:
+        signature = LayoutSignature.createSignatureFromLayout(layout)
+        with open(self.get_layout_signature_path(mode, index), "w") as f:
+            json.dump(signature.toJSON(), f)
+        return signature
+
+    def get_layout_signature(self, mode: str, index: int) -> LayoutSignature:
+        """
+        Returns the signature of the layout, which is written next to the layout when the state is captured.
+        If the signature is missing or outdated (e.g., results of older versions), it's created from the layout
+        and written for the next calls.
+        """
+        layout_path = self.get_layout_path(mode, index)
+        signature_path = self.get_layout_signature_path(mode, index)
+        if signature_path is not None and signature_path.exists() and \
+                signature_path.stat().st_mtime >= layout_path.stat().st_mtime:
+            with open(signature_path) as f:
+                signature = LayoutSignature.createSignatureFromDict(unsafe_json_load(f.read()) or {})
+            if signature is not None:
+                return signature
+        with open(layout_path) as f:
+            layout = f.read()
+        try:
+            return self.write_layout_signature(mode, index, layout)
+        except OSError as e:
+            logger.error(f"The layout signature cannot be written at {signature_path}, Exception: {e}")
+            return LayoutSignature.createSignatureFromLayout(layout)
+
     def get_log_path(self, mode: str, index: int, extension: str = None, should_exists: bool = False):
         file_name = f"{index}_{extension}.log" if (
                 extension is not None and extension != BLIND_MONKEY_TAG) else f"{index}.log"
@@ -780,7 +862,7 @@ class AddressBook:
             oac = oac.name
         with open(path) as f:
             for line in f.readlines():
-                res = json.loads(line)
+                res = json_loads(line)
                 if oac == "oacs":
                     node = Node.createNodeFromDict(res['node'])
                 else:
@@ -817,39 +899,44 @@ class AddressBook:
                     with open(self.get_log_path('s_areg', action['index'], extension=BLIND_MONKEY_EVENTS_TAG)) as f2:
                         if "TYPE_VIEW_CLICKED" in f2.read():
                             api_actions_xpaths[action['element']['xpath']] = action
+        tb_reachable_index = SpatialIndex.createIndexFromNodes([Node.createNodeFromDict(element)
+                                                                for element in tb_reachable_xpaths.values()])
+        tb_actions_index = SpatialIndex.createIndexFromNodes([Node.createNodeFromDict(action)
+                                                              for action in tb_actions_xpaths.values()])
+        api_actions_index = SpatialIndex.createIndexFromNodes([Node.createNodeFromDict(action)
+                                                               for action in api_actions_xpaths.values()])
+        tb_reachable_xpath_list = list(tb_reachable_xpaths.keys())
+        tb_actions_xpath_list = list(tb_actions_xpaths.keys())
+        api_actions_xpath_list = list(api_actions_xpaths.keys())
         tba_resource_id_to_action = {}
         apia_resource_id_to_action = {}
         for oac_node in oac_nodes:
             info = {}
             max_subseq_tb_element = None
             if oac_node.visible:
-                for tb_xpath in tb_reachable_xpaths:
+                # The reachable elements that include the OAC
+                for i in tb_reachable_index.containing(oac_node.bounds):
+                    tb_xpath = tb_reachable_xpath_list[i]
                     if oac_node.xpath.startswith(tb_xpath):
-                        tb_node = Node.createNodeFromDict(tb_reachable_xpaths[tb_xpath])
-                        if not bounds_included(tb_node.bounds, oac_node.bounds):
-                            continue
                         if max_subseq_tb_element is None or len(max_subseq_tb_element['xpath']) < len(tb_xpath):
                             max_subseq_tb_element = tb_reachable_xpaths[tb_xpath]
             info['tbr'] = max_subseq_tb_element
             min_subseq_tb_action = None
             if info['tbr'] is not None:
-                for tb_xpath in tb_actions_xpaths:
+                # The actions on the elements inside the OAC
+                for i in tb_actions_index.inside(oac_node.bounds):
+                    tb_xpath = tb_actions_xpath_list[i]
                     if tb_xpath.startswith(oac_node.xpath):
-                        tb_node = Node.createNodeFromDict(tb_actions_xpaths[tb_xpath])
-                        if not bounds_included(oac_node.bounds, tb_node.bounds):
-                            continue
                         if min_subseq_tb_action is None or len(min_subseq_tb_action['xpath']) < len(tb_xpath):
                             min_subseq_tb_action = tb_actions_xpaths[tb_xpath]
             info['tba'] = min_subseq_tb_action
             if info['tba'] is not None and info['tba']['resource_id']:
                 tba_resource_id_to_action[info['tba']['resource_id']] = info['tba']
             min_subseq_api_action = None
-            for api_xpath in api_actions_xpaths:
+            for i in api_actions_index.inside(oac_node.bounds):
+                api_xpath = api_actions_xpath_list[i]
                 if api_xpath.startswith(oac_node.xpath):
-                    api_node = Node.createNodeFromDict(api_actions_xpaths[api_xpath])
-                    if not bounds_included(oac_node.bounds, api_node.bounds):
-                        continue
-                    if min_subseq_api_action is None or len(min_subseq_api_action['xpath']) < len(tb_xpath):
+                    if min_subseq_api_action is None or len(min_subseq_api_action['xpath']) < len(api_xpath):
                         min_subseq_api_action = api_actions_xpaths[api_xpath]
             info['apia'] = min_subseq_api_action
             if info['apia'] is not None and info['apia']['resource_id']:
@@ -868,44 +955,84 @@ async def capture_layout(device) -> Tuple[str, dict]:
     return await padb_logger.execute_async_with_log(latte_capture_layout(device_name=device.serial))
 
 
+async def _write_file(path: Union[str, Path], content: str) -> None:
+    async with aiofiles.open(path, mode='w') as f:
+        await f.write(content)
+
+
+async def _measure_time(timings: Dict[str, float], name: str, awaitable: Awaitable):
+    start_time = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = time.perf_counter() - start_time
+
+
 async def capture_current_state(address_book: AddressBook, device,
                                 mode: str,
                                 index: Union[int, str],
                                 has_layout=True,
                                 dumpsys: bool = False,
                                 log_message_map: Optional[dict] = None,
-                                use_adb_layout: bool = False) -> str:
+                                use_adb_layout: bool = False,
+                                timings: Optional[Dict[str, float]] = None) -> str:
+    """
+    Captures the screenshot, activity name, layout, and (if `dumpsys` is True) the windows and activities of the
+    device, and writes them in the address book. The probes are independent and run concurrently. The time of each
+    probe (in seconds) is recorded in `timings` if it's given.
+    """
     await asyncio.sleep(CAPTURE_STATE_DELAY)
-    await save_screenshot(device, address_book.get_screenshot_path(mode, index))
-    activity_name = await get_current_activity_name(device_name=device.serial)
-    with open(address_book.get_activity_name_path(mode, index), mode='w') as f:
-        f.write(activity_name + "\n")
+    if timings is None:
+        timings = {}
+    start_time = time.perf_counter()
+
+    async def capture_activity_name():
+        if dumpsys:
+            # The activity name is extracted from the windows instead of running dumpsys again
+            windows = await get_windows(device_name=device.serial)
+            await _write_file(address_book.get_log_path(mode, index, extension="WINDOWS"), windows + "\n")
+            activity_name = extract_activity_name(windows)
+        else:
+            activity_name = await get_current_activity_name(device_name=device.serial)
+        await _write_file(address_book.get_activity_name_path(mode, index), activity_name + "\n")
 
-    layout = ""
-    if has_layout:
+    async def capture_activities():
+        activities = await get_activities(device_name=device.serial)
+        await _write_file(address_book.get_log_path(mode, index, extension="ACTIVITIES"), activities + "\n")
+
+    async def capture_layout_probe() -> str:
         if use_adb_layout:
             layout = await adb_capture_layout(device_name=device.serial)
         else:
             log_map, layout = await capture_layout(device)
-            with open(address_book.get_log_path(mode, index, extension="layout"), mode='w') as f:
-                f.write(log_map[BLIND_MONKEY_TAG])
-        with open(address_book.get_layout_path(mode, index), mode='w') as f:
-            f.write(layout)
-
-    if log_message_map:
+            await _write_file(address_book.get_log_path(mode, index, extension="layout"), log_map[BLIND_MONKEY_TAG])
+        await _write_file(address_book.get_layout_path(mode, index), layout)
+        # Parsing the layout blocks, it's done in the default executor so the other probes are not stalled
+        signature = await asyncio.get_running_loop().run_in_executor(
+            None, LayoutSignature.createSignatureFromLayout, layout)
+        await _write_file(address_book.get_layout_signature_path(mode, index), json.dumps(signature.toJSON()))
+        return layout
+
+    async def write_log_messages():
         for tag, log_message in log_message_map.items():
-            with open(address_book.get_log_path(mode, index, extension=tag), mode='w') as f:
-                f.write(log_message)
+            await _write_file(address_book.get_log_path(mode, index, extension=tag), log_message)
 
+    probes = {
+        'screenshot': save_screenshot(device, address_book.get_screenshot_path(mode, index)),
+        'activity_name': capture_activity_name(),
+    }
+    if has_layout:
+        probes['layout'] = capture_layout_probe()
+    if log_message_map:
+        probes['log_messages'] = write_log_messages()
     if dumpsys:
-        windows = await get_windows(device_name=device.serial)
-        with open(address_book.get_log_path(mode, index, extension="WINDOWS"), mode='w') as f:
-            f.write(windows + "\n")
-        activities = await get_activities(device_name=device.serial)
-        with open(address_book.get_log_path(mode, index, extension="ACTIVITIES"), mode='w') as f:
-            f.write(activities + "\n")
+        probes['activities'] = capture_activities()
+    results = await asyncio.gather(*[_measure_time(timings, name, probe) for name, probe in probes.items()])
+    timings['total'] = time.perf_counter() - start_time
+    logger.debug(f"The state {mode}.{index} is captured, " +
+                 ", ".join(f"{name}: {timing * 1000:.0f} ms" for name, timing in timings.items()))
 
-    return layout  # TODO: Remove it
+    return dict(zip(probes.keys(), results)).get('layout', "")  # TODO: Remove it
 
 
 class ResultWriter:
@@ -1018,6 +1145,35 @@ def get_snapshot_paths(result_path: Union[str, Path] = None,
     return snapshot_paths
 
 
+def ingest_snapshot_layouts(snapshot_paths: List[Path],
+                            processes: int = None,
+                            chunk_size: int = None,
+                            progress_callback: Callable[[int, int, LayoutIngestionResult], None] = None,
+                            ordered: bool = False) \
+        -> Iterator[LayoutIngestionResult]:
+    """
+    Creates the node tables of the initial layouts of the snapshots in a pool of processes, the stored node tables
+    of the snapshots are used (or rewritten if they are outdated). The results are yielded in the order of
+    completion (or in the order of snapshot_paths if `ordered` is True) and their keys are the snapshot paths. The
+    snapshots without layout are skipped.
+    """
+    layout_items = []
+    for snapshot_path in snapshot_paths:
+        address_book = AddressBook(snapshot_path)
+        layout_path = address_book.get_layout_path(mode=AddressBook.BASE_MODE,
+                                                   index=AddressBook.INITIAL,
+                                                   should_exists=True)
+        if layout_path is None:
+            logger.error(f"The layout is not provided for snapshot {snapshot_path}!")
+            continue
+        layout_items.append((snapshot_path, layout_path, address_book.node_table_cache_path))
+    return ingest_layouts(layout_items,
+                          processes=processes,
+                          chunk_size=chunk_size,
+                          progress_callback=progress_callback,
+                          ordered=ordered)
+
+
 def read_all_visited_elements_in_app(app_path: Union[str, Path]) -> Dict[str, Node]:
     """
     Given the result path of an app, returns visited nodes, mapping xpath to the list of its nodes
@@ -1034,14 +1190,14 @@ def read_all_visited_elements_in_app(app_path: Union[str, Path]) -> Dict[str, No
             continue
         with open(address_book.visited_elements_path) as f:
             for line in f.readlines():
-                element = json.loads(line)
+                element = json_loads(line)
                 if element['state'] != 'selected' or element['node'] is None:
                     continue
                 visited_elements.setdefault(element['element']['xpath'], [])
                 visited_elements[element['element']['xpath']].append(Node.createNodeFromDict(element['node']))
         with open(address_book.s_action_path) as f:
             for line in f.readlines():
-                action = json.loads(line)
+                action = json_loads(line)
                 visited_elements.setdefault(action['element']['xpath'], [])
                 visited_elements[action['element']['xpath']].append(Node.createNodeFromDict(action['node']))
     return visited_elements
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from PIL import Image
+from cachetools import LRUCache
+
+from consts import SCREENSHOT_CACHE_SIZE, SCREENSHOT_ENCODER_WORKERS, LAST_SCREENSHOTS_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# The screenshots are decoded and encoded in these threads to not block the event loop
+_screenshot_executor = ThreadPoolExecutor(max_workers=SCREENSHOT_ENCODER_WORKERS,
+                                          thread_name_prefix="screenshot_encoder")
+# The decoded images of the recently saved screenshots, maps the path to the image and the mtime of the file
+_screenshot_images = LRUCache(maxsize=SCREENSHOT_CACHE_SIZE)
+# The digest and path of the last screenshot in each directory (i.e., each snapshot and mode), only the recently
+# used directories are kept
+_last_screenshots = LRUCache(maxsize=LAST_SCREENSHOTS_CACHE_SIZE)
+
+
+class UnsupportedFramebufferError(ValueError):
+    pass
+
+
+def decode_framebuffer(data: bytes) -> Image.Image:
+    """
+    Decodes the output of the `framebuffer:` service of adb, i.e., a header (version 1 or 2) and the raw pixels
+    """
+    if len(data) < 4:
+        raise UnsupportedFramebufferError("The framebuffer is empty")
+    version = struct.unpack_from("<I", data)[0]
+    if version == 1:
+        bpp, size, width, height, *color_fields = struct.unpack_from("<12I", data, 4)
+        header_size = 4 + 12 * 4
+    elif version == 2:
+        bpp, _, size, width, height, *color_fields = struct.unpack_from("<13I", data, 4)
+        header_size = 4 + 13 * 4
+    else:
+        raise UnsupportedFramebufferError(f"The framebuffer version {version} is not supported")
+    if bpp != 32:
+        raise UnsupportedFramebufferError(f"The framebuffer with {bpp} bits per pixel is not supported")
+    red_offset, red_length, blue_offset, blue_length, green_offset, green_length, alpha_offset, alpha_length = \
+        color_fields
+    channels = sorted([(red_offset, 'R'), (green_offset, 'G'), (blue_offset, 'B'),
+                       (alpha_offset, 'A' if alpha_length > 0 else 'X')])
+    raw_mode = "".join(channel for _, channel in channels)
+    mode = "RGBA" if alpha_length > 0 else "RGB"
+    if raw_mode not in ["RGBA", "BGRA", "ARGB", "ABGR", "RGBX", "BGRX", "XRGB", "XBGR"]:
+        raise UnsupportedFramebufferError(f"The framebuffer pixel format {raw_mode} is not supported")
+    pixels = data[header_size:header_size + size]
+    if len(pixels) != size or size != width * height * 4:
+        raise UnsupportedFramebufferError(f"The framebuffer is incomplete, size: {len(pixels)}/{size}")
+    return Image.frombuffer(mode, (width, height), pixels, "raw", raw_mode, 0, 1)
+
+
+async def capture_framebuffer(device) -> bytes:
+    """
+    Returns the raw framebuffer of the device, which is not encoded on the device (unlike `screencap -p`)
+    """
+    connection = await device.create_connection()
+    try:
+        await connection.send("framebuffer:")
+        return bytes(await connection.read_all())
+    finally:
+        await connection.close()
+
+
+def _get_digest(image: Image.Image) -> bytes:
+    return hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+
+
+def _decode_screenshot(framebuffer: Optional[bytes], encoded: Optional[bytes]) -> Tuple[Image.Image, bytes]:
+    if framebuffer is not None:
+        image = decode_framebuffer(framebuffer)
+    else:
+        image = Image.open(BytesIO(encoded))
+        image.load()
+    return image, _get_digest(image)
+
+
+def _write_screenshot(path: Path, image: Image.Image, encoded: Optional[bytes]) -> None:
+    if encoded is not None and path.suffix.lower() == ".png":
+        path.write_bytes(encoded)
+    else:
+        # The format (e.g., PNG or WebP) is determined by the extension
+        image.save(path)
+
+
+async def save_screenshot(device, file_name: Union[str, Path]) -> Optional[Image.Image]:
+    """
+    Captures the screenshot of the device and saves it in `file_name`, returns the decoded image. The raw framebuffer
+    is captured and encoded in a thread pool (if the framebuffer cannot be captured, the device encodes it with
+    `screencap`). If the screenshot is identical to the previous one in the same directory, the previous file is
+    copied instead of encoding it again. The image can be opened later by `open_screenshot` without decoding.
+    """
+    path = Path(file_name).resolve()
+    loop = asyncio.get_running_loop()
+    try:
+        framebuffer, encoded = None, None
+        try:
+            framebuffer = await capture_framebuffer(device)
+            image, digest = await loop.run_in_executor(_screenshot_executor, _decode_screenshot, framebuffer, None)
+        except (UnsupportedFramebufferError, struct.error, RuntimeError, OSError) as e:
+            logger.debug(f"The framebuffer could not be captured, using screencap. Error: {e}")
+            framebuffer, encoded = None, await device.screencap()
+            image, digest = await loop.run_in_executor(_screenshot_executor, _decode_screenshot, None, encoded)
+        directory = path.parent
+        last_digest, last_path = _last_screenshots.get(directory, (None, None))
+        if last_digest == digest and last_path.exists():
+            if last_path != path:
+                await loop.run_in_executor(_screenshot_executor, shutil.copyfile, last_path, path)
+        else:
+            await loop.run_in_executor(_screenshot_executor, _write_screenshot, path, image, encoded)
+        _last_screenshots[directory] = (digest, path)
+        _screenshot_images[str(path)] = (image, os.stat(path).st_mtime_ns)
+        return image
+    except Exception as e:
+        logger.error(f"The screenshot for {file_name} could not be taken. Exception: {e}")
+        return None
+
+
+def open_screenshot(file_name: Union[str, Path]) -> Image.Image:
+    """
+    Opens the image, if it's a screenshot that is recently saved by `save_screenshot`, a copy of the decoded image is
+    returned without reading the file.
+    """
+    key = str(Path(file_name).resolve())
+    cached_item = _screenshot_images.get(key, None)
+    if cached_item is not None:
+        image, mtime = cached_item
+        try:
+            if os.stat(key).st_mtime_ns == mtime:
+                return image.copy()
+        except OSError:
+            pass
+        del _screenshot_images[key]
+    return Image.open(file_name)
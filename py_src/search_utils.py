@@ -1,6 +1,8 @@
 from typing import List
 
-from GUI_utils import Node
+import numpy as np
+
+from GUI_utils import Node, NodeTable
 
 
 def compare_string(value: str, query: str):
@@ -97,4 +99,47 @@ def contains_node_with_attrs(nodes: List[Node], attrs: List[str], queries: List[
                 break
         if is_satisfied:
             return True
-    return False
\ No newline at end of file
+    return False
+
+
+def _int_mask(values: np.ndarray, query: str) -> np.ndarray:
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    satisfied = np.array([compare_int(int(value), query) for value in unique_values], dtype=bool)
+    return satisfied[inverse]
+
+
+def contains_table_node_with_attrs(node_table: NodeTable, attrs: List[str], queries: List[str]) -> bool:
+    """
+    The vectorized version of `contains_node_with_attrs` which works on the columns of a NodeTable. The queries
+    that cannot be vectorized (ALL and a11y_actions) are only checked on the remaining candidates.
+    """
+    string_attrs = ['text', 'content_desc', 'class_name', 'resource_id']
+    bool_attrs = ['clickable', 'checkable', 'visible', 'enabled', 'clickable_span', 'invalid', 'context_clickable',
+                  'long_clickable', 'important_for_accessibility']
+    if len(node_table) == 0:
+        return False
+    mask = np.ones(len(node_table), dtype=bool)
+    remaining_attrs = []
+    remaining_queries = []
+    for (attr, query) in zip(attrs, queries):
+        if not query:
+            continue  # TODO
+        if attr in string_attrs:
+            mask &= node_table.string_mask(attr, lambda value: compare_string(value, query))
+        elif attr in bool_attrs:
+            if query.strip().lower() != 'any':
+                mask &= node_table.flag(attr) == (query.strip().lower() == 'true')
+        elif attr == 'area':
+            mask &= _int_mask(node_table.area(), query)
+        elif attr == 'width':
+            mask &= _int_mask(node_table.bounds[:, 2] - node_table.bounds[:, 0], query)
+        elif attr == 'height':
+            mask &= _int_mask(node_table.bounds[:, 3] - node_table.bounds[:, 1], query)
+        else:
+            remaining_attrs.append(attr)
+            remaining_queries.append(query)
+        if not mask.any():
+            return False
+    if len(remaining_attrs) == 0:
+        return True
+    return contains_node_with_attrs(node_table.nodes(mask), remaining_attrs, remaining_queries)
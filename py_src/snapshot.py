@@ -1,15 +1,23 @@
 import asyncio
 import logging
 import shutil
+import statistics
+import time
+from collections import defaultdict
 from pathlib import Path
-from typing import Union, Callable, List
+from typing import Union, Callable, List, Dict, Awaitable
 from ppadb.client_async import ClientAsync as AdbClient
 from ppadb.device_async import DeviceAsync
 
-from GUI_utils import NodesFactory, Node, is_in_same_state_with_nodes
+from GUI_utils import NodesFactory, Node, NodeTable, SpatialIndex, XPathIndex, get_state_fingerprint, \
+    max_subsequence_substring, SNAPSHOT_STATE_EXCLUDED_ATTRIBUTES, XPATH_INDEX_PATTERN
 from a11y_service import A11yServiceManager
-from adb_utils import save_snapshot, load_snapshot
-from consts import DEVICE_NAME, ADB_HOST, ADB_PORT
+from adb_transport import get_shell_pool
+from adb_utils import save_snapshot, load_snapshot, is_boot_completed, get_focused_windows
+from consts import DEVICE_NAME, ADB_HOST, ADB_PORT, SNAPSHOT_READY_TIMEOUT, SNAPSHOT_READY_POLL_INTERVAL
+from latte_channel import get_latte_channel
+from latte_utils import get_latte_heartbeat
+from layout_ingestion import get_node_table_metadata, load_stored_node_table
 from results_utils import AddressBook, capture_current_state
 from utils import synch_run
 
@@ -21,17 +29,29 @@ class Snapshot:
         address_book.initiate()
         self.address_book = address_book
         self.name = address_book.snapshot_name()
-        self.initial_layout = None
+        self._initial_layout = None
+        self._initial_layout_path = None
         self.initial_screenshot = None
         self.nodes = []
         self.xpath_to_node = {}
+        self._node_table = None
+        self._spatial_index = None
+        self._xpath_index = None
+        self._similar_nodes_groups = None
+        self._resolved_nodes = {}
+        self._state_fingerprint = None
         self._setup_completed = False
 
     async def setup(self,
                     layout: str = None,
                     layout_path: Union[str, Path] = None,
                     screenshot: Union[str, Path] = None,
+                    node_table: NodeTable = None,
                     **kwargs):
+        """
+        Creates the nodes of the initial layout of the snapshot. If the node table of the layout is given (e.g., by
+        `ingest_snapshot_layouts`), the nodes are created from it.
+        """
         if self._setup_completed:
             return
         if layout is None and layout_path is None:
@@ -44,15 +64,21 @@ class Snapshot:
             if layout_path is None:
                 raise Exception(f"The layout is not provided for snapshot {self.name}!")
         if layout_path is not None:
-            with open(layout_path) as f:
-                layout = f.read()
-        self.initial_layout = layout
+            # The layout is read at the first access of initial_layout, the nodes do not need it
+            self._initial_layout_path = layout_path
+            if node_table is not None:
+                self._node_table = node_table
+                self.nodes = node_table.to_nodes()
+            else:
+                self.nodes = self._load_nodes(layout_path)
+        else:
+            self.nodes = NodesFactory() \
+                .with_layout(layout) \
+                .with_xpath_pass() \
+                .with_ad_detection() \
+                .build()
+            self.initial_layout = layout
         self.initial_screenshot = screenshot
-        self.nodes = NodesFactory() \
-            .with_layout(self.initial_layout) \
-            .with_xpath_pass() \
-            .with_ad_detection() \
-            .build()
 
         for node in self.nodes:
             self.xpath_to_node[node.xpath] = node
@@ -65,6 +91,83 @@ class Snapshot:
 
         self._setup_completed = True
 
+    def _load_nodes(self, layout_path: Union[str, Path]) -> List[Node]:
+        """
+        Loads the nodes of the layout file from the binary node table of the snapshot if it's created from the same
+        file (same size and modification time) by the same version, otherwise builds the nodes and rewrites the node
+        table. The nodes loaded from the table have no XML element.
+        """
+        metadata = get_node_table_metadata(layout_path)
+        cache_path = self.address_book.node_table_cache_path
+        node_table = load_stored_node_table(cache_path, metadata)
+        if node_table is not None:
+            self._node_table = node_table
+            return node_table.to_nodes()
+        # The nodes are not taken from the shared layout cache, since the nodes of a snapshot can be modified
+        nodes = NodesFactory() \
+            .with_layout_path(layout_path) \
+            .with_xpath_pass() \
+            .with_ad_detection() \
+            .build()
+        node_table = NodeTable.createTableFromNodes(nodes)
+        node_table.metadata = metadata
+        try:
+            node_table.write_to_file(cache_path)
+        except OSError as e:
+            logger.error(f"The node table of snapshot {self.name} could not be written: {e}")
+        self._node_table = node_table
+        return nodes
+
+    @property
+    def initial_layout(self) -> Union[str, None]:
+        """
+        The initial layout of the snapshot, if it's given by a layout file, the file is read at the first access
+        """
+        if self._initial_layout is None and self._initial_layout_path is not None:
+            with open(self._initial_layout_path) as f:
+                self._initial_layout = f.read()
+        return self._initial_layout
+
+    @initial_layout.setter
+    def initial_layout(self, layout: Union[str, None]) -> None:
+        self._initial_layout = layout
+        self._initial_layout_path = None
+
+    @property
+    def node_table(self) -> NodeTable:
+        """
+        The columnar representation of the nodes, it's created at the first access
+        """
+        if self._node_table is None:
+            self._node_table = NodeTable.createTableFromNodes(self.nodes)
+        return self._node_table
+
+    @property
+    def spatial_index(self) -> SpatialIndex:
+        """
+        The spatial index over the bounds of the nodes, it's created at the first access. The returned indices
+        of the queries can be passed to `node_table.nodes`.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.node_table.bounds)
+        return self._spatial_index
+
+    @property
+    def xpath_index(self) -> XPathIndex:
+        """
+        The xpath trie of the nodes, it's created at the first access. The returned indices of the queries can be
+        used with `nodes`.
+        """
+        if self._xpath_index is None:
+            self._xpath_index = XPathIndex.createIndexFromNodes(self.nodes)
+        return self._xpath_index
+
+    def get_nodes_at(self, x: int, y: int) -> List[Node]:
+        """
+        Returns the nodes whose bounds include the point (x, y), in the order of the layout
+        """
+        return self.node_table.nodes(self.spatial_index.containing_point(x, y))
+
     def clone(self, target_address_book: AddressBook) -> 'Snapshot':
         shutil.copytree(self.address_book.snapshot_result_path, target_address_book.snapshot_result_path, )
         return Snapshot(target_address_book)
@@ -75,53 +178,39 @@ class Snapshot:
 
         return [node for node in self.nodes if filter_query(node)]
 
+    def find_node(self, node: Node) -> Union[Node, None]:
+        """
+        Returns the node of the snapshot with the same xpath as the given node. If there is no such node, among the
+        nodes with almost the same xpath (see `Node.almost_same_xpath`), returns the one whose xpath has the longest
+        substring which is a subsequence of the given node's xpath. The candidates are grouped by their simplified
+        xpath (without indices) and resource id at the first call, and the results are cached.
+        """
+        indices = self.xpath_index.find(node.xpath)
+        if len(indices) > 0:
+            return self.nodes[indices[0]]
+        simple_xpath = XPATH_INDEX_PATTERN.sub('', node.xpath)
+        key = (node.xpath, node.resource_id)
+        if key not in self._resolved_nodes:
+            if self._similar_nodes_groups is None:
+                self._similar_nodes_groups = defaultdict(list)
+                for t_node in self.nodes:
+                    self._similar_nodes_groups[(XPATH_INDEX_PATTERN.sub('', t_node.xpath), t_node.resource_id)] \
+                        .append(t_node)
+            similar_nodes = self._similar_nodes_groups.get((simple_xpath, node.resource_id), [])
+            self._resolved_nodes[key] = max(similar_nodes,
+                                            key=lambda t_node: max_subsequence_substring(node.xpath, t_node.xpath),
+                                            default=None)
+        return self._resolved_nodes[key]
+
     def get_text_description(self, node: Node, depth: int = 1000, excluded_xpaths: List[str] = None) -> List[str]:
-        def max_subsequenc_substring(string_1, string_2, n, m) -> int:
-            # Copied from https://www.geeksforgeeks.org/find-length-longest-subsequence-one-string-substring-another-string/
-            MAX_LENGTH = 1000
-            dp = [[0 for i in range(MAX_LENGTH)]
-                  for i in range(MAX_LENGTH)]
-
-            # Initialize the dp[][] to 0.
-
-            # Calculating value for each element.
-            for i in range(1, m + 1):
-                for j in range(1, n + 1):
-
-                    # If alphabet of string
-                    # X and Y are equal make
-                    # dp[i][j] = 1 + dp[i-1][j-1]
-                    if(string_1[j - 1] == string_2[i - 1]):
-                        dp[i][j] = 1 + dp[i - 1][j - 1]
-
-                    # Else copy the previous value
-                    # in the row i.e dp[i-1][j-1]
-                    else:
-                        dp[i][j] = dp[i][j - 1]
-
-            # Finding the maximum length
-            ans = 0
-            for i in range(1, m + 1):
-                ans = max(ans, dp[i][n])
-            return ans
         if depth <= 0:
             return []
         my_node: Node = None
-        if node.xml_element is not None:
+        # The nodes of the snapshot may have no XML element, e.g., when they're loaded from the node table
+        if node.xml_element is not None or self.xpath_to_node.get(node.xpath, None) is node:
             my_node = node
         else:
-            for t_node in self.nodes:
-                if t_node.xpath == node.xpath:
-                    my_node = t_node
-                    break
-            if my_node is None:
-                similar_nodes = []
-                for t_node in self.nodes:
-                    if t_node.almost_same_xpath(node):
-                        sim = max_subsequenc_substring(node.xpath, t_node.xpath, len(node.xpath), len(t_node.xpath))
-                        similar_nodes.append((t_node, sim))
-                if len(similar_nodes) > 0:
-                    my_node = max(similar_nodes, key=lambda x: x[1])[0]
+            my_node = self.find_node(node)
         if my_node is None:
             return []
         if my_node.content_desc:
@@ -146,10 +235,21 @@ class Snapshot:
                          f"First Path: {self.address_book.snapshot_result_path}, "
                          f"Second Path: {other_snapshot.address_book.snapshot_result_path}")
             return False
-        return is_in_same_state_with_nodes(self.nodes, other_snapshot.nodes,
-                                           extra_excluded_attributes=['checked', 'selected', 'text', 'content_desc',
-                                                                      'visible'],
-                                           package_name=self.address_book.package_name())
+        state_fingerprint = self.get_state_fingerprint()
+        return state_fingerprint is not None and state_fingerprint == other_snapshot.get_state_fingerprint()
+
+    def get_state_fingerprint(self) -> Union[str, None]:
+        """
+        Returns the fingerprint of the app's nodes without the attributes that don't change the state, it's
+        calculated at the first call. Two snapshots of the same app are in the same state iff their state
+        fingerprints are equal.
+        """
+        if self._state_fingerprint is None:
+            self._state_fingerprint = get_state_fingerprint(
+                self.nodes,
+                extra_excluded_attributes=SNAPSHOT_STATE_EXCLUDED_ATTRIBUTES,
+                package_name=self.address_book.package_name())
+        return self._state_fingerprint
 
 
 class DeviceSnapshot(Snapshot):
@@ -183,28 +283,105 @@ class EmulatorSnapshot(DeviceSnapshot):
         super().__init__(address_book=address_book, device=device)
         self.tmp_snapshot = self.address_book.snapshot_name() + "_TMP"
         self.no_save_snapshot = no_save_snapshot
+        # The time (in seconds) of each step of the reloads, i.e., 'load', 'boot', 'latte', 'windows', and 'total'
+        self.reload_latencies: List[Dict[str, float]] = []
 
     async def setup(self, first_setup: bool = True, initial_emulator_load: bool = False, **kwargs):
         if initial_emulator_load:
             if not await load_snapshot(self.address_book.snapshot_name(), device_name=self.device.serial):
                 raise Exception("Error in loading snapshot")
+            await self._reset_device_state()
 
         await super().setup(first_setup=first_setup, **kwargs)
         if first_setup and not self.no_save_snapshot:
-            await asyncio.sleep(3)
+            await self.wait_until_ready()
             await save_snapshot(self.tmp_snapshot, device_name=self.device.serial)
 
-    async def reload(self, hard: bool = False) -> bool:
-        if hard:
-            if not await load_snapshot(self.address_book.snapshot_name(), device_name=self.device.serial):
+    async def _reset_device_state(self) -> None:
+        # The connections to the device are broken and the accessibility services and Latte of the loaded snapshot
+        # might be different
+        await get_shell_pool(self.device.serial).close()
+        await get_latte_channel(self.device.serial).close()
+        A11yServiceManager.invalidate(self.device.serial)
+        get_latte_heartbeat(self.device.serial).invalidate()
+
+    async def _poll_until(self, predicate: Callable[[], Awaitable[bool]], timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not await predicate():
+            if loop.time() >= deadline:
                 return False
-            await asyncio.sleep(3)
-            if not self.no_save_snapshot:
-                await save_snapshot(self.tmp_snapshot, device_name=self.device.serial)
-            return True
-        if self.no_save_snapshot:
+            await asyncio.sleep(SNAPSHOT_READY_POLL_INTERVAL)
+        return True
+
+    async def wait_until_ready(self,
+                               timeout: float = SNAPSHOT_READY_TIMEOUT,
+                               timings: Dict[str, float] = None) -> bool:
+        """
+        Waits until the device is ready after loading a snapshot, i.e., the device is booted, Latte is live (if it's
+        enabled), and the focused window is not changed between two polls. Each check waits at most `timeout`
+        seconds, and its time is recorded in `timings` if it's given. Returns False if any check is timed out.
+        """
+        if timings is None:
+            timings = {}
+        last_focused_windows = None
+
+        async def is_latte_ready() -> bool:
+            if not await A11yServiceManager.is_enabled("latte", device_name=self.device.serial):
+                return True
+            return await A11yServiceManager.wait_for_latte(timeout=timeout, device_name=self.device.serial)
+
+        async def are_windows_stable() -> bool:
+            nonlocal last_focused_windows
+            focused_windows = await get_focused_windows(device_name=self.device.serial)
+            is_stable = len(focused_windows) > 0 and focused_windows == last_focused_windows
+            last_focused_windows = focused_windows
+            return is_stable
+
+        is_ready = True
+        checks = [('boot', lambda: self._poll_until(lambda: is_boot_completed(device_name=self.device.serial),
+                                                    timeout)),
+                  ('latte', is_latte_ready),
+                  ('windows', lambda: self._poll_until(are_windows_stable, timeout))]
+        for name, check in checks:
+            start_time = time.perf_counter()
+            if not await check():
+                logger.warning(f"The snapshot {self.name} is not ready after {timeout} seconds, check: {name}")
+                is_ready = False
+            timings[name] = time.perf_counter() - start_time
+        return is_ready
+
+    async def reload(self, hard: bool = False) -> bool:
+        if not hard and self.no_save_snapshot:
             logger.error("There is no temporary snapshot saved!")
             return False
-        result = await load_snapshot(self.tmp_snapshot, device_name=self.device.serial)
-        await asyncio.sleep(3)
+        timings = {}
+        start_time = time.perf_counter()
+        snapshot_name = self.address_book.snapshot_name() if hard else self.tmp_snapshot
+        result = await load_snapshot(snapshot_name, device_name=self.device.serial)
+        timings['load'] = time.perf_counter() - start_time
+        if hard and not result:
+            return False
+        await self._reset_device_state()
+        await self.wait_until_ready(timings=timings)
+        timings['total'] = time.perf_counter() - start_time
+        self.reload_latencies.append(timings)
+        logger.info(f"The snapshot {self.name} is reloaded in {timings['total'] * 1000:.0f} ms, " +
+                    ", ".join(f"{name}: {timing * 1000:.0f} ms" for name, timing in timings.items() if name != 'total'))
+        if hard and not self.no_save_snapshot:
+            await save_snapshot(self.tmp_snapshot, device_name=self.device.serial)
         return result
+
+    def reload_latency_summary(self) -> Dict[str, dict]:
+        """
+        The distribution of the time (in seconds) of each step of the reloads
+        """
+        summary = {}
+        for name in self.reload_latencies[0].keys() if self.reload_latencies else []:
+            latencies = sorted(timings[name] for timings in self.reload_latencies if name in timings)
+            summary[name] = {'count': len(latencies),
+                             'mean_time': statistics.mean(latencies),
+                             'median_time': statistics.median(latencies),
+                             'p90_time': latencies[min(len(latencies) - 1, int(0.9 * len(latencies)))],
+                             'max_time': latencies[-1]}
+        return summary
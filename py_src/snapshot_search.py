@@ -3,8 +3,8 @@ from pathlib import Path
 from typing import List
 import logging
 
-from results_utils import AddressBook
-from search_utils import contains_node_with_attrs
+from results_utils import AddressBook, ingest_snapshot_layouts
+from search_utils import contains_table_node_with_attrs
 from snapshot import Snapshot
 from utils import synch_run
 
@@ -34,9 +34,9 @@ class SnapshotSearchQuery:
 
     def contains_node(self, attrs: List[str], queries: List[str]):
         def contains_node_satisfies(snapshot: Snapshot) -> bool:
-            if snapshot is None or not snapshot.initial_layout or len(snapshot.nodes) == 0:
+            if snapshot is None or len(snapshot.nodes) == 0:
                 return False
-            return contains_node_with_attrs(snapshot.nodes, attrs, queries)
+            return contains_table_node_with_attrs(snapshot.node_table, attrs, queries)
 
         if len(attrs) == len(queries):
             self.filters.append(contains_node_satisfies)
@@ -50,26 +50,38 @@ class SnapshotSearchManager:
     def search(self,
                search_query: SnapshotSearchQuery,
                snapshot_limit: int = 10000,
+               processes: int = None,
                ) -> List[Snapshot]:
-        results = []
+        """
+        Returns the snapshots satisfying the query, sorted by their paths. The layouts of the snapshots are parsed in
+        a pool of processes, but they are checked in the order of the paths, so the first `snapshot_limit` snapshots
+        are returned regardless of the order the layouts are ingested.
+        """
+        snapshot_paths = []
         for app_path in self.result_path.iterdir():
-            if len(results) >= snapshot_limit:
-                break
             if not app_path.is_dir():
                 continue
             if not search_query.is_valid_app(app_path.name):
                 continue
-            for snapshot_path in app_path.iterdir():
-                if len(results) >= snapshot_limit:
-                    break
-                if not snapshot_path.is_dir():
-                    continue
-                address_book = AddressBook(snapshot_path)
-                try:
-                    snapshot = Snapshot(address_book)
-                    synch_run(snapshot.setup())
-                    if search_query.satisfies(snapshot):
-                        results.append(snapshot)
-                except Exception as e:
-                    logger.error(f"Error in SnapshotSearch for snapshot {address_book.snapshot_result_path}: {e}")
+            snapshot_paths.extend(snapshot_path for snapshot_path in app_path.iterdir() if snapshot_path.is_dir())
+        results = []
+        snapshot_paths.sort()
+        for ingestion_result in ingest_snapshot_layouts(snapshot_paths, processes=processes, ordered=True):
+            if len(results) >= snapshot_limit:
+                break
+            if not ingestion_result.is_successful():
+                continue
+            address_book = AddressBook(ingestion_result.key)
+            try:
+                snapshot = Snapshot(address_book)
+                screenshot = address_book.get_screenshot_path(mode=AddressBook.BASE_MODE,
+                                                              index=AddressBook.INITIAL,
+                                                              should_exists=True)
+                synch_run(snapshot.setup(layout_path=ingestion_result.layout_path,
+                                         screenshot=screenshot,
+                                         node_table=ingestion_result.node_table))
+                if search_query.satisfies(snapshot):
+                    results.append(snapshot)
+            except Exception as e:
+                logger.error(f"Error in SnapshotSearch for snapshot {address_book.snapshot_result_path}: {e}")
         return results
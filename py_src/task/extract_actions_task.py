@@ -1,9 +1,11 @@
-import json
 import logging
 import re
 from collections import Counter, defaultdict
 
-from GUI_utils import Node
+import numpy as np
+
+from GUI_utils import Node, NodeTable
+from json_util import json_loads
 from results_utils import Actionables
 from snapshot import Snapshot
 from task.snapshot_task import SnapshotTask
@@ -18,6 +20,16 @@ def is_node_clickable(node: Node, use_naf: bool = True) -> bool:
            (node.naf if use_naf else False)
 
 
+def clickable_mask(node_table: NodeTable, use_naf: bool = True) -> np.ndarray:
+    """
+    The vectorized version of `is_node_clickable`
+    """
+    mask = node_table.flag('clickable') | node_table.has_action("16")
+    if use_naf:
+        mask |= node_table.flag('naf')
+    return mask
+
+
 class ExtractActionsTask(SnapshotTask):
     def __init__(self, snapshot: Snapshot):
         super().__init__(snapshot)
@@ -26,30 +38,30 @@ class ExtractActionsTask(SnapshotTask):
         self.snapshot.address_book.initiate_extract_actions_task()
         only_visible: bool = True
         no_ad: bool = True
-        actionable_node_queries = [is_node_clickable]
+        node_table = self.snapshot.node_table
+        actionable_mask = clickable_mask(node_table)
         if only_visible:
-            actionable_node_queries.append(lambda node: node.visible)
+            actionable_mask &= node_table.flag('visible')
         if no_ad:
-            actionable_node_queries.append(lambda node: not node.is_ad)
+            actionable_mask &= ~node_table.flag('is_ad')
         nodes_map = {}
         for mode in self.snapshot.address_book.extract_actions_modes:
             nodes_map[mode] = []
-        nodes_map[Actionables.All] = self.snapshot.get_nodes(
-            filter_query=lambda node: all(q(node) for q in actionable_node_queries))
+        nodes_map[Actionables.All] = node_table.nodes(actionable_mask)
         tb_reachable_nodes = {}
         if self.snapshot.address_book.tb_explore_visited_nodes_path.exists():
             with open(self.snapshot.address_book.tb_explore_visited_nodes_path) as f:
                 for line in f.readlines():
-                    tb_reachable_node = Node.createNodeFromDict(json.loads(line))
+                    tb_reachable_node = Node.createNodeFromDict(json_loads(line))
                     corresponding_node = None
                     if tb_reachable_node.xpath in self.snapshot.xpath_to_node:
                         corresponding_node = self.snapshot.xpath_to_node[tb_reachable_node.xpath]
                     elif tb_reachable_node.text or tb_reachable_node.content_desc or tb_reachable_node.resource_id:
-                        similar_nodes = self.snapshot.get_nodes(
-                            filter_query=lambda node: node.class_name == tb_reachable_node.class_name and
-                                                      node.resource_id == tb_reachable_node.resource_id and
-                                                      node.content_desc == tb_reachable_node.content_desc and
-                                                      node.text == tb_reachable_node.text
+                        similar_nodes = node_table.nodes(
+                            node_table.string_equals('class_name', tb_reachable_node.class_name) &
+                            node_table.string_equals('resource_id', tb_reachable_node.resource_id) &
+                            node_table.string_equals('content_desc', tb_reachable_node.content_desc) &
+                            node_table.string_equals('text', tb_reachable_node.text)
                         )
                         if len(similar_nodes) == 1:
                             corresponding_node = similar_nodes[0]
@@ -74,8 +86,11 @@ class ExtractActionsTask(SnapshotTask):
             nodes_map[Actionables.UniqueResource].append(node)
 
         nodes_map[Actionables.Spanned] = []
-        for node in self.snapshot.get_nodes(
-                filter_query=lambda node: node.clickable_span and not node.clickable and node.text and not node.is_ad):
+        spanned_mask = node_table.flag('clickable_span') & \
+                       ~node_table.flag('clickable') & \
+                       ~node_table.string_equals('text', '') & \
+                       ~node_table.flag('is_ad')
+        for node in node_table.nodes(spanned_mask):
             nodes_map[Actionables.Spanned].append(node)
 
         pre_selected = []
@@ -115,14 +130,9 @@ class ExtractActionsTask(SnapshotTask):
                               nodes)
 
     def is_xpath_actionable(self, xpath: str) -> bool:
-
-        while len(xpath) > 1 and xpath[0] == '/':
-            if xpath not in self.snapshot.xpath_to_node:
-                logger.error(f"The element could not be found in layout! Xpath: {xpath}")
-                return False
-            node = self.snapshot.xpath_to_node[xpath]
-            if is_node_clickable(node):
-                # TODO: Maybe we need more checks here
-                return True
-            xpath = xpath[:xpath.rfind("/")]
-        return False
+        if xpath not in self.snapshot.xpath_to_node:
+            logger.error(f"The element could not be found in layout! Xpath: {xpath}")
+            return False
+        # TODO: Maybe we need more checks here
+        return any(is_node_clickable(self.snapshot.nodes[index])
+                   for index in self.snapshot.xpath_index.ancestors(xpath, include_self=True))
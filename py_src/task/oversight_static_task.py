@@ -2,6 +2,8 @@ import json
 import logging
 from collections import defaultdict
 
+import numpy as np
+
 from GUI_utils import NodesFactory
 from results_utils import OAC
 from snapshot import Snapshot
@@ -19,45 +21,53 @@ class OversightStaticTask(SnapshotTask):
         self.snapshot.address_book.initiate_oversight_static_task()
         pkg_name = self.snapshot.address_book.app_name()  # TODO: It's not always correct
 
-        nodes = NodesFactory() \
+        node_table = NodesFactory() \
             .with_layout(self.snapshot.initial_layout) \
             .with_ad_detection() \
             .with_xpath_pass() \
             .with_covered_pass() \
-            .build()
+            .build_table()
 
-        screen_bounds = nodes[0].bounds
+        screen_bounds = tuple(node_table.bounds[0])
+        out_of_bounds = node_table.is_out_of_bounds(screen_bounds)
+        zero_area = node_table.area() == 0
+        visible = node_table.flag('visible')
+        is_ad = node_table.flag('is_ad')
+        potentially_data = ~node_table.string_equals('text', '') | ~node_table.string_equals('content_desc', '')
+        potentially_function = node_table.flag('clickable') | \
+                               node_table.flag('long_clickable') | \
+                               node_table.has_action("16") | \
+                               node_table.has_action("32")
 
         oa_conditions = {
-            OAC.P1_BELONGS: lambda node: not node.belongs(pkg_name),
-            OAC.P2_OUT_OF_BOUNDS: lambda node: node.is_out_of_bounds(screen_bounds),
-            OAC.P3_COVERED: lambda node: node.covered and not node.is_out_of_bounds(screen_bounds),
-            OAC.P4_ZERO_AREA: lambda node: node.area() == 0,
-            OAC.P5_AINVISIBLE: lambda node: not node.visible and
-                                            not node.is_out_of_bounds(screen_bounds) and
-                                            node.area() != 0,
-            OAC.A2_CONDITIONAL_DISABLED: lambda node: not node.enabled,
-            OAC.A3_INCONSISTENT_ABILITIES: lambda node: not node.clickable and "16" in node.a11y_actions,
-            OAC.A4_CAMOUFLAGED: lambda node: (node.text == node.content_desc == "") and
-                                             node.class_name == "android.widget.TextView" and
-                                             node.visible and
-                                             not node.is_out_of_bounds(screen_bounds) and
-                                             not node.area() == 0,
-            OAC.O_AD: lambda node: node.is_ad
+            OAC.P1_BELONGS: ~node_table.string_equals('pkg_name', pkg_name),
+            OAC.P2_OUT_OF_BOUNDS: out_of_bounds,
+            OAC.P3_COVERED: node_table.flag('covered') & ~out_of_bounds,
+            OAC.P4_ZERO_AREA: zero_area,
+            OAC.P5_AINVISIBLE: ~visible & ~out_of_bounds & ~zero_area,
+            OAC.A2_CONDITIONAL_DISABLED: ~node_table.flag('enabled'),
+            OAC.A3_INCONSISTENT_ABILITIES: ~node_table.flag('clickable') & node_table.has_action("16"),
+            OAC.A4_CAMOUFLAGED: node_table.string_equals('text', '') &
+                                node_table.string_equals('content_desc', '') &
+                                node_table.string_equals('class_name', "android.widget.TextView") &
+                                visible &
+                                ~out_of_bounds &
+                                ~zero_area,
+            OAC.O_AD: is_ad
         }
-        oa_conditions[OAC.A1_PINVISIBLE] = lambda node: any(oa_conditions[oac](node) for oac in OAC if oac.name.startswith("P"))
+        oa_conditions[OAC.A1_PINVISIBLE] = np.logical_or.reduce(
+            [oa_conditions[oac] for oac in OAC if oac.name.startswith("P")])
 
         node_to_oac_map = defaultdict(list)
         oac_count = {}
-        for key, query in oa_conditions.items():
-            queries = [query]
+        for key, condition in oa_conditions.items():
             if key.name.startswith("P"):
-                queries.append(lambda node: not node.is_ad and node.potentially_data())
+                condition = condition & ~is_ad & potentially_data
             elif key.name.startswith("A"):
-                queries.append(lambda node: not node.is_ad and node.potentially_function())
+                condition = condition & ~is_ad & potentially_function
             else:
-                queries.append(lambda node: node.potentially_data() or node.potentially_function())
-            oa_nodes = [node for node in nodes if all(q(node) for q in queries)]
+                condition = condition & (potentially_data | potentially_function)
+            oa_nodes = node_table.nodes(condition)
             annotate_elements(self.snapshot.initial_screenshot,
                               self.snapshot.address_book.get_os_result_path(key, extension='png'),
                               oa_nodes)
@@ -5,6 +5,7 @@ from GUI_utils import Node
 from command import ClickCommand, CommandResponse, LocatableCommandResponse
 from consts import BLIND_MONKEY_TAG, BLIND_MONKEY_EVENTS_TAG
 from controller import TalkBackTouchController, TouchController, A11yAPIController, TalkBackAPIController
+from json_util import json_loads
 from latte_executor_utils import report_atf_issues
 from padb_utils import ParallelADBLogger
 from results_utils import AddressBook, Actionables, capture_current_state, ActionResult
@@ -39,7 +40,7 @@ class PerformActionsTask(SnapshotTask):
         selected_actionable_nodes = []
         with open(snapshot.address_book.extract_actions_nodes[Actionables.Selected]) as f:
             for line in f.readlines():
-                node = Node.createNodeFromDict(json.loads(line.strip()))
+                node = Node.createNodeFromDict(json_loads(line.strip()))
                 selected_actionable_nodes.append(node)
         logger.info(f"There are {len(selected_actionable_nodes)} actionable nodes!")
         tags = [BLIND_MONKEY_TAG, BLIND_MONKEY_EVENTS_TAG]
@@ -97,6 +98,7 @@ class PerformActionsTask(SnapshotTask):
                                outline=[(244, 164, 96), (144, 238, 144), (220, 20, 60), (0, 139, 139)],
                                width=[5, 15, 5, 5],
                                scale=[1, 20, 7, 13])
+        logger.info(f"The latencies of reloading the snapshot: {snapshot.reload_latency_summary()}")
 
     async def write_ATF_issues(self):
         atf_issues = await report_atf_issues()
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import adb_transport
+import latte_channel
+from a11y_service import A11yServiceManager
+from adb_transport import DeviceShellPool
+from latte_channel import LatteChannel
+from latte_utils import get_latte_heartbeat
+from test.test_adb_transport import FakeADBServer
+from test.test_latte_channel import FakeLatte
+
+# The `settings` command of the device, the calls are logged in `calls` and the value is kept in `value`. The
+# services are bound (kept in `bound`) a bit later.
+FAKE_SETTINGS_SCRIPT = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+case "$1" in
+    get) cat "$(dirname "$0")/value" 2>/dev/null || echo null ;;
+    put) echo "$4" > "$(dirname "$0")/value"; (sleep 0.3; echo "$4" > "$(dirname "$0")/bound") & ;;
+    delete) rm -f "$(dirname "$0")/value"; (sleep 0.3; rm -f "$(dirname "$0")/bound") & ;;
+esac
+"""
+# The `dumpsys accessibility` command of the device, TalkBack is bound if it's in `bound`
+FAKE_DUMPSYS_ACCESSIBILITY_SCRIPT = """#!/bin/sh
+case "$(cat "$(dirname "$0")/bound" 2>/dev/null)" in
+    *talkback*) bound="Service[label=TalkBack, feedbackType[FEEDBACK_SPOKEN], capabilities=251]" ;;
+esac
+echo "User state[attributes:{id=0, currentUser=true}"
+echo "     Bound services:{$bound}"
+"""
+
+
+class TestA11yService(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_dir = Path(self.directory.name)
+        for name, script in [("settings", FAKE_SETTINGS_SCRIPT), ("dumpsys", FAKE_DUMPSYS_ACCESSIBILITY_SCRIPT)]:
+            (self.settings_dir / name).write_text(script)
+            (self.settings_dir / name).chmod(0o755)
+        self.original_path = os.environ["PATH"]
+        os.environ["PATH"] = f"{self.settings_dir}{os.pathsep}{self.original_path}"
+        A11yServiceManager.invalidate("fake-device")
+
+    def tearDown(self):
+        os.environ["PATH"] = self.original_path
+        A11yServiceManager.invalidate("fake-device")
+        self.directory.cleanup()
+
+    def pop_settings_calls(self) -> list:
+        calls_path = self.settings_dir / "calls"
+        if not calls_path.exists():
+            return []
+        calls = [call.split()[0] for call in calls_path.read_text().splitlines()]
+        calls_path.unlink()
+        return calls
+
+    def test_setup_latte_a11y_services(self):
+        tb, latte = A11yServiceManager.services["tb"], A11yServiceManager.services["latte"]
+
+        async def scenario():
+            server = await FakeADBServer().start()
+            server.services["tcp:8712"] = FakeLatte().handle_connection
+            loop = asyncio.get_running_loop()
+            pool = DeviceShellPool("fake-device", adb_port=server.port)
+            channel = LatteChannel("fake-device", adb_port=server.port, device_port=8712)
+            adb_transport._shell_pools.setdefault(loop, {})["fake-device"] = pool
+            latte_channel._latte_channels.setdefault(loop, {})["fake-device"] = channel
+            try:
+                (self.settings_dir / "value").write_text("other/Service\n")
+                await A11yServiceManager.setup_latte_a11y_services(tb=False, device_name="fake-device")
+                self.assertEqual(["get", "put"], self.pop_settings_calls())
+                self.assertEqual(["other/Service", latte], await A11yServiceManager.get_enabled_services(
+                    use_cache=True, device_name="fake-device"))
+                # Enabling and disabling TalkBack is one write, and nothing is written if the state is not changed
+                await A11yServiceManager.setup_latte_a11y_services(tb=True, device_name="fake-device")
+                # TalkBack is bound once the services are set up
+                self.assertTrue(await A11yServiceManager.is_bound("tb", device_name="fake-device"))
+                await A11yServiceManager.setup_latte_a11y_services(tb=True, device_name="fake-device")
+                self.assertEqual(["put"], self.pop_settings_calls())
+                self.assertEqual(f"other/Service:{latte}:{tb}", (self.settings_dir / "value").read_text().strip())
+                await A11yServiceManager.setup_latte_a11y_services(tb=False, device_name="fake-device")
+                self.assertFalse(await A11yServiceManager.is_bound("tb", device_name="fake-device"))
+                self.assertEqual(["put"], self.pop_settings_calls())
+                self.assertEqual(["other/Service", "latte"], await A11yServiceManager.get_enabled_services(
+                    simplify=True, device_name="fake-device"))
+                self.assertEqual(["get"], self.pop_settings_calls())
+                # The services are read again once the state is invalidated, e.g., after loading a snapshot
+                (self.settings_dir / "value").write_text(f"{tb}\n")
+                A11yServiceManager.invalidate("fake-device")
+                self.assertTrue(await A11yServiceManager.is_enabled("tb", device_name="fake-device"))
+                self.assertTrue(await A11yServiceManager.is_enabled("tb", use_cache=True, device_name="fake-device"))
+                self.assertTrue(await A11yServiceManager.disable("tb", device_name="fake-device"))
+                self.assertEqual(0, await A11yServiceManager.enable([], device_name="fake-device"))
+                self.assertEqual(["get", "delete"], self.pop_settings_calls())
+                self.assertFalse((self.settings_dir / "value").exists())
+                # The device is changed by others, only the cached answer is stale
+                (self.settings_dir / "value").write_text(f"{tb}\n")
+                self.assertFalse(await A11yServiceManager.is_enabled("tb", use_cache=True, device_name="fake-device"))
+                self.assertTrue(await A11yServiceManager.is_enabled("tb", device_name="fake-device"))
+                self.assertEqual(["get"], self.pop_settings_calls())
+            finally:
+                await get_latte_heartbeat("fake-device").stop()
+                await channel.close()
+                await pool.close()
+                await server.stop()
+
+        asyncio.run(scenario())
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import signal
+import tempfile
+import unittest
+from pathlib import Path
+
+import adb_transport
+from adb_transport import DeviceShellPool, ShellSessionClosedError, ShellSessionOpenError, run_device_shell
+
+
+class FakeADBServer:
+    """
+    A local stand-in of the ADB server, the shell service runs a local `sh`. The other services of the device
+    (e.g., `tcp:8712`) can be added to `services` by their handlers, and the other shell commands are answered by
+    the output of `shell_command_handler`.
+    """
+
+    def __init__(self):
+        self.server = None
+        self.port = None
+        self.shell_count = 0
+        self.processes = []
+        self.services = {}
+        self.shell_command_handler = None
+
+    async def start(self) -> 'FakeADBServer':
+        self.server = await asyncio.start_server(self.handle_connection, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        for process in self.processes:
+            if process.returncode is None:
+                # The commands of the shell are in its process group
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            length = await reader.readexactly(4)
+            request = (await reader.readexactly(int(length, 16))).decode('utf-8')
+            if request.startswith("host:transport:"):
+                if request != "host:transport:fake-device":
+                    writer.write(b"FAIL0010device not found")
+                    writer.close()
+                    return
+                writer.write(b"OKAY")
+            elif request == "shell:sh":
+                writer.write(b"OKAY")
+                break
+            elif request in self.services:
+                writer.write(b"OKAY")
+                await self.services[request](reader, writer)
+                writer.close()
+                return
+            elif request.startswith("shell:") and self.shell_command_handler is not None:
+                writer.write(b"OKAY")
+                writer.write(await self.shell_command_handler(request[len("shell:"):]))
+                writer.close()
+                return
+            else:
+                writer.write(b"FAIL0013unknown service")
+                writer.close()
+                return
+        self.shell_count += 1
+        process = await asyncio.create_subprocess_exec("sh",
+                                                       stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       start_new_session=True)
+        self.processes.append(process)
+
+        async def forward_input():
+            while data := await reader.read(4096):
+                process.stdin.write(data)
+            process.stdin.close()
+
+        input_task = asyncio.create_task(forward_input())
+        while data := await process.stdout.read(4096):
+            writer.write(data)
+            await writer.drain()
+        input_task.cancel()
+        writer.close()
+
+
+class TestADBTransport(unittest.TestCase):
+    def test_shell_pool(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            pool = DeviceShellPool("fake-device", size=2, adb_port=server.port)
+            try:
+                self.assertEqual((0, "hello\n", ""), await pool.execute("echo hello"))
+                self.assertEqual((3, "no new line", ""), await pool.execute("printf 'no new line'; exit 3"))
+                self.assertEqual((0, "err\n", ""), await pool.execute("echo err >&2 # a comment"))
+                results = await asyncio.gather(*[pool.execute(f"sleep 0.1; echo {i}") for i in range(6)])
+                self.assertEqual([f"{i}\n" for i in range(6)], [output for _, output, _ in results])
+                self.assertEqual(2, server.shell_count)
+                with self.assertRaises(asyncio.TimeoutError):
+                    await pool.execute("sleep 5", timeout=0.2)
+                # The timed out session is discarded
+                self.assertEqual(1, len(pool._idle_sessions))
+                results = await asyncio.gather(*[pool.execute(f"echo ok") for _ in range(2)])
+                self.assertEqual([(0, "ok\n", "")] * 2, results)
+                self.assertEqual(3, server.shell_count)
+                self.assertEqual(4, pool.latency_summary()['echo']['count'])
+                self.assertEqual(6, pool.latency_summary()['sleep']['count'])
+                session = pool._idle_sessions[0]
+                await session.close()
+                with self.assertRaises(ShellSessionClosedError):
+                    await session.execute("echo closed")
+            finally:
+                await pool.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_session_closed_while_idle(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            pool = DeviceShellPool("fake-device", adb_port=server.port)
+            try:
+                self.assertEqual((0, "hello\n", ""), await pool.execute("echo hello"))
+                # The device closes the idle session, the command is executed again on a new session
+                os.killpg(server.processes[0].pid, signal.SIGKILL)
+                await server.processes[0].wait()
+                self.assertEqual((0, "again\n", ""), await pool.execute("echo again"))
+                self.assertEqual(2, server.shell_count)
+                # A command whose output has arrived is not executed again
+                with self.assertRaises(ShellSessionClosedError):
+                    await pool.execute("echo partial; kill -9 $$; sleep 1")
+                self.assertEqual(2, server.shell_count)
+                self.assertEqual([], pool._idle_sessions)
+            finally:
+                await pool.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_unknown_device(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            pool = DeviceShellPool("unknown-device", adb_port=server.port)
+            try:
+                with self.assertRaises(ShellSessionOpenError):
+                    await pool.execute("echo hello")
+            finally:
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_run_device_shell_timeout(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            pool = DeviceShellPool("fake-device", adb_port=server.port)
+            adb_transport._shell_pools.setdefault(asyncio.get_running_loop(), {})["fake-device"] = pool
+            try:
+                with tempfile.TemporaryDirectory() as directory:
+                    calls_path = Path(directory) / "calls"
+                    # The timed out command is not executed again with `adb shell`
+                    return_code, _, _ = await run_device_shell(f"echo call >> {calls_path}; sleep 5",
+                                                               device_name="fake-device",
+                                                               timeout=0.3)
+                    self.assertEqual(124, return_code)
+                    self.assertEqual(["call"], calls_path.read_text().split())
+            finally:
+                await pool.close()
+                await server.stop()
+
+        asyncio.run(scenario())
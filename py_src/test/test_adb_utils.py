@@ -0,0 +1,13 @@
+import unittest
+
+from adb_utils import extract_activity_name
+
+
+class TestADBUtils(unittest.TestCase):
+    def test_extract_activity_name(self):
+        windows = "WINDOW MANAGER WINDOWS (dumpsys window windows)\n" \
+                  "  mObscuringWindow=Window{5f4 u0 com.example/com.example.MainActivity}\n" \
+                  "  mFocusedApp=AppWindowToken{c2a token=Token{9f1 ActivityRecord{1d3 u0 com.example/.Main}}}\n"
+        self.assertEqual("  mObscuringWindow=Window{5f4 u0 com.example/com.example.MainActivity}\n",
+                         extract_activity_name(windows))
+        self.assertEqual("", extract_activity_name(""))
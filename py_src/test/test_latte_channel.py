@@ -0,0 +1,236 @@
+import asyncio
+import time
+import unittest
+
+import latte_channel
+from adb_utils import read_local_android_file
+from latte_channel import LatteChannel, LatteChannelClosedError
+from latte_utils import send_command_to_latte, send_commands_sequence_to_latte, _encode_latte_message, \
+    LatteHeartbeat
+from test.test_adb_transport import FakeADBServer
+
+
+class FakeLatte:
+    """
+    A local stand-in of the channel of Latte (LatteChannel.java), the result files are kept in `files` and the
+    received commands in `commands`. The commands in `known_commands` succeed, and the `stuck` commands are not
+    answered until they're cancelled.
+    """
+
+    def __init__(self, known_commands=("is_live", "controller_set", "controller_execute")):
+        self.files = {}
+        self.waiters = {}
+        self.writers = []
+        self.commands = []
+        self.known_commands = known_commands
+        self.stuck_requests = []
+        self.cancelled_requests = []
+
+    def write_file(self, file_name: str, content: str):
+        self.files[file_name] = content
+        remove = False
+        for writer, request_id, remove_file in self.waiters.pop(file_name, []):
+            self.send_result(writer, request_id, content)
+            remove |= remove_file
+        if remove:
+            del self.files[file_name]
+
+    def stop(self):
+        for writer in self.writers:
+            writer.close()
+
+    @staticmethod
+    def send_result(writer: asyncio.StreamWriter, request_id: int, content: str):
+        content = content.encode('utf-8')
+        writer.write(f"RESULT {request_id} {len(content)}\n".encode('utf-8') + content)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.append(writer)
+        while line := await reader.readline():
+            request = line.decode('utf-8').split()
+            if request[0] == "HELLO":
+                writer.write(b"HELLO 1\n")
+            elif request[0] == "WAIT":
+                request_id, file_name, remove = int(request[1]), request[2], request[3] == "remove"
+                if file_name in self.files:
+                    self.send_result(writer, request_id, self.files[file_name])
+                    if remove:
+                        del self.files[file_name]
+                else:
+                    self.waiters.setdefault(file_name, []).append((writer, request_id, remove))
+            elif request[0] == "COMMAND":
+                command = (await reader.readexactly(int(request[2]))).decode('utf-8')
+                extra = (await reader.readexactly(int(request[3]))).decode('utf-8')
+                self.commands.append((command, extra))
+                if command == "is_live":
+                    self.write_file(f"is_live_{extra}.txt", f"I'm alive {extra}")
+                if command == "stuck":
+                    self.stuck_requests.append(int(request[1]))
+                    continue
+                status = b"OK" if command in self.known_commands else b"FAILED"
+                writer.write(f"DONE {request[1]} {len(status)}\n".encode('utf-8') + status)
+            elif request[0] == "CANCEL":
+                if int(request[1]) in self.stuck_requests:
+                    self.stuck_requests.remove(int(request[1]))
+                    self.cancelled_requests.append(int(request[1]))
+                for file_name in list(self.waiters.keys()):
+                    self.waiters[file_name] = [waiter for waiter in self.waiters[file_name]
+                                               if waiter[0] is not writer or waiter[1] != int(request[1])]
+                    if len(self.waiters[file_name]) == 0:
+                        del self.waiters[file_name]
+
+
+class TestLatteChannel(unittest.TestCase):
+    def test_latte_channel(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            fake_latte = FakeLatte()
+            server.services["tcp:8712"] = fake_latte.handle_connection
+            channel = LatteChannel("fake-device", adb_port=server.port, device_port=8712)
+            try:
+                await channel.open()
+                self.assertTrue(channel.is_open())
+                # The file is written before the request
+                fake_latte.write_file("early.txt", "early")
+                self.assertEqual("early", await channel.wait_for_file("early.txt"))
+                self.assertNotIn("early.txt", fake_latte.files)
+                # The file is pushed once it's written
+                start_time = time.perf_counter()
+                task = asyncio.create_task(channel.wait_for_file("a11y_layout.xml", timeout=2))
+                await asyncio.sleep(0.05)
+                fake_latte.write_file("a11y_layout.xml", "<hierarchy text='ü'>\n</hierarchy>")
+                self.assertEqual("<hierarchy text='ü'>\n</hierarchy>", await task)
+                self.assertLess(time.perf_counter() - start_time, 1)
+                content, _ = await asyncio.gather(channel.wait_for_file("kept.txt", remove=False),
+                                                  self._write_later(fake_latte, "kept.txt", "kept"))
+                self.assertEqual("kept", content)
+                self.assertIn("kept.txt", fake_latte.files)
+                # The responses are matched by the request ids
+                tasks = [asyncio.create_task(channel.wait_for_file(f"{i}.txt", timeout=2)) for i in range(3)]
+                await asyncio.sleep(0.05)
+                for i in reversed(range(3)):
+                    fake_latte.write_file(f"{i}.txt", f"content {i}")
+                self.assertEqual([f"content {i}" for i in range(3)], await asyncio.gather(*tasks))
+                # The request is cancelled after the timeout, so the file is not removed later
+                self.assertIsNone(await channel.wait_for_file("late.txt", timeout=0.1))
+                await asyncio.sleep(0.05)
+                self.assertEqual({}, fake_latte.waiters)
+                fake_latte.write_file("late.txt", "late")
+                self.assertIn("late.txt", fake_latte.files)
+                # The files of Latte are read through the channel
+                latte_channel._latte_channels.setdefault(asyncio.get_running_loop(), {})["fake-device"] = channel
+                self.assertEqual("late", await read_local_android_file("late.txt", wait_time=1,
+                                                                       device_name="fake-device"))
+                # The waiting requests fail if Latte is stopped
+                task = asyncio.create_task(channel.wait_for_file("never.txt"))
+                await asyncio.sleep(0.05)
+                fake_latte.stop()
+                with self.assertRaises(LatteChannelClosedError):
+                    await task
+                self.assertFalse(channel.is_open())
+            finally:
+                await channel.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_latte_commands(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            fake_latte = FakeLatte()
+            server.services["tcp:8712"] = fake_latte.handle_connection
+            channel = LatteChannel("fake-device", adb_port=server.port, device_port=8712)
+            latte_channel._latte_channels.setdefault(asyncio.get_running_loop(), {})["fake-device"] = channel
+            try:
+                extra = '{"text": "a (b), \'c\'\nü"}'
+                self.assertTrue(await send_command_to_latte("controller_execute", extra, device_name="fake-device"))
+                self.assertEqual([("controller_execute", extra)], fake_latte.commands)
+                self.assertFalse(await send_command_to_latte("unknown", device_name="fake-device"))
+                fake_latte.commands.clear()
+                # The commands are sent at once and executed in order
+                self.assertTrue(await send_commands_sequence_to_latte([("controller_set", "touch"), "is_live"],
+                                                                      device_name="fake-device"))
+                self.assertFalse(await send_commands_sequence_to_latte(["is_live", "unknown"],
+                                                                       device_name="fake-device"))
+                self.assertEqual([("controller_set", "touch"), ("is_live", "NONE"), ("is_live", "NONE"),
+                                  ("unknown", "NONE")], fake_latte.commands)
+                self.assertEqual([], await channel.send_commands([]))
+                # The commands which are not answered in time are cancelled
+                self.assertEqual([True, False], await channel.send_commands([("is_live", "NONE"), ("stuck", "NONE")],
+                                                                            timeout=0.2))
+                self.assertTrue(await send_command_to_latte("controller_set", "touch", device_name="fake-device"))
+                self.assertEqual([], fake_latte.stuck_requests)
+                self.assertEqual(1, len(fake_latte.cancelled_requests))
+            finally:
+                await channel.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_latte_heartbeat(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            fake_latte = FakeLatte()
+            server.services["tcp:8712"] = fake_latte.handle_connection
+            channel = LatteChannel("fake-device", adb_port=server.port, device_port=8712)
+            latte_channel._latte_channels.setdefault(asyncio.get_running_loop(), {})["fake-device"] = channel
+            heartbeat = LatteHeartbeat("fake-device", interval=0.2)
+            try:
+                self.assertFalse(heartbeat.is_healthy())
+                self.assertTrue(await heartbeat.wait_until_live(timeout=1))
+                self.assertTrue(heartbeat.is_healthy())
+                # Latte is not probed when it's known to be live
+                probe_count = len(fake_latte.commands)
+                self.assertTrue(await heartbeat.wait_until_live(timeout=1))
+                self.assertEqual(probe_count, len(fake_latte.commands))
+                # Latte is not probed in the background, it's live while the channel is open
+                self.assertFalse(heartbeat.is_running())
+                await asyncio.sleep(0.3)
+                self.assertEqual(probe_count, len(fake_latte.commands))
+                self.assertTrue(heartbeat.is_healthy())
+                await channel.close()
+                self.assertFalse(heartbeat.is_healthy())
+                self.assertTrue(await heartbeat.wait_until_live(timeout=1))
+                self.assertEqual(probe_count + 1, len(fake_latte.commands))
+                fake_latte.known_commands = ()
+                heartbeat.invalidate()
+                self.assertFalse(heartbeat.is_healthy())
+                self.assertFalse(await heartbeat.wait_until_live(timeout=0.3))
+                fake_latte.known_commands = ("is_live",)
+                self.assertTrue(await heartbeat.wait_until_live(timeout=2))
+                self.assertFalse(heartbeat.is_running())
+            finally:
+                await heartbeat.stop()
+                await channel.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_encode_latte_message(self):
+        self.assertEqual("f__^o^__x__^c^__", _encode_latte_message("f(x)"))
+
+    def test_unavailable_channel(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            channel = LatteChannel("fake-device", adb_port=server.port, device_port=8712)
+            try:
+                with self.assertRaises(LatteChannelClosedError):
+                    await channel.open()
+                self.assertIsNotNone(channel.last_failure_time)
+                # The channel is not opened again right away even if Latte is started
+                server.services["tcp:8712"] = FakeLatte().handle_connection
+                with self.assertRaises(LatteChannelClosedError):
+                    await channel.open()
+                channel.last_failure_time = None
+                await channel.open()
+                self.assertTrue(channel.is_open())
+            finally:
+                await channel.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    @staticmethod
+    async def _write_later(fake_latte: FakeLatte, file_name: str, content: str):
+        await asyncio.sleep(0.05)
+        fake_latte.write_file(file_name, content)
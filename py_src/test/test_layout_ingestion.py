@@ -0,0 +1,72 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from GUI_utils import NodeTable
+from layout_ingestion import ingest_layouts, load_node_table, NODE_TABLE_VERSION
+from test.test_nodes_factory import create_factory, layout_str
+
+
+class TestLayoutIngestion(unittest.TestCase):
+    def test_ingest_layouts(self):
+        expected_nodes = create_factory().build()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            layout_items = []
+            for i in range(5):
+                layout_path = os.path.join(tmp_dir, f"{i}.xml")
+                with open(layout_path, "w") as f:
+                    f.write(layout_str.replace('text="OK"', f'text="OK {i}"'))
+                layout_items.append((i, layout_path, os.path.join(tmp_dir, f"{i}.bin")))
+            layout_items.append((5, os.path.join(tmp_dir, "missing.xml"), None))
+            progress = []
+            for processes in [2, 1]:
+                progress.clear()
+                results = {result.key: result for result in
+                           ingest_layouts(layout_items,
+                                          processes=processes,
+                                          progress_callback=lambda completed, total, _:
+                                          progress.append((completed, total)))}
+                self.assertEqual([(i, 6) for i in range(1, 7)], progress)
+                self.assertFalse(results[5].is_successful())
+                for i in range(5):
+                    node_table = results[i].node_table
+                    self.assertEqual(len(expected_nodes), len(node_table))
+                    self.assertEqual(f"OK {i}", node_table.node(3).text)
+                    self.assertEqual(expected_nodes[4].xpath, node_table.node(4).xpath)
+                    self.assertTrue(node_table.node(6).is_ad)
+                    self.assertIsNone(node_table.node(6).xml_element)
+                # The tables are stored by the first ingestion
+                self.assertIsNotNone(NodeTable.createTableFromFile(layout_items[0][2]))
+            # Stopping the iteration does not wait for the remaining layouts
+            for result in ingest_layouts(layout_items, processes=2, chunk_size=1):
+                self.assertIsNotNone(result)
+                break
+
+    def test_pickle_node_table(self):
+        node_table = NodeTable.createTableFromNodes(create_factory().build())
+        node_table.metadata = {'source': 'test'}
+        self.assertIsNotNone(node_table.node(2).xml_element)
+        unpickled_table = pickle.loads(pickle.dumps(node_table))
+        self.assertEqual({'source': 'test'}, unpickled_table.metadata)
+        self.assertEqual([node.toJSONStr() for node in node_table.to_nodes()],
+                         [node.toJSONStr() for node in unpickled_table.to_nodes()])
+        self.assertIsNone(unpickled_table.node(2).xml_element)
+        self.assertEqual(1, len(unpickled_table.nodes(unpickled_table.string_equals('text', 'Dialog'))))
+
+    def test_stale_node_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            layout_path = os.path.join(tmp_dir, "layout.xml")
+            cache_path = os.path.join(tmp_dir, "layout.bin")
+            with open(layout_path, "w") as f:
+                f.write(layout_str)
+            node_table = load_node_table(layout_path, cache_path)
+            self.assertEqual(NODE_TABLE_VERSION, node_table.metadata['version'])
+            # A stored table of another version is not loaded, even if the layout is the same
+            node_table.metadata = {key: value for key, value in node_table.metadata.items() if key != 'version'}
+            node_table.string_columns['text'] = node_table.string_columns['text'].copy()
+            node_table.string_columns['text'][3] = node_table.string_columns['text'][0]
+            node_table.write_to_file(cache_path)
+            self.assertNotIn('version', NodeTable.createTableFromFile(cache_path).metadata)
+            self.assertEqual("OK", load_node_table(layout_path, cache_path).node(3).text)
+            self.assertEqual(NODE_TABLE_VERSION, NodeTable.createTableFromFile(cache_path).metadata['version'])
@@ -1,6 +1,11 @@
+import copy
+import pickle
 import unittest
 
+from lxml import etree
+
 from GUI_utils import Node
+from json_util import JSONSerializable, json_loads
 import json
 
 node1_json_str = '{"a11y_actions": ["4", "8", "64", "16908342"], "action": "click", "bounds": [540, 214, 540, 281], "checkable": false, "checked": false, "class_name": "android.widget.TextView", "clickable": false, "clickable_span": false, "content_desc": "my_content", "context_clickable": false, "covered": false, "drawing_order": 1, "enabled": true, "focusable": false, "focused": false, "important_for_accessibility": true, "index": 0, "invalid": false, "is_ad": false, "located_by": "xpath", "long_clickable": false, "naf": false, "pkg_name": "au.gov.nsw.newcastle.app.android", "resource_id": "my_res", "skip": false, "text": "my_text", "visible": false, "xpath": "/android.widget.FrameLayout/android.widget.LinearLayout/android.widget.FrameLayout/android.widget.LinearLayout/android.widget.FrameLayout/android.widget.FrameLayout/android.widget.FrameLayout/android.view.ViewGroup/android.widget.LinearLayout/android.widget.FrameLayout/android.widget.TextView"}'
@@ -76,3 +81,85 @@ class TestNode(unittest.TestCase):
         normalized_bounds = node2.get_normalized_bounds((0, 10, 500, 410))
         self.assertEqual((10/500, 10/400, 110/500, 210/400), normalized_bounds)
 
+
+    def test_lazy_attributes(self):
+        element = etree.fromstring('<node index="2" text="null" class="c1" bounds=" [0,0][10,20] " '
+                                   'clickable="true" actionList="16-32" />')
+        node = Node.createNodeFromXmlElement(element)
+        self.assertIs(element, node._raw_attributes)
+        self.assertEqual("c1", node.class_name)
+        self.assertIsNone(node._raw_attributes)
+        self.assertEqual(2, node.index)
+        self.assertEqual("", node.text)
+        self.assertEqual((0, 0, 10, 20), node.bounds)
+        self.assertTrue(node.clickable)
+        self.assertListEqual([16, 32], node.a11y_actions)
+        self.assertIs(element, node.xml_element)
+        self.assertFalse(hasattr(node, '__dict__'))
+        with self.assertRaises(AttributeError):
+            node.unknown_attribute = 1
+        # Changing an attribute before decoding should not affect the others
+        node2 = Node.createNodeFromXmlElement(element)
+        node2.xpath = "/a/b"
+        self.assertEqual("/a/b", node2.xpath)
+        self.assertEqual("c1", node2.class_name)
+        self.assertEqual(Node.createNodeFromDict(json.loads(node1_json_str)).toJSONStr(),
+                         Node.createNodeFromDict(json.loads(node1_json_str)).toJSONStr())
+
+    def test_fingerprint(self):
+        node1 = Node.createNodeFromDict(json.loads(node1_json_str))
+        node2 = Node.createNodeFromDict(json.loads(node1_json_str))
+        self.assertEqual(node1.fingerprint(), node2.fingerprint())
+        excluded_attrs = ['text']
+        self.assertTrue(node1.practically_equal(node2, excluded_attrs=excluded_attrs))
+        self.assertListEqual(['text'], excluded_attrs)
+        node2.text = "something else"
+        self.assertNotEqual(node1.fingerprint(), node2.fingerprint())
+        self.assertEqual(node1.fingerprint(['text']), node2.fingerprint(['text']))
+        self.assertFalse(node1.practically_equal(node2))
+        self.assertTrue(node1.practically_equal(node2, excluded_attrs=excluded_attrs))
+
+    def test_serialization(self):
+        node = Node.createNodeFromDict(json.loads(node1_json_str))
+        # The output is the same as the files written by the previous versions
+        self.assertEqual(node1_json_str.replace('["4", "8", "64", "16908342"]', '[4, 8, 64, 16908342]'),
+                         node.toJSONStr())
+        self.assertEqual(json.loads(node.toJSONStr()), node.toJSON())
+        self.assertEqual(list(json.loads(node.toJSONStr()).keys()), list(node.toJSON().keys()))
+        self.assertNotIn('text', node.toJSON(['text']))
+        self.assertEqual(json.loads(node1_json_str), json_loads(node1_json_str))
+
+        class Holder(JSONSerializable):
+            def __init__(self):
+                self.node = node
+                self.pairs = {2: (1, 2), 1: [Node(text="a")]}
+                self.value = 1.5
+
+        holder = Holder()
+        self.assertEqual(json.loads(holder.toJSONStr()), holder.toJSON())
+        self.assertEqual(node.toJSON(), holder.toJSON()['node'])
+        self.assertEqual([1, 2], holder.toJSON()['pairs']['2'])
+
+    def test_is_none(self):
+        self.assertTrue(Node.createNodeFromDict({"bounds": [0, 0, 0, 0], "a11y_actions": []}).is_none())
+        self.assertFalse(Node.createNodeFromDict({"text": "a"}).is_none())
+        self.assertFalse(Node.createNodeFromDict({"index": 0}).is_none())
+        self.assertFalse(Node.createNodeFromDict(json.loads(node1_json_str)).is_none())
+
+    def test_copy_and_pickle(self):
+        node = Node.createNodeFromDict(json.loads(node1_json_str))
+        element = etree.fromstring('<node text="lazy" bounds="[0,0][10,20]" />')
+        lazy_node = Node.createNodeFromXmlElement(element)
+        for original_node in [node, lazy_node]:
+            fingerprint = original_node.fingerprint()
+            copied_node = copy.copy(original_node)
+            self.assertEqual(original_node.toJSONStr(), copied_node.toJSONStr())
+            self.assertIs(original_node.xml_element, copied_node.xml_element)
+            copied_node.text = "changed"
+            self.assertNotEqual(fingerprint, copied_node.fingerprint())
+            self.assertEqual(fingerprint, original_node.fingerprint())
+            for restored_node in [pickle.loads(pickle.dumps(original_node)), copy.deepcopy(original_node)]:
+                self.assertEqual(original_node.toJSONStr(), restored_node.toJSONStr())
+                self.assertEqual(fingerprint, restored_node.fingerprint())
+                self.assertIsNone(restored_node.xml_element)
+        self.assertEqual("lazy", copy.copy(lazy_node).text)
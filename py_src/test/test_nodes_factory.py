@@ -0,0 +1,419 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from GUI_utils import Node, NodesFactory, NodeTable, SpatialIndex, XPathIndex, get_element_from_xpath, \
+    max_subsequence_substring, bounds_included, calculate_occlusion, calculate_overlap, \
+    is_in_same_state_with_nodes, get_state_fingerprint, is_in_same_state_layout, LayoutSignature, \
+    SNAPSHOT_STATE_EXCLUDED_ATTRIBUTES, LayoutCache, NodesPass, diff_layouts
+from search_utils import contains_node_with_attrs, contains_table_node_with_attrs
+
+layout_str = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>
+<hierarchy rotation="0">
+  <node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="com.example" content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,0][1080,1920]" drawingOrder="0" importantForAccessibility="true" actionList="">
+    <node index="0" text="" resource-id="com.example:id/content" class="android.widget.LinearLayout" package="com.example" content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,0][1080,1920]" drawingOrder="1" importantForAccessibility="true" actionList="">
+      <node index="0" text="Title" resource-id="com.example:id/title" class="android.widget.TextView" package="com.example" content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,0][1080,200]" drawingOrder="1" importantForAccessibility="true" actionList="" />
+      <node index="1" text="OK" resource-id="com.example:id/ok" class="android.widget.Button" package="com.example" content-desc="" checkable="false" checked="false" clickable="true" enabled="true" focusable="true" focused="false" long-clickable="false" visible="true" bounds="[0,200][540,400]" drawingOrder="2" importantForAccessibility="true" actionList="16" />
+      <node index="2" text="Cancel" resource-id="com.example:id/cancel" class="android.widget.Button" package="com.example" content-desc="" checkable="false" checked="false" clickable="true" enabled="true" focusable="true" focused="false" long-clickable="false" visible="true" bounds="[540,200][1080,400]" drawingOrder="3" importantForAccessibility="true" actionList="16" />
+      <node index="3" text="" resource-id="com.example:id/banner_ad" class="android.widget.FrameLayout" package="com.example" content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,1700][1080,1920]" drawingOrder="4" importantForAccessibility="true" actionList="">
+        <node index="0" text="Test Ad" resource-id="" class="android.widget.TextView" package="com.example" content-desc="" checkable="false" checked="false" clickable="true" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,1700][1080,1920]" drawingOrder="1" importantForAccessibility="true" actionList="16" />
+      </node>
+    </node>
+    <node index="1" text="" resource-id="com.example:id/dialog" class="android.widget.FrameLayout" package="com.example" content-desc="" checkable="false" checked="false" clickable="true" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,0][1080,1000]" drawingOrder="2" importantForAccessibility="true" actionList="16">
+      <node index="0" text="Dialog" resource-id="com.example:id/message" class="android.widget.TextView" package="com.example" content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="false" focused="false" long-clickable="false" visible="true" bounds="[0,0][1080,500]" drawingOrder="1" importantForAccessibility="true" actionList="" />
+    </node>
+  </node>
+</hierarchy>
+"""
+
+
+def create_factory() -> NodesFactory:
+    return NodesFactory() \
+        .with_layout(layout_str) \
+        .with_xpath_pass() \
+        .with_ad_detection() \
+        .with_covered_pass()
+
+
+class TestNodesFactory(unittest.TestCase):
+    def test_build(self):
+        nodes = create_factory().build()
+        self.assertEqual(9, len(nodes))
+        self.assertEqual("/android.widget.FrameLayout/android.widget.LinearLayout/android.widget.Button[2]",
+                         nodes[4].xpath)
+        self.assertTrue(nodes[5].is_ad)
+        self.assertTrue(nodes[6].is_ad)
+        # The title and the buttons are drawn before the dialog
+        self.assertTrue(nodes[2].covered)
+        self.assertTrue(nodes[4].covered)
+        self.assertFalse(nodes[5].covered)
+        self.assertFalse(nodes[8].covered)
+
+    def test_streaming_build(self):
+        nodes = create_factory().build()
+        streamed_nodes = create_factory().with_streaming().build()
+        self.assertEqual([node.toJSONStr() for node in nodes], [node.toJSONStr() for node in streamed_nodes])
+        for node, streamed_node in zip(nodes, streamed_nodes):
+            self.assertEqual(len(node.children_nodes), len(streamed_node.children_nodes))
+            self.assertIsNotNone(streamed_node.xml_element)
+        self.assertIsNone(streamed_nodes[0].parent_node.parent_node)
+
+    def test_streaming_release_xml_elements(self):
+        nodes = create_factory().build()
+        released_nodes = create_factory().with_streaming(release_xml_elements=True).build()
+        self.assertEqual([node.toJSONStr() for node in nodes], [node.toJSONStr() for node in released_nodes])
+        self.assertTrue(all(node.xml_element is None for node in released_nodes))
+        # The visible descendants are counted while parsing, the same as querying the XML element
+        self.assertEqual([len(node.xml_element.findall('.//node[@visible="true"]')) for node in nodes],
+                         [node.visible_descendant_count for node in released_nodes])
+
+    def test_invalid_layout(self):
+        self.assertListEqual([], NodesFactory().with_layout("PROBLEM_WITH_XML 0.1").build())
+        self.assertListEqual([], NodesFactory().with_layout("PROBLEM_WITH_XML 0.1").with_streaming().build())
+
+    def test_node_table(self):
+        nodes = create_factory().build()
+        node_table = NodeTable.createTableFromNodes(nodes)
+        self.assertEqual(len(nodes), len(node_table))
+        self.assertListEqual([node.clickable for node in nodes], list(node_table.flag('clickable')))
+        self.assertListEqual([node.covered for node in nodes], list(node_table.flag('covered')))
+        self.assertListEqual([node.xpath for node in nodes], node_table.string_values('xpath'))
+        self.assertListEqual([16 in node.a11y_actions for node in nodes], list(node_table.has_action(16)))
+        self.assertEqual(1, node_table.parent[2])
+        self.assertIs(nodes[3], node_table.node(3))
+        self.assertListEqual([nodes[3], nodes[4]], node_table.nodes(node_table.string_equals('class_name',
+                                                                                             'android.widget.Button')))
+
+    def test_node_table_area(self):
+        nodes = [Node(bounds="[-100000,-100000][100000,100000]"), Node(bounds="[0,0][1080,1920]")]
+        self.assertListEqual([node.area() for node in nodes], list(NodeTable.createTableFromNodes(nodes).area()))
+
+    def test_node_table_views(self):
+        nodes = create_factory().build()
+        node_table = NodeTable.createTableFromNodes(nodes)
+        detached_table = NodeTable(bounds=node_table.bounds,
+                                   flags=node_table.flags,
+                                   drawing_order=node_table.drawing_order,
+                                   index=node_table.index,
+                                   parent=node_table.parent,
+                                   visible_descendant_count=node_table.visible_descendant_count,
+                                   string_columns=node_table.string_columns,
+                                   strings=node_table.strings,
+                                   actions_offsets=node_table.actions_offsets,
+                                   actions_values=node_table.actions_values)
+        table_nodes = detached_table.to_nodes()
+        self.assertListEqual([node.toJSONStr() for node in nodes], [node.toJSONStr() for node in table_nodes])
+        self.assertIs(table_nodes[1], table_nodes[2].parent_node)
+        self.assertEqual(4, len(table_nodes[1].children_nodes))
+        # The nodes of the table have no XML element, their visible descendants are counted by the table
+        self.assertListEqual([len(node.xml_element.findall('.//node[@visible="true"]')) for node in nodes],
+                             [node.visible_descendant_count for node in table_nodes])
+        self.assertListEqual([node.is_practically_invisible() for node in nodes],
+                             [node.is_practically_invisible() for node in table_nodes])
+
+    def test_table_search(self):
+        nodes = create_factory().build()
+        node_table = NodeTable.createTableFromNodes(nodes)
+        queries = [(['text', 'clickable'], ['ok', 'true']),
+                   (['text', 'clickable'], ['"title"', 'true']),
+                   (['class_name', 'area'], ['button', '>100000']),
+                   (['class_name', 'area'], ['button', '>200000']),
+                   (['resource_id', 'ALL'], ['!dialog', 'Test Ad'])]
+        for attrs, attr_queries in queries:
+            self.assertEqual(contains_node_with_attrs(nodes, attrs, attr_queries),
+                             contains_table_node_with_attrs(node_table, attrs, attr_queries))
+
+    def test_calculate_occlusion(self):
+        rnd = random.Random(0)
+
+        def random_bounds():
+            x0, y0 = rnd.randint(0, 1000), rnd.randint(0, 1000)
+            return x0, y0, rnd.randint(x0, 1080), rnd.randint(y0, 1920)
+
+        for covered_count, children_count in [(0, 5), (3, 10), (0, 300), (40, 200)]:
+            covered_bounds = [random_bounds() for _ in range(covered_count)]
+            children_bounds = [random_bounds() for _ in range(children_count)]
+            covered, overlaps = calculate_occlusion(covered_bounds, children_bounds)
+            # Only the boxes of the children which are not covered are drawn
+            drawn_bounds = list(covered_bounds)
+            for child_bounds, child_covered, child_overlaps in zip(children_bounds, covered, overlaps):
+                expected_covered = any(bounds_included(bounds, child_bounds) for bounds in drawn_bounds)
+                self.assertEqual(expected_covered, child_covered)
+                if not child_covered:
+                    drawn_bounds.append(child_bounds)
+                    expected_overlaps = {calculate_overlap(bounds, child_bounds) for bounds in drawn_bounds[:-1]}
+                    expected_overlaps.discard(None)
+                    # The boxes of the covered prior children are included in the other overlaps
+                    child_overlaps = {tuple(int(x) for x in bounds) for bounds in child_overlaps}
+                    self.assertTrue(expected_overlaps.issubset(child_overlaps))
+                    for bounds in child_overlaps - expected_overlaps:
+                        self.assertTrue(any(bounds_included(expected_bounds, bounds)
+                                            for expected_bounds in expected_overlaps))
+
+    def test_spatial_index(self):
+        nodes = create_factory().build()
+        spatial_index = SpatialIndex.createIndexFromNodes(nodes)
+        self.assertListEqual([0, 1, 3, 7, 8], list(spatial_index.containing_point(100, 300)))
+        self.assertListEqual([2, 3, 4, 8], list(spatial_index.inside((0, 0, 1080, 500))))
+        self.assertListEqual([0, 1, 2, 7, 8], list(spatial_index.intersecting((0, 100, 1080, 200))))
+        rnd = random.Random(0)
+
+        def random_bounds():
+            x0, y0 = rnd.randint(0, 1000), rnd.randint(0, 1000)
+            return x0, y0, rnd.randint(x0, 1080), rnd.randint(y0, 1920)
+
+        bounds_list = [random_bounds() for _ in range(1000)]
+        spatial_index = SpatialIndex(bounds_list, fan_out=8)
+        for _ in range(20):
+            query = random_bounds()
+            self.assertListEqual([i for i, bounds in enumerate(bounds_list) if bounds_included(bounds, query)],
+                                 list(spatial_index.containing(query)))
+            self.assertListEqual([i for i, bounds in enumerate(bounds_list) if bounds_included(query, bounds)],
+                                 list(spatial_index.inside(query)))
+            self.assertListEqual([i for i, bounds in enumerate(bounds_list) if calculate_overlap(query, bounds)],
+                                 list(spatial_index.intersecting(query)))
+
+    def test_same_state(self):
+        nodes1 = create_factory().build()
+        nodes2 = create_factory().build()
+        self.assertEqual(get_state_fingerprint(nodes1), get_state_fingerprint(nodes2))
+        self.assertTrue(is_in_same_state_with_nodes(nodes1, nodes2))
+        # Ads and volatile attributes are ignored
+        nodes2[6].text = "Another Ad"
+        nodes2[3].focused = True
+        self.assertTrue(is_in_same_state_with_nodes(nodes1, nodes2))
+        nodes2[3].text = "Yes"
+        self.assertFalse(is_in_same_state_with_nodes(nodes1, nodes2))
+        self.assertTrue(is_in_same_state_with_nodes(nodes1, nodes2, extra_excluded_attributes=['text']))
+        self.assertFalse(is_in_same_state_with_nodes(nodes1, nodes2[:-1], extra_excluded_attributes=['text']))
+        self.assertIsNone(get_state_fingerprint(nodes1, package_name="com.another"))
+        self.assertFalse(is_in_same_state_with_nodes(nodes1, nodes1, package_name="com.another"))
+
+    def test_layout_signature(self):
+        nodes = NodesFactory().with_layout(layout_str).with_xpath_pass().with_ad_detection().build()
+        signature = LayoutSignature.createSignatureFromLayout(layout_str)
+        self.assertEqual(get_state_fingerprint(nodes), signature.get_state_fingerprint('layout'))
+        self.assertEqual(get_state_fingerprint(nodes, extra_excluded_attributes=SNAPSHOT_STATE_EXCLUDED_ATTRIBUTES,
+                                               package_name="com.example"),
+                         signature.get_state_fingerprint('state', package_name="com.example"))
+        self.assertIsNone(signature.get_state_fingerprint('state', package_name="com.another"))
+        loaded_signature = LayoutSignature.createSignatureFromDict(json.loads(json.dumps(signature.toJSON())))
+        self.assertTrue(signature.is_in_same_state(loaded_signature))
+        self.assertIsNone(LayoutSignature.createSignatureFromDict({**signature.toJSON(), 'version': 0}))
+        other_layout = layout_str.replace('text="OK"', 'text="Yes"')
+        other_signature = LayoutSignature.createSignatureFromLayout(other_layout)
+        self.assertEqual(is_in_same_state_layout(layout_str, other_layout), signature.is_in_same_state(other_signature))
+        self.assertFalse(signature.is_in_same_state(other_signature))
+        self.assertTrue(signature.is_in_same_state(other_signature, profile='state'))
+
+    def test_layout_cache(self):
+        layout_cache = LayoutCache(max_nodes=20)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            layout_path = os.path.join(tmp_dir, "layout.xml")
+            with open(layout_path, "w") as f:
+                f.write(layout_str)
+
+            def build_cached(streaming: bool = False):
+                factory = NodesFactory().with_layout_path(layout_path, layout_cache=layout_cache).with_xpath_pass()
+                if streaming:
+                    factory.with_streaming()
+                return factory.with_ad_detection().build()
+
+            nodes = build_cached()
+            self.assertEqual([node.toJSONStr() for node in NodesFactory().with_layout(layout_str).with_xpath_pass()
+                             .with_ad_detection().build()], [node.toJSONStr() for node in nodes])
+            self.assertIs(nodes[0], build_cached()[0])
+            self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'nodes': 9},
+                             {k: v for k, v in layout_cache.stats().items() if k != 'max_nodes'})
+            # Different passes or options are cached separately, and the least recently used entry is evicted
+            streamed_nodes = build_cached(streaming=True)
+            self.assertIsNot(nodes[0], streamed_nodes[0])
+            self.assertEqual(9, len(NodesFactory().with_layout_path(layout_path, layout_cache=layout_cache).build()))
+            self.assertEqual(1, layout_cache.stats()['evictions'])
+            self.assertIs(streamed_nodes[0], build_cached(streaming=True)[0])
+            # A modified layout is parsed again
+            with open(layout_path, "w") as f:
+                f.write(layout_str.replace('text="OK"', 'text="Yes"'))
+            os.utime(layout_path, ns=(0, 0))
+            self.assertEqual("Yes", build_cached(streaming=True)[3].text)
+
+    def test_subtree_aggregation(self):
+        nodes = NodesFactory().with_layout(layout_str).with_subtree_aggregation().build()
+        self.assertEqual([8, 5, 0, 0, 0, 1, 0, 1, 0], [node.visible_descendant_count for node in nodes])
+        self.assertEqual([True, True, False, False, False, True, False, False, False],
+                         [node.has_clickable_descendant for node in nodes])
+        self.assertTrue(nodes[7].has_text_descendant)
+        self.assertFalse(nodes[2].has_text_descendant)
+        self.assertNotIn('visible_descendant_count', nodes[0].toJSON())
+        # The practically invisible nodes are the same with and without the aggregates
+        invisible_layout = layout_str.replace('visible="true" bounds="[0,0][1080,500]"',
+                                              'visible="false" bounds="[0,0][1080,500]"')
+        for streaming in [False, True]:
+            plain_factory = NodesFactory().with_layout(invisible_layout)
+            aggregated_factory = NodesFactory().with_layout(invisible_layout).with_subtree_aggregation()
+            if streaming:
+                plain_factory.with_streaming()
+                aggregated_factory.with_streaming()
+            expected = [node.is_practically_invisible() for node in plain_factory.build()]
+            self.assertEqual(expected, [node.is_practically_invisible() for node in aggregated_factory.build()])
+            self.assertTrue(expected[7])
+
+    def test_pass_framework(self):
+        depths = {}
+
+        def compute_depth(node, extra, children_nodes, child_to_extras_map):
+            for child_node in children_nodes:
+                child_to_extras_map[child_node]['depth'] = extra.get('depth', 0) + 1
+            depths[node.xpath] = extra.get('depth', 0)
+
+        factory = create_factory().with_pass_timing()
+        # The depth pass reads the xpaths of the visiting node, which are written by the xpath pass
+        factory.with_pass(NodesPass(name="compute_depth", function=compute_depth, reads=['xpath'], writes=[]))
+        self.assertEqual([['create_xpath', 'detect_ad', 'aggregate_subtree'], ['calculate_covered', 'compute_depth']],
+                         [[t_pass.name for t_pass in traversal] for traversal in factory._plan_traversals()])
+        nodes = factory.build()
+        self.assertEqual([node.toJSONStr() for node in create_factory().build()], [node.toJSONStr() for node in nodes])
+        self.assertEqual(3, depths[nodes[4].xpath])
+        self.assertEqual({'create_xpath', 'detect_ad', 'aggregate_subtree', 'calculate_covered', 'compute_depth'},
+                         set(factory.pass_timings.keys()))
+        # With a plain function, all passes are applied in one traversal
+        factory = NodesFactory().with_layout(layout_str).with_xpath_pass()
+        factory.passes.append(compute_depth)
+        self.assertEqual([['create_xpath', 'compute_depth']],
+                         [[t_pass.name for t_pass in traversal] for traversal in factory._plan_traversals()])
+        depths.clear()
+        self.assertEqual(3, depths[factory.build()[4].xpath])
+        # A plain function added before the ad detection sees the ads written by the detection of the parent
+        visited_ads = {}
+
+        def collect_ads(node, extra, children_nodes, child_to_extras_map):
+            visited_ads[node.xpath] = node.is_ad
+
+        factory = NodesFactory().with_layout(layout_str).with_xpath_pass()
+        factory.passes.append(collect_ads)
+        factory.with_ad_detection().with_covered_pass()
+        self.assertEqual(1, len(factory._plan_traversals()))
+        nodes = factory.build()
+        self.assertEqual([node.toJSONStr() for node in create_factory().build()], [node.toJSONStr() for node in nodes])
+        self.assertFalse(visited_ads[nodes[5].xpath])
+        self.assertTrue(visited_ads[nodes[6].xpath])
+        # A post-order pass writing what a prior post-order pass reads is not fused
+        aggregate_pass = NodesFactory().with_subtree_aggregation().passes[0]
+        self.assertFalse(NodesPass(name="clear", function=lambda node, children_nodes: None,
+                                   order=NodesPass.POST_ORDER, reads=[], writes=['text'])
+                         .can_be_fused_after([aggregate_pass]))
+
+    def test_layout_diff(self):
+        self.assertTrue(diff_layouts(layout_str, layout_str).is_empty())
+        new_node = '<node index="0" text="New" class="android.widget.TextView" package="com.example" ' \
+                   'visible="true" bounds="[0,0][10,10]" />'
+        other_layout = "\n".join(line for line in layout_str.split("\n") if 'text="Dialog"' not in line) \
+            .replace('text="OK"', 'text="Yes"') \
+            .replace('<node index="0" text="Title"', new_node + '<node index="0" text="Title"')
+        layout_diff = diff_layouts(layout_str, other_layout)
+        self.assertIs(layout_diff, diff_layouts(layout_str, other_layout))
+        self.assertEqual({'added': 1, 'removed': 1, 'modified': 2}, layout_diff.summary())
+        self.assertEqual("New", layout_diff.added[0].text)
+        self.assertEqual("Dialog", layout_diff.removed[0].text)
+        # The title is matched even though its xpath is changed
+        title_deltas = [deltas for node1, _, deltas in layout_diff.modified if node1.text == "Title"][0]
+        self.assertEqual(['xpath'], list(title_deltas.keys()))
+        ok_deltas = [deltas for node1, _, deltas in layout_diff.modified if node1.text == "OK"][0]
+        self.assertEqual({'text': ("OK", "Yes")}, ok_deltas)
+        self.assertEqual(layout_diff.summary(), {name: len(value) for name, value in layout_diff.toJSON().items()})
+
+    def test_xpath_index(self):
+        nodes = create_factory().build()
+        xpath_index = XPathIndex.createIndexFromNodes(nodes)
+        for i, node in enumerate(nodes):
+            self.assertEqual([i], xpath_index.find(node.xpath))
+            ancestors = [nodes[index] for index in xpath_index.ancestors(node.xpath)]
+            expected_ancestors = []
+            parent_node = node.parent_node
+            while parent_node.parent_node is not None:
+                expected_ancestors.append(parent_node)
+                parent_node = parent_node.parent_node
+            self.assertEqual(expected_ancestors, ancestors)
+            self.assertEqual([index for index, other in enumerate(nodes) if other in ancestors or other is node],
+                             sorted(xpath_index.ancestors(node.xpath, include_self=True)))
+        self.assertEqual(list(range(2, 7)), xpath_index.descendants(nodes[1].xpath))
+        # The xpath of the query does not need to be indexed
+        self.assertEqual([8, 7, 0], xpath_index.ancestors(nodes[8].xpath + "/android.view.View"))
+        self.assertEqual([], xpath_index.find("/android.widget.FrameLayout/android.widget.Button"))
+        # A descendant of Button[1] is not Button[12]
+        sparse_index = XPathIndex(["/A/B[12]/C", "/A/B[1]/D/E", "/A/B[1]/C[2]/F", "/A/B[1]/C[1]"])
+        self.assertEqual([1, 2, 3], sparse_index.descendants("/A/B[1]"))
+        self.assertEqual(3, sparse_index.closest_descendant("/A/B[1]"))
+        self.assertEqual(1, sparse_index.closest_descendant("/A/B[1]/D"))
+        self.assertIsNone(sparse_index.closest_descendant("/A/B[2]"))
+        self.assertEqual([3], sparse_index.ancestors("/A/B[1]/C[1]/G/H"))
+
+    def test_xpath_index_starting_with(self):
+        xpaths = ["/A/B[12]/C", "/A/B[1]/D/E", "/A/B[1]/C[2]/F", "/A/B[1]/C[1]", "/A/android.view.ViewGroup",
+                  "/A/android.view.View/E", "/A/android.view.View", "/A/B[1]/C[1]", "/X/A/B[1]"]
+        xpath_index = XPathIndex(xpaths)
+        for prefix in ["/A/B[1]", "/A/B[1]/C", "/A/android.view.View", "/A", "/X", "/A/B[2]", ""]:
+            # The same results as scanning the xpaths with startswith
+            expected = sorted((xpath, index) for index, xpath in enumerate(xpaths) if xpath.startswith(prefix))
+            self.assertEqual([index for _, index in expected], xpath_index.starting_with(prefix))
+            closest = min((xpath for xpath in xpaths if xpath.startswith(prefix)), default=None)
+            indices = xpath_index.starting_with(prefix)
+            self.assertEqual(closest, xpaths[indices[0]] if indices else None)
+        self.assertEqual([3, 7], xpath_index.starting_with("/A/B[1]/C[1]"))
+        self.assertEqual([], XPathIndex([]).starting_with("/A"))
+
+    def test_element_from_xpath(self):
+        for node in create_factory().build():
+            element = get_element_from_xpath(layout_str, node.xpath)
+            self.assertIsNotNone(element)
+            self.assertEqual(dict(node.xml_element.attrib), dict(element.attrib))
+        self.assertIsNone(get_element_from_xpath(layout_str, "/android.widget.FrameLayout/android.widget.Button"))
+        self.assertIsNone(get_element_from_xpath(layout_str, "/android.widget.FrameLayout[1]"))
+        self.assertIsNone(get_element_from_xpath(layout_str, ""))
+
+    def test_max_subsequence_substring(self):
+        def dp_max_subsequence_substring(string_1: str, string_2: str) -> int:
+            dp = [[0] * (len(string_1) + 1) for _ in range(len(string_2) + 1)]
+            for i in range(1, len(string_2) + 1):
+                for j in range(1, len(string_1) + 1):
+                    dp[i][j] = 1 + dp[i - 1][j - 1] if string_1[j - 1] == string_2[i - 1] else dp[i][j - 1]
+            return max([row[len(string_1)] for row in dp])
+
+        self.assertEqual(3, max_subsequence_substring("/A[1]/B", "/A[2]/B"))
+        self.assertEqual(0, max_subsequence_substring("", "/A"))
+        rnd = random.Random(0)
+        for _ in range(200):
+            string_1 = "".join(rnd.choice("/A[12]") for _ in range(rnd.randint(0, 20)))
+            string_2 = "".join(rnd.choice("/A[12]") for _ in range(rnd.randint(0, 20)))
+            self.assertEqual(dp_max_subsequence_substring(string_1, string_2),
+                             max_subsequence_substring(string_1, string_2))
+
+    def test_node_table_file(self):
+        nodes = create_factory().build()
+        node_table = NodeTable.createTableFromNodes(nodes)
+        node_table.metadata = {'source': 'test'}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            table_path = os.path.join(tmp_dir, "node_table.bin")
+            node_table.write_to_file(table_path)
+            loaded_table = NodeTable.createTableFromFile(table_path)
+            self.assertEqual({'source': 'test'}, loaded_table.metadata)
+            self.assertEqual(node_table.strings, loaded_table.strings)
+            loaded_nodes = loaded_table.to_nodes()
+            self.assertEqual([node.toJSONStr() for node in nodes], [node.toJSONStr() for node in loaded_nodes])
+            self.assertEqual([len(node.children_nodes) for node in nodes],
+                             [len(node.children_nodes) for node in loaded_nodes])
+            self.assertEqual(nodes[4].xpath, loaded_table.nodes(loaded_table.has_action(16) &
+                                                                loaded_table.flag('covered'))[-1].xpath)
+            # Another version or a corrupted file is not loaded
+            with open(table_path, "r+b") as f:
+                f.seek(4)
+                f.write(bytes([NodeTable.FILE_VERSION + 1]))
+            self.assertIsNone(NodeTable.createTableFromFile(table_path))
+            with open(table_path, "wb") as f:
+                f.write(b"AX")
+            self.assertIsNone(NodeTable.createTableFromFile(table_path))
+            self.assertIsNone(NodeTable.createTableFromFile(os.path.join(tmp_dir, "missing.bin")))
+            NodeTable.createTableFromNodes([]).write_to_file(table_path)
+            self.assertEqual(0, len(NodeTable.createTableFromFile(table_path)))
@@ -0,0 +1,122 @@
+import asyncio
+import unittest
+
+from ppadb.client_async import ClientAsync
+from ppadb.device_async import DeviceAsync
+
+from consts import BLIND_MONKEY_TAG, BLIND_MONKEY_EVENTS_TAG, TB_TREELIST_TAG
+from padb_utils import LogcatRecord, ParallelADBLogger, get_logcat_reader
+from test.test_adb_transport import FakeADBServer
+
+
+class FakeLogcat:
+    """
+    A local stand-in of the logcat of the device, the lines written by `log` or `write_log` are streamed to the
+    `logcat` connections
+    """
+
+    def __init__(self, server: FakeADBServer):
+        self.writers = []
+        self.line_count = 0
+        server.services["shell:logcat -v threadtime -T 1"] = self.handle_logcat
+        server.shell_command_handler = self.handle_shell_command
+
+    def write_log(self, tag: str, message: str):
+        self.line_count += 1
+        line = f"05-12 14:02:03.{self.line_count:03d}  1234  1250 I {tag}: {message}\r\n"
+        for writer in self.writers:
+            writer.write(line.encode('utf-8'))
+
+    async def handle_logcat(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.append(writer)
+        writer.write(b"--------- beginning of main\n")
+        await reader.read()
+
+    async def handle_shell_command(self, command: str) -> bytes:
+        if command.startswith("log -t "):
+            _, _, tag, message = command.split(" ", 3)
+            self.write_log(tag, message)
+        return b""
+
+
+class TestPADBUtils(unittest.TestCase):
+    def test_logcat_record(self):
+        record = LogcatRecord.createRecordFromLine(3, "05-12 14:02:03.123  1234  1250 I talkback: TreeDebug: a: b")
+        self.assertEqual((3, "05-12 14:02:03.123", "talkback", "TreeDebug: a: b"), record[:4])
+        record = LogcatRecord.createRecordFromLine(4, "--------- beginning of main")
+        self.assertEqual(("", "--------- beginning of main"), (record.tag, record.message))
+
+    def test_execute_async_with_log(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            fake_logcat = FakeLogcat(server)
+            device = DeviceAsync(ClientAsync(port=server.port), "fake-device")
+
+            async def action(name: str, delay: float):
+                fake_logcat.write_log(BLIND_MONKEY_TAG, f"{name} started")
+                await asyncio.sleep(delay)
+                fake_logcat.write_log("talkback", f"TreeDebug: {name}")
+                fake_logcat.write_log("OTHER", f"{name} finished")
+                return name
+
+            try:
+                padb_logger = ParallelADBLogger(device)
+                reader = await get_logcat_reader(device).start()
+                fake_logcat.write_log(BLIND_MONKEY_TAG, "before")
+                log_map, result = await padb_logger.execute_async_with_log(action("first", 0))
+                self.assertEqual("first", result)
+                self.assertEqual([BLIND_MONKEY_TAG], list(log_map.keys()))
+                self.assertEqual(1, len(log_map[BLIND_MONKEY_TAG].split("\n")))
+                self.assertTrue(log_map[BLIND_MONKEY_TAG].endswith(f"{BLIND_MONKEY_TAG}: first started"))
+                # Several coroutines can be logged at the same time
+                (log_map_1, result_1), (log_map_2, result_2) = await asyncio.gather(
+                    padb_logger.execute_async_with_log(action("second", 0.2), tags=[TB_TREELIST_TAG, "OTHER"]),
+                    ParallelADBLogger(device).execute_async_with_log(action("third", 0)))
+                self.assertEqual(("second", "third"), (result_1, result_2))
+                self.assertIn("TreeDebug: second", log_map_1[TB_TREELIST_TAG])
+                self.assertIn("second finished", log_map_1["OTHER"])
+                self.assertIn("third started", log_map_2[BLIND_MONKEY_TAG])
+                self.assertNotIn("first", log_map_1[TB_TREELIST_TAG] + log_map_2[BLIND_MONKEY_TAG])
+                # The windows overlap, the logs of "third" are written while "second" is executed
+                self.assertEqual(["TreeDebug: third", "TreeDebug: second"],
+                                 [line.split(": ", 1)[1] for line in log_map_1[TB_TREELIST_TAG].split("\n")])
+                # Only the records with the exact tag (and the message prefix) are taken
+                start = await reader.mark()
+                for tag, message in [(BLIND_MONKEY_TAG, "exact"), (f"{BLIND_MONKEY_TAG}_CHANNEL", "channel"),
+                                     ("OTHER", f"{BLIND_MONKEY_TAG}: other"), ("talkback", "Other: TreeDebug:")]:
+                    fake_logcat.write_log(tag, message)
+                log_map = reader.window(start, await reader.mark()).get_log_map([BLIND_MONKEY_TAG, TB_TREELIST_TAG])
+                self.assertTrue(log_map[BLIND_MONKEY_TAG].endswith(f"{BLIND_MONKEY_TAG}: exact"))
+                self.assertEqual(1, len(log_map[BLIND_MONKEY_TAG].split("\n")))
+                self.assertEqual("", log_map[TB_TREELIST_TAG])
+                # The windows between markers, and the records of a tag
+                start = await reader.mark()
+                await action("fourth", 0)
+                end = await reader.mark()
+                window = reader.window(start, end)
+                self.assertEqual(["fourth started", "TreeDebug: fourth", "fourth finished"],
+                                 [record.message for record in window.records()])
+                self.assertEqual(["TreeDebug: fourth"], [record.message for record in window.records("talkback")])
+                self.assertEqual(["TreeDebug: first", "TreeDebug: third", "TreeDebug: second", "Other: TreeDebug:",
+                                  "TreeDebug: fourth"],
+                                 [record.message for record in reader.tag_records["talkback"]])
+                # The events logged right after the coroutine returns are in its window
+                async def action_with_late_event():
+                    asyncio.get_running_loop().call_later(0.1, fake_logcat.write_log,
+                                                          BLIND_MONKEY_EVENTS_TAG, "WindowContentChange: {}")
+                    return "late"
+
+                log_map, result = await padb_logger.execute_async_with_log(action_with_late_event(),
+                                                                           tags=[BLIND_MONKEY_EVENTS_TAG],
+                                                                           settle_time=0.3)
+                self.assertEqual("late", result)
+                self.assertTrue(log_map[BLIND_MONKEY_EVENTS_TAG].endswith("WindowContentChange: {}"))
+                # The failure of the coroutine
+                log_map, result = await padb_logger.execute_async_with_log(asyncio.sleep(-1, result=1 / 1))
+                self.assertEqual(1, result)
+                await reader.stop()
+                self.assertFalse(reader.is_running())
+            finally:
+                await server.stop()
+
+        asyncio.run(scenario())
@@ -0,0 +1,86 @@
+import asyncio
+import struct
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+from ppadb.client_async import ClientAsync
+from ppadb.device_async import DeviceAsync
+
+from screenshot_utils import decode_framebuffer, save_screenshot, open_screenshot
+from test.test_adb_transport import FakeADBServer
+
+
+def create_framebuffer(image: Image.Image, version: int = 2, bpp: int = 32) -> bytes:
+    # The header of RGBA_8888 pixels, i.e., red, blue, green, and alpha offsets and lengths
+    color_fields = [0, 8, 16, 8, 8, 8, 24, 8]
+    pixels = image.convert("RGBA").tobytes()
+    header = [version, bpp] + ([0] if version == 2 else []) + [len(pixels), image.width, image.height] + color_fields
+    return struct.pack(f"<{len(header)}I", *header) + pixels
+
+
+class TestScreenshotUtils(unittest.TestCase):
+    def test_decode_framebuffer(self):
+        image = Image.new("RGBA", (3, 2), (10, 20, 30, 255))
+        image.putpixel((1, 1), (200, 100, 50, 128))
+        self.assertEqual(image.tobytes(), decode_framebuffer(create_framebuffer(image)).tobytes())
+        self.assertEqual(image.tobytes(), decode_framebuffer(create_framebuffer(image, version=1)).tobytes())
+        # BGRX pixels
+        header = struct.pack("<13I", 1, 32, 8, 2, 1, 16, 8, 0, 8, 8, 8, 24, 0)
+        rgb_image = decode_framebuffer(header + bytes([30, 20, 10, 0, 50, 100, 200, 0]))
+        self.assertEqual("RGB", rgb_image.mode)
+        self.assertEqual([(10, 20, 30), (200, 100, 50)], list(rgb_image.getdata()))
+        with self.assertRaises(ValueError):
+            decode_framebuffer(create_framebuffer(image, bpp=16))
+        with self.assertRaises(ValueError):
+            decode_framebuffer(create_framebuffer(image)[:-1])
+
+    def test_save_screenshot(self):
+        async def scenario(directory: Path):
+            server = await FakeADBServer().start()
+            frames = []
+
+            async def framebuffer_service(reader, writer):
+                writer.write(frames.pop(0))
+                await writer.drain()
+
+            async def screencap_service(reader, writer):
+                writer.write(png_content)
+                await writer.drain()
+
+            server.services["framebuffer:"] = framebuffer_service
+            server.services["shell:/system/bin/screencap -p"] = screencap_service
+            device = DeviceAsync(ClientAsync(port=server.port), "fake-device")
+            image = Image.new("RGBA", (4, 4), (255, 0, 0, 255))
+            changed_image = image.copy()
+            changed_image.putpixel((0, 0), (0, 0, 255, 255))
+            buffer = BytesIO()
+            changed_image.save(buffer, format="PNG")
+            png_content = buffer.getvalue()
+            try:
+                frames.append(create_framebuffer(image))
+                saved_image = await save_screenshot(device, directory / "1.png")
+                self.assertEqual(image.tobytes(), saved_image.tobytes())
+                self.assertEqual(image.tobytes(), Image.open(directory / "1.png").tobytes())
+                # The identical frame is copied
+                frames.append(create_framebuffer(image))
+                await save_screenshot(device, directory / "2.png")
+                self.assertEqual((directory / "1.png").read_bytes(), (directory / "2.png").read_bytes())
+                # The device encodes the screenshot if the framebuffer is not supported
+                frames.append(create_framebuffer(image, bpp=16))
+                await save_screenshot(device, directory / "3.png")
+                self.assertEqual(png_content, (directory / "3.png").read_bytes())
+                # The decoded image is reused
+                opened_image = open_screenshot(directory / "3.png")
+                self.assertEqual(changed_image.tobytes(), opened_image.tobytes())
+                opened_image.putpixel((1, 1), (0, 0, 0, 0))
+                self.assertEqual(changed_image.tobytes(), open_screenshot(directory / "3.png").tobytes())
+                (directory / "4.png").write_bytes((directory / "1.png").read_bytes())
+                self.assertEqual(image.tobytes(), open_screenshot(directory / "4.png").convert("RGBA").tobytes())
+            finally:
+                await server.stop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(scenario(Path(directory)))
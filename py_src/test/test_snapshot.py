@@ -0,0 +1,134 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from ppadb.client_async import ClientAsync
+from ppadb.device_async import DeviceAsync
+
+import adb_transport
+import latte_channel
+from a11y_service import A11yServiceManager
+from adb_transport import DeviceShellPool
+from latte_channel import LatteChannel
+from latte_utils import get_latte_heartbeat
+from results_utils import AddressBook
+from snapshot import EmulatorSnapshot, Snapshot
+from snapshot_search import SnapshotSearchManager, SnapshotSearchQuery
+from test.test_a11y_service import FAKE_SETTINGS_SCRIPT
+from test.test_adb_transport import FakeADBServer
+from test.test_latte_channel import FakeLatte
+from test.test_nodes_factory import layout_str
+
+# The `getprop` and `dumpsys` commands of the device, their outputs are kept in files
+FAKE_GETPROP_SCRIPT = """#!/bin/sh
+cat "$(dirname "$0")/boot_completed" 2>/dev/null
+"""
+FAKE_DUMPSYS_SCRIPT = """#!/bin/sh
+echo "  mCurrentFocus=Window{$(cat "$(dirname "$0")/focus" 2>/dev/null || date +%N)}"
+echo "  mOtherWindow=Window{$(date +%N)}"
+"""
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_setup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            address_book = AddressBook(Path(directory) / "snapshot")
+            address_book.initiate()
+            layout_path = address_book.get_layout_path(AddressBook.BASE_MODE, AddressBook.INITIAL)
+            Path(layout_path).write_text(layout_str)
+            snapshot = Snapshot(address_book)
+            asyncio.run(snapshot.setup())
+            self.assertEqual(9, len(snapshot.nodes))
+            self.assertTrue(address_book.node_table_cache_path.exists())
+            # The nodes are loaded again (from the node table or the layout), and they are not shared
+            for remove_node_table in [False, True]:
+                if remove_node_table:
+                    address_book.node_table_cache_path.unlink()
+                other_snapshot = Snapshot(address_book)
+                asyncio.run(other_snapshot.setup())
+                self.assertEqual([node.toJSONStr() for node in snapshot.nodes],
+                                 [node.toJSONStr() for node in other_snapshot.nodes])
+                other_snapshot.nodes[0].text = "changed"
+                self.assertTrue(all(node is not other_node
+                                    for node, other_node in zip(snapshot.nodes, other_snapshot.nodes)))
+                self.assertNotEqual("changed", snapshot.nodes[0].text)
+                self.assertEqual(layout_str, other_snapshot.initial_layout)
+
+    def test_search(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (Path(directory) / "app").mkdir()
+            for i in range(6):
+                address_book = AddressBook(Path(directory) / "app" / f"snapshot_{i}")
+                address_book.initiate()
+                layout_path = address_book.get_layout_path(AddressBook.BASE_MODE, AddressBook.INITIAL)
+                Path(layout_path).write_text(layout_str if i % 2 == 0 else layout_str.replace('text="OK"', ''))
+            search_manager = SnapshotSearchManager(Path(directory))
+            # The first snapshots (by their paths) are returned, regardless of the order of ingestion
+            for processes in [1, 3]:
+                snapshots = search_manager.search(SnapshotSearchQuery().contains_node(['text'], ['OK']),
+                                                  snapshot_limit=2,
+                                                  processes=processes)
+                self.assertEqual(["snapshot_0", "snapshot_2"], [snapshot.name for snapshot in snapshots])
+
+
+class TestEmulatorSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.bin_dir = Path(self.directory.name) / "bin"
+        self.bin_dir.mkdir()
+        for name, script in [("settings", FAKE_SETTINGS_SCRIPT),
+                             ("getprop", FAKE_GETPROP_SCRIPT),
+                             ("dumpsys", FAKE_DUMPSYS_SCRIPT)]:
+            (self.bin_dir / name).write_text(script)
+            (self.bin_dir / name).chmod(0o755)
+        self.original_path = os.environ["PATH"]
+        os.environ["PATH"] = f"{self.bin_dir}{os.pathsep}{self.original_path}"
+        A11yServiceManager.invalidate("fake-device")
+
+    def tearDown(self):
+        os.environ["PATH"] = self.original_path
+        A11yServiceManager.invalidate("fake-device")
+        self.directory.cleanup()
+
+    def test_wait_until_ready(self):
+        async def scenario():
+            server = await FakeADBServer().start()
+            server.services["tcp:8712"] = FakeLatte().handle_connection
+            loop = asyncio.get_running_loop()
+            pool = DeviceShellPool("fake-device", adb_port=server.port)
+            channel = LatteChannel("fake-device", adb_port=server.port, device_port=8712)
+            adb_transport._shell_pools.setdefault(loop, {})["fake-device"] = pool
+            latte_channel._latte_channels.setdefault(loop, {})["fake-device"] = channel
+            device = DeviceAsync(ClientAsync(port=server.port), "fake-device")
+            snapshot = EmulatorSnapshot(AddressBook(Path(self.directory.name) / "snapshot"), device=device)
+
+            async def boot_later():
+                await asyncio.sleep(0.3)
+                (self.bin_dir / "boot_completed").write_text("1\n")
+
+            try:
+                (self.bin_dir / "value").write_text(f"{A11yServiceManager.services['latte']}\n")
+                (self.bin_dir / "focus").write_text("com.example/.MainActivity\n")
+                timings = {}
+                is_ready, _ = await asyncio.gather(snapshot.wait_until_ready(timeout=2, timings=timings),
+                                                   boot_later())
+                self.assertTrue(is_ready)
+                self.assertEqual(['boot', 'latte', 'windows'], list(timings.keys()))
+                self.assertGreater(timings['boot'], 0.2)
+                self.assertLess(sum(timings.values()), 2)
+                self.assertTrue(get_latte_heartbeat("fake-device").is_healthy())
+                # The focused window is changed in every poll
+                (self.bin_dir / "focus").unlink()
+                self.assertFalse(await snapshot.wait_until_ready(timeout=0.3))
+                snapshot.reload_latencies = [{'load': 1, 'total': 2}, {'load': 3, 'total': 4}, {'load': 2, 'total': 3}]
+                self.assertEqual({'count': 3, 'mean_time': 2, 'median_time': 2, 'p90_time': 3, 'max_time': 3},
+                                 snapshot.reload_latency_summary()['load'])
+            finally:
+                await get_latte_heartbeat("fake-device").stop()
+                await channel.close()
+                await pool.close()
+                await server.stop()
+
+        asyncio.run(scenario())
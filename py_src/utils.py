@@ -5,6 +5,7 @@ from pathlib import Path
 from PIL import Image, ImageDraw
 
 from GUI_utils import Node
+from screenshot_utils import open_screenshot
 
 logger = logging.getLogger(__name__)
 
@@ -85,7 +86,7 @@ def annotate_rectangle(source_img,
 
     im = None
     try:
-        im = Image.open(source_img)
+        im = open_screenshot(source_img)
         draw = ImageDraw.Draw(im)
         # draw.rectangle(reg_result.bound, fill=(255, 255, 0, 20), outline=(100, 100, 100))
         for bound, o, w, s in zip(bounds, outline, width, scale):
@@ -172,7 +173,7 @@ def create_gif(source_images: List[Union[str, Path]],
             if isinstance(src_image, Path):
                 src_image = src_image.resolve()
             if src_image not in image_to_nodes:
-                images.append(Image.open(src_image))
+                images.append(open_screenshot(src_image))
             else:
                 for node in image_to_nodes[src_image]:
                     if node is None:
@@ -17,6 +17,7 @@ from app import App
 from command import create_command_from_dict, LocatableCommand
 from consts import BLIND_MONKEY_EVENTS_TAG
 from data_utils import RecordDataManager, A11yReportManager
+from GUI_utils import diff_layout_paths
 from snapshot_search import SnapshotSearchManager, SnapshotSearchQuery
 
 sys.path.append(str(pathlib.Path(__file__).parent.resolve()))
@@ -470,7 +471,10 @@ def xml_diff_v2(result_path, app_name, snapshot_name, index, sighted_str, left_m
     right_xml_path = address_book.get_layout_path(f'{prefix}{right_mode}', index)
     cmd = f"diff --unified {left_xml_path} {right_xml_path}"
     diff_string = subprocess.run(cmd.split(), stdout=subprocess.PIPE).stdout.decode('utf-8')
-    return render_template('xml_diff.html', diff_string=[diff_string])
+    layout_diff = None
+    if left_xml_path.exists() and right_xml_path.exists():
+        layout_diff = diff_layout_paths(left_xml_path, right_xml_path)
+    return render_template('xml_diff.html', diff_string=[diff_string], layout_diff=layout_diff)
 
 
 # @flask_app.route("/v2/<result_path>/app/<app_name>/post_analysis")